@@ -11,6 +11,7 @@ from .models import Region, District, Municipality, Neighbourhood
 
 
 class GeounitsSheet(Sheet):
+    bulk_save = True
 
     def merge_duplicate_rows(self, rows, check_columns=None):
         errors = 0
@@ -184,6 +185,7 @@ class NeighbourhoodSheet(GeounitsSheet):
     label = u'REGPJ'
     model = Neighbourhood
     ignore_superfluous_columns = True
+    incremental = True
 
     columns = Columns(
             # {{{
@@ -5,7 +5,7 @@ from django.db.models import Q, F
 
 from poleno import datacheck
 from poleno.utils.models import QuerySet
-from poleno.utils.misc import FormatMixin, squeeze, decorate, slugify
+from poleno.utils.misc import FormatMixin, squeeze, slugify
 
 
 class RegionQuerySet(QuerySet):
@@ -52,16 +52,15 @@ class Region(FormatMixin, models.Model): # "Kraj"
 
     objects = RegionQuerySet.as_manager()
 
-    @decorate(prevent_bulk_create=True)
-    def save(self, *args, **kwargs):
-        update_fields = kwargs.get(u'update_fields', None)
-
+    def prepare_save(self, update_fields=None):
         # Generate and save slug if saving name
         if update_fields is None or u'name' in update_fields:
             self.slug = slugify(self.name)
             if update_fields is not None:
                 update_fields.append(u'slug')
 
+    def save(self, *args, **kwargs):
+        self.prepare_save(kwargs.get(u'update_fields', None))
         super(Region, self).save(*args, **kwargs)
 
     def __unicode__(self):
@@ -118,16 +117,15 @@ class District(FormatMixin, models.Model): # "Okres"
 
     objects = DistrictQuerySet.as_manager()
 
-    @decorate(prevent_bulk_create=True)
-    def save(self, *args, **kwargs):
-        update_fields = kwargs.get(u'update_fields', None)
-
+    def prepare_save(self, update_fields=None):
         # Generate and save slug if saving name
         if update_fields is None or u'name' in update_fields:
             self.slug = slugify(self.name)
             if update_fields is not None:
                 update_fields.append(u'slug')
 
+    def save(self, *args, **kwargs):
+        self.prepare_save(kwargs.get(u'update_fields', None))
         super(District, self).save(*args, **kwargs)
 
     def __unicode__(self):
@@ -187,16 +185,15 @@ class Municipality(FormatMixin, models.Model): # "Obec"
 
     objects = MunicipalityQuerySet.as_manager()
 
-    @decorate(prevent_bulk_create=True)
-    def save(self, *args, **kwargs):
-        update_fields = kwargs.get(u'update_fields', None)
-
+    def prepare_save(self, update_fields=None):
         # Generate and save slug if saving name
         if update_fields is None or u'name' in update_fields:
             self.slug = slugify(self.name)
             if update_fields is not None:
                 update_fields.append(u'slug')
 
+    def save(self, *args, **kwargs):
+        self.prepare_save(kwargs.get(u'update_fields', None))
         super(Municipality, self).save(*args, **kwargs)
 
     def __unicode__(self):
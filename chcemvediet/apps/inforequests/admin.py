@@ -255,6 +255,9 @@ class ActionAdmin(admin.ModelAdmin):
     exclude = [
             ]
     readonly_fields = [
+            u'deadline_type',
+            u'deadline_date',
+            u'snooze_date',
             ]
     raw_id_fields = [
             u'branch',
@@ -1,11 +1,13 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+import datetime
 import traceback
 
 from django.db import transaction
+from django.db.models import Q
 from django.conf import settings
 
-from poleno.cron import cron_job, cron_logger
+from poleno.cron import cron_job, cron_logger, CronSweep
 from poleno.workdays import workdays
 from poleno.utils.translation import translation
 from poleno.utils.date import local_date, local_today
@@ -14,44 +16,67 @@ from poleno.utils.misc import nop
 from .models import Inforequest, Branch, Action
 
 
+def _inforequests():
+    return (Inforequest.objects
+            .prefetch_related(Inforequest.prefetch_branches())
+            .prefetch_related(Branch.prefetch_last_action(u'branches'))
+            .prefetch_related(Inforequest.prefetch_newest_undecided_email())
+            )
+
+# Not closed inforequests are loaded once per cron slot and shared by all jobs run in the slot.
+user_interaction_sweep = CronSweep(settings.CRON_USER_INTERACTION_TIMES, _inforequests)
+important_maintenance_sweep = CronSweep(settings.CRON_IMPORTANT_MAINTENANCE_TIMES, _inforequests)
+
+
+def _should_send_undecided_email_reminder(inforequest):
+    try:
+        email = inforequest.newest_undecided_email
+        if email is None:
+            return False
+        last = inforequest.last_undecided_email_reminder
+        if last and last > email.processed:
+            return False
+        days = workdays.between(local_date(email.processed), local_today())
+        if days < 5:
+            return False
+        return True
+    except Exception:
+        msg = u'Checking if undecided email reminder should be sent failed: {}\n{}'
+        trace = unicode(traceback.format_exc(), u'utf-8')
+        cron_logger.error(msg.format(inforequest, trace))
+        return False
+
+user_interaction_sweep.register(u'undecided_email_reminder',
+        lambda: (Inforequest.objects
+            .not_closed()
+            .with_undecided_email()
+            .values_list(u'pk', flat=True)
+            ),
+        lambda inforequest: [inforequest.pk]
+            if _should_send_undecided_email_reminder(inforequest) else [],
+        )
+
 @cron_job(run_at_times=settings.CRON_USER_INTERACTION_TIMES)
 @transaction.atomic
 def undecided_email_reminder():
     with translation(settings.LANGUAGE_CODE):
-        inforequests = (Inforequest.objects
-                .not_closed()
-                .with_undecided_email()
-                .prefetch_related(Inforequest.prefetch_newest_undecided_email())
-                )
-
-        filtered = []
-        for inforequest in inforequests:
-            try:
-                email = inforequest.newest_undecided_email
-                last = inforequest.last_undecided_email_reminder
-                if last and last > email.processed:
-                    continue
-                days = workdays.between(local_date(email.processed), local_today())
-                if days < 5:
-                    continue
-                filtered.append(inforequest)
-            except Exception:
-                msg = u'Checking if undecided email reminder should be sent failed: {}\n{}'
-                trace = unicode(traceback.format_exc(), u'utf-8')
-                cron_logger.error(msg.format(inforequest, trace))
-
-        if not filtered:
+        matched = user_interaction_sweep.matched(u'undecided_email_reminder')
+        if not matched:
             return
 
-        filtered = (Inforequest.objects
+        inforequests = (Inforequest.objects
+                .not_closed()
                 .select_related(u'applicant')
                 .select_undecided_emails_count()
                 .prefetch_related(Inforequest.prefetch_main_branch(None,
                     Branch.objects.select_related(u'historicalobligee')))
                 .prefetch_related(Inforequest.prefetch_newest_undecided_email())
-                .filter(pk__in=(o.pk for o in filtered))
+                .chunked(pks=matched)
                 )
-        for inforequest in filtered:
+        for inforequest in inforequests:
+            # Jobs run before in the same cron slot may have changed the inforequest.
+            if not _should_send_undecided_email_reminder(inforequest):
+                continue
             try:
                 with transaction.atomic():
                     inforequest.send_undecided_email_reminder()
@@ -61,47 +86,61 @@ def undecided_email_reminder():
                 trace = unicode(traceback.format_exc(), u'utf-8')
                 cron_logger.error(msg.format(inforequest, trace))
 
+
+def _should_send_obligee_deadline_reminder(action):
+    try:
+        if not action.has_obligee_deadline_snooze_missed:
+            return False
+        # The last reminder was sent after the applicant snoozed for the last time iff the snooze
+        # was missed before the reminder was sent. We don't want to send any more reminders if the
+        # last reminder was sent after the last snooze.
+        last = action.last_deadline_reminder
+        last_date = local_date(last) if last else None
+        if last and action.deadline.is_snooze_missed_at(last_date):
+            return False
+        return True
+    except Exception:
+        msg = u'Checking if obligee deadline reminder should be sent failed: {}\n{}'
+        trace = unicode(traceback.format_exc(), u'utf-8')
+        cron_logger.error(msg.format(action, trace))
+        return False
+
+user_interaction_sweep.register(u'obligee_deadline_reminder',
+        # Candidates are selected by persisted deadline fields of branch last actions. The precise
+        # conditions are checked using ``Action.deadline``.
+        lambda: (Action.objects
+            .last_in_branch()
+            .obligee_deadlines()
+            .snooze_before(local_today())
+            .filter(branch__inforequest__closed=False)
+            .values_list(u'branch__inforequest', flat=True)
+            ),
+        lambda inforequest: [b.pk for b in inforequest.branches
+            if inforequest.newest_undecided_email is None
+            and _should_send_obligee_deadline_reminder(b.last_action)],
+        )
+
 @cron_job(run_at_times=settings.CRON_USER_INTERACTION_TIMES)
 @transaction.atomic
 def obligee_deadline_reminder():
     with translation(settings.LANGUAGE_CODE):
-        inforequests = (Inforequest.objects
-                .not_closed()
-                .without_undecided_email()
-                .prefetch_related(Inforequest.prefetch_branches())
-                .prefetch_related(Branch.prefetch_last_action(u'branches'))
-                )
-
-        filtered = []
-        for inforequest in inforequests:
-            for branch in inforequest.branches:
-                action = branch.last_action
-                try:
-                    if not action.has_obligee_deadline_snooze_missed:
-                        continue
-                    # The last reminder was sent after the applicant snoozed for the last time iff
-                    # the snooze was missed before the reminder was sent. We don't want to send any
-                    # more reminders if the last reminder was sent after the last snooze.
-                    last = action.last_deadline_reminder
-                    last_date = local_date(last) if last else None
-                    if last and action.deadline.is_snooze_missed_at(last_date):
-                        continue
-                    filtered.append(branch)
-                except Exception:
-                    msg = u'Checking if obligee deadline reminder should be sent failed: {}\n{}'
-                    trace = unicode(traceback.format_exc(), u'utf-8')
-                    cron_logger.error(msg.format(action, trace))
-
-        if not filtered:
+        matched = user_interaction_sweep.matched(u'obligee_deadline_reminder')
+        if not matched:
             return
 
-        filtered = (Branch.objects
+        branches = (Branch.objects
+                .filter(inforequest__in=Inforequest.objects
+                    .not_closed()
+                    .without_undecided_email())
                 .select_related(u'inforequest__applicant')
                 .select_related(u'historicalobligee')
                 .prefetch_related(Branch.prefetch_last_action())
-                .filter(pk__in=(o.pk for o in filtered))
+                .chunked(pks=matched)
                 )
-        for branch in filtered:
+        for branch in branches:
+            # Jobs run before in the same cron slot may have changed the branch.
+            if not _should_send_obligee_deadline_reminder(branch.last_action):
+                continue
             try:
                 with transaction.atomic():
                     branch.inforequest.send_obligee_deadline_reminder(branch.last_action)
@@ -112,46 +151,61 @@ def obligee_deadline_reminder():
                 trace = unicode(traceback.format_exc(), u'utf-8')
                 cron_logger.error(msg.format(branch.last_action, trace))
 
+
+def _should_send_applicant_deadline_reminder(action):
+    try:
+        if not action.has_applicant_deadline:
+            return False
+        # The reminder is sent 2 CD before the deadline is missed.
+        if action.deadline.calendar_days_remaining > 2:
+            return False
+        # Applicant may not snooze his deadlines, so we send at most one applicant deadline
+        # reminder for the action.
+        if action.last_deadline_reminder:
+            return False
+        return True
+    except Exception:
+        msg = u'Checking if applicant deadline reminder should be sent failed: {}\n{}'
+        trace = unicode(traceback.format_exc(), u'utf-8')
+        cron_logger.error(msg.format(action, trace))
+        return False
+
+user_interaction_sweep.register(u'applicant_deadline_reminder',
+        # Candidates are selected by persisted deadline fields of branch last actions. The precise
+        # conditions are checked using ``Action.deadline``.
+        lambda: (Action.objects
+            .last_in_branch()
+            .applicant_deadlines()
+            .deadline_before(local_today() + datetime.timedelta(days=3))
+            .filter(last_deadline_reminder__isnull=True)
+            .filter(branch__inforequest__closed=False)
+            .values_list(u'branch__inforequest', flat=True)
+            ),
+        lambda inforequest: [b.pk for b in inforequest.branches
+            if inforequest.newest_undecided_email is None
+            and _should_send_applicant_deadline_reminder(b.last_action)],
+        )
+
 @cron_job(run_at_times=settings.CRON_USER_INTERACTION_TIMES)
 @transaction.atomic
 def applicant_deadline_reminder():
     with translation(settings.LANGUAGE_CODE):
-        inforequests = (Inforequest.objects
-                .not_closed()
-                .without_undecided_email()
-                .prefetch_related(Inforequest.prefetch_branches())
-                .prefetch_related(Branch.prefetch_last_action(u'branches'))
-                )
-
-        filtered = []
-        for inforequest in inforequests:
-            for branch in inforequest.branches:
-                action = branch.last_action
-                try:
-                    if not action.has_applicant_deadline:
-                        continue
-                    # The reminder is sent 2 CD before the deadline is missed.
-                    if action.deadline.calendar_days_remaining > 2:
-                        continue
-                    # Applicant may not snooze his deadlines, so we send at most one applicant
-                    # deadline reminder for the action.
-                    if action.last_deadline_reminder:
-                        continue
-                    filtered.append(branch)
-                except Exception:
-                    msg = u'Checking if applicant deadline reminder should be sent failed: {}\n{}'
-                    trace = unicode(traceback.format_exc(), u'utf-8')
-                    cron_logger.error(msg.format(action, trace))
-
-        if not filtered:
+        matched = user_interaction_sweep.matched(u'applicant_deadline_reminder')
+        if not matched:
             return
 
-        filtered = (Branch.objects
+        branches = (Branch.objects
+                .filter(inforequest__in=Inforequest.objects
+                    .not_closed()
+                    .without_undecided_email())
                 .select_related(u'inforequest__applicant')
                 .prefetch_related(Branch.prefetch_last_action())
-                .filter(pk__in=(o.pk for o in filtered))
+                .chunked(pks=matched)
                 )
-        for branch in filtered:
+        for branch in branches:
+            # Jobs run before in the same cron slot may have changed the branch.
+            if not _should_send_applicant_deadline_reminder(branch.last_action):
+                continue
             try:
                 with transaction.atomic():
                     branch.inforequest.send_applicant_deadline_reminder(branch.last_action)
@@ -162,31 +216,53 @@ def applicant_deadline_reminder():
                 trace = unicode(traceback.format_exc(), u'utf-8')
                 cron_logger.error(msg.format(branch.last_action, trace))
 
+
+def _should_close_inforequest(inforequest):
+    try:
+        for branch in inforequest.branches:
+            action = branch.last_action
+            if action.deadline and action.deadline.snooze_calendar_days_behind < 100:
+                return False
+        # Every branch that has a deadline have been missed for at least 100 WD.
+        return True
+    except Exception:
+        msg = u'Checking if inforequest should be closed failed: {}\n{}'
+        trace = unicode(traceback.format_exc(), u'utf-8')
+        cron_logger.error(msg.format(inforequest, trace))
+        return False
+
+important_maintenance_sweep.register(u'close_inforequests',
+        # Only inforequests with a branch which last action has no deadline or has the deadline
+        # missed for at least 100 CD may be closed. The precise conditions are checked using
+        # ``Action.deadline``.
+        lambda: (Action.objects
+            .last_in_branch()
+            .filter(branch__inforequest__closed=False)
+            .filter(Q(deadline_type__isnull=True)
+                | Q(snooze_date__lte=local_today() - datetime.timedelta(days=100)))
+            .values_list(u'branch__inforequest', flat=True)
+            ),
+        lambda inforequest: [inforequest.pk]
+            if _should_close_inforequest(inforequest) else [],
+        )
+
 @cron_job(run_at_times=settings.CRON_IMPORTANT_MAINTENANCE_TIMES)
 @transaction.atomic
 def close_inforequests():
+    matched = important_maintenance_sweep.matched(u'close_inforequests')
+    if not matched:
+        return
+
     inforequests = (Inforequest.objects
             .not_closed()
             .prefetch_related(Inforequest.prefetch_branches())
             .prefetch_related(Branch.prefetch_last_action(u'branches'))
+            .chunked(pks=matched)
             )
-
-    filtered = []
     for inforequest in inforequests:
-        try:
-            for branch in inforequest.branches:
-                action = branch.last_action
-                if action.deadline and action.deadline.snooze_calendar_days_behind < 100:
-                    break
-            else:
-                # Every branch that has a deadline have been missed for at least 100 WD.
-                filtered.append(inforequest)
-        except Exception:
-            msg = u'Checking if inforequest should be closed failed: {}\n{}'
-            trace = unicode(traceback.format_exc(), u'utf-8')
-            cron_logger.error(msg.format(inforequest, trace))
-
-    for inforequest in filtered:
+        # Jobs run before in the same cron slot may have changed the inforequest.
+        if not _should_close_inforequest(inforequest):
+            continue
         try:
             with transaction.atomic():
                 for branch in inforequest.branches:
@@ -199,36 +275,57 @@ def close_inforequests():
             trace = unicode(traceback.format_exc(), u'utf-8')
             cron_logger.error(msg.format(inforequest, trace))
 
+
+def _should_add_expiration(action):
+    try:
+        if not action.has_obligee_deadline_snooze_missed:
+            return False
+        if action.deadline.calendar_days_behind <= 8:
+            return False
+        # The last action obligee deadline was missed more than 8 calendar days ago. The applicant
+        # may snooze for at most 8 calendar days. So it's safe to add expiration now. The
+        # expiration action has 15 calendar days deadline of which about half is still left.
+        return True
+    except Exception:
+        msg = u'Checking if expiration action should be added failed: {}\n{}'
+        trace = unicode(traceback.format_exc(), u'utf-8')
+        cron_logger.error(msg.format(action, trace))
+        return False
+
+important_maintenance_sweep.register(u'add_expirations',
+        # Candidates are selected by persisted deadline fields of branch last actions. The precise
+        # conditions are checked using ``Action.deadline``.
+        lambda: (Action.objects
+            .last_in_branch()
+            .obligee_deadlines()
+            .snooze_before(local_today())
+            .deadline_before(local_today() - datetime.timedelta(days=8))
+            .filter(branch__inforequest__closed=False)
+            .values_list(u'branch__inforequest', flat=True)
+            ),
+        lambda inforequest: [b.pk for b in inforequest.branches
+            if inforequest.newest_undecided_email is None
+            and _should_add_expiration(b.last_action)],
+        )
+
 @cron_job(run_at_times=settings.CRON_IMPORTANT_MAINTENANCE_TIMES)
 @transaction.atomic
 def add_expirations():
-    inforequests = (Inforequest.objects
-            .not_closed()
-            .without_undecided_email()
-            .prefetch_related(Inforequest.prefetch_branches())
-            .prefetch_related(Branch.prefetch_last_action(u'branches'))
-            )
+    matched = important_maintenance_sweep.matched(u'add_expirations')
+    if not matched:
+        return
 
-    filtered = []
-    for inforequest in inforequests:
-        for branch in inforequest.branches:
-            try:
-                action = branch.last_action
-                if not action.has_obligee_deadline_snooze_missed:
-                    continue
-                if action.deadline.calendar_days_behind <= 8:
-                    continue
-                # The last action obligee deadline was missed more than 8 calendar days ago. The
-                # applicant may snooze for at most 8 calendar days. So it's safe to add expiration
-                # now. The expiration action has 15 calendar days deadline of which about half is
-                # still left.
-                filtered.append(branch)
-            except Exception:
-                msg = u'Checking if expiration action should be added failed: {}\n{}'
-                trace = unicode(traceback.format_exc(), u'utf-8')
-                cron_logger.error(msg.format(branch, trace))
-
-    for branch in filtered:
+    branches = (Branch.objects
+            .filter(inforequest__in=Inforequest.objects
+                .not_closed()
+                .without_undecided_email())
+            .prefetch_related(Branch.prefetch_last_action())
+            .chunked(pks=matched)
+            )
+    for branch in branches:
+        # Jobs run before in the same cron slot may have changed the branch.
+        if not _should_add_expiration(branch.last_action):
+            continue
         try:
             with transaction.atomic():
                 branch.add_expiration_if_expired()
@@ -0,0 +1,33 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from poleno.utils.misc import squeeze
+
+from ...models import Branch, Action
+
+
+class Command(NoArgsCommand):
+    help = squeeze(u"""
+            Recomputes deadline fields of all actions. Use it to backfill ``deadline_type``,
+            ``deadline_date`` and ``snooze_date`` fields of existing actions.
+            """)
+
+    @transaction.atomic
+    def handle_noargs(self, **options):
+        branches = Branch.objects.prefetch_related(Branch.prefetch_actions())
+
+        updated = 0
+        for branch in branches:
+            previous = None
+            for action in branch.actions:
+                # Actions are ordered chronologically, so the previous action is already updated.
+                action.branch = branch
+                action.previous_action = previous
+                if action.update_deadline_fields():
+                    action.save(update_fields=list(Action.DEADLINE_FIELDS))
+                    updated += 1
+                previous = action
+
+        self.stdout.write(u'Updated deadlines of {} actions.'.format(updated))
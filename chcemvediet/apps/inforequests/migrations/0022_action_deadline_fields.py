@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inforequests', '0021_auto_20151213_0838'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='action',
+            name='deadline_date',
+            field=models.DateField(help_text='The last day of the action deadline. Computed automatically when the action is saved. NULL if the action has no deadline.', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='action',
+            name='deadline_type',
+            field=models.SmallIntegerField(blank=True, help_text='Type of the action deadline. Computed automatically when the action is saved. NULL if the action has no deadline.', null=True, choices=[(1, 'Obligee Deadline'), (2, 'Applicant Deadline')]),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='action',
+            name='snooze_date',
+            field=models.DateField(help_text='The last day of the action deadline including the applicant snooze. Computed automatically when the action is saved. NULL if the action has no deadline.', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AlterIndexTogether(
+            name='action',
+            index_together=set([('created', 'id'), ('deadline_type', 'snooze_date'), ('deadline_type', 'deadline_date')]),
+        ),
+    ]
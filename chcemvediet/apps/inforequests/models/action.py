@@ -3,7 +3,7 @@
 from email.utils import formataddr
 
 from django.core.mail import EmailMessage
-from django.db import models
+from django.db import models, connection
 from django.db.models import Prefetch, Q, F
 from django.utils.translation import ugettext_lazy as _
 from django.utils.functional import cached_property
@@ -75,6 +75,37 @@ class ActionQuerySet(QuerySet):
         return self.filter(Q(created__lt=other.created) | Q(created=other.created, pk__lt=other.pk))
     def after(self, other):
         return self.filter(Q(created__gt=other.created) | Q(created=other.created, pk__gt=other.pk))
+    def last_in_branch(self):
+        u"""
+        Restricts the queryset to actions that are the last actions of their branches.
+        """
+        quote_name = connection.ops.quote_name
+        return self.extra(where=[
+            u'{action}.{pk} = ('
+                u'SELECT p.{pk} '
+                u'FROM {action} p '
+                u'WHERE p.{branch} = {action}.{branch} '
+                u'ORDER BY p.{created} DESC, p.{pk} DESC '
+                u'LIMIT 1'
+            u')'.format(
+                action = quote_name(Action._meta.db_table),
+                pk = quote_name(Action._meta.pk.column),
+                branch = quote_name(Action._meta.get_field(u'branch').column),
+                created = quote_name(Action._meta.get_field(u'created').column),
+                )
+            ])
+
+    # Deadline methods; Based on persisted ``deadline_type``, ``deadline_date`` and ``snooze_date``
+    def with_deadline(self):
+        return self.filter(deadline_type__isnull=False)
+    def obligee_deadlines(self):
+        return self.filter(deadline_type=Action.DEADLINE_TYPES.OBLIGEE_DEADLINE)
+    def applicant_deadlines(self):
+        return self.filter(deadline_type=Action.DEADLINE_TYPES.APPLICANT_DEADLINE)
+    def deadline_before(self, date):
+        return self.filter(deadline_date__lt=date)
+    def snooze_before(self, date):
+        return self.filter(snooze_date__lt=date)
 
 class Action(FormatMixin, models.Model):
     # NOT NULL
@@ -259,6 +290,47 @@ class Action(FormatMixin, models.Model):
     # May be NULL; Used by ``cron.obligee_deadline_reminder`` and ``cron.applicant_deadline_reminder``
     last_deadline_reminder = models.DateTimeField(blank=True, null=True)
 
+    # NOT NULL for actions with deadline; NULL otherwise; Denormalized ``Action.deadline`` computed
+    # in save(); Used by cron jobs to select actions with missed or approaching deadlines
+    DEADLINE_TYPES = FieldChoices(
+            (u'OBLIGEE_DEADLINE',   1, u'Obligee Deadline'),
+            (u'APPLICANT_DEADLINE', 2, u'Applicant Deadline'),
+            )
+    deadline_type = models.SmallIntegerField(choices=DEADLINE_TYPES._choices,
+            blank=True, null=True,
+            help_text=squeeze(u"""
+                Type of the action deadline. Computed automatically when the action is saved. NULL
+                if the action has no deadline.
+                """))
+    deadline_date = models.DateField(blank=True, null=True,
+            help_text=squeeze(u"""
+                The last day of the action deadline. Computed automatically when the action is
+                saved. NULL if the action has no deadline.
+                """))
+    snooze_date = models.DateField(blank=True, null=True,
+            help_text=squeeze(u"""
+                The last day of the action deadline including the applicant snooze. Computed
+                automatically when the action is saved. NULL if the action has no deadline.
+                """))
+
+    # Fields the deadline columns are computed from
+    DEADLINE_SOURCE_FIELDS = (
+            u'branch',
+            u'type',
+            u'created',
+            u'sent_date',
+            u'delivered_date',
+            u'legal_date',
+            u'extension',
+            u'snooze',
+            u'disclosure_level',
+            )
+    DEADLINE_FIELDS = (
+            u'deadline_type',
+            u'deadline_date',
+            u'snooze_date',
+            )
+
     # Backward relations:
     #
     #  -- advanced_to_set: by Branch.advanced_by
@@ -274,15 +346,19 @@ class Action(FormatMixin, models.Model):
     #     May raise DoesNotExist
 
     # Indexes:
-    #  -- branch:      ForeignKey
-    #  -- email:       OneToOneField
-    #  -- created, id: index_together
+    #  -- branch:                       ForeignKey
+    #  -- email:                        OneToOneField
+    #  -- created, id:                  index_together
+    #  -- deadline_type, deadline_date: index_together
+    #  -- deadline_type, snooze_date:   index_together
 
     objects = ActionQuerySet.as_manager()
 
     class Meta:
         index_together = [
                 [u'created', u'id'],
+                [u'deadline_type', u'deadline_date'],
+                [u'deadline_type', u'snooze_date'],
                 ]
 
     @staticmethod
@@ -305,7 +381,11 @@ class Action(FormatMixin, models.Model):
 
     @cached_property
     def previous_action(self):
-        return self.branch.action_set.order_by_created().before(self).last()
+        actions = self.branch.action_set.order_by_created()
+        if self.pk is None:
+            # New actions are ordered after all saved actions created at the same time
+            return actions.filter(created__lte=self.created).last()
+        return actions.before(self).last()
 
     @cached_property
     def next_action(self):
@@ -364,6 +444,9 @@ class Action(FormatMixin, models.Model):
 
     @cached_property
     def deadline(self):
+        return self._compute_deadline()
+
+    def _compute_deadline(self):
 
         # Applicant actions
         if self.type == self.TYPES.REQUEST:
@@ -440,6 +523,36 @@ class Action(FormatMixin, models.Model):
 
         raise ValueError(u'Invalid action type: {}'.format(self.type))
 
+    def update_deadline_fields(self):
+        u"""
+        Recomputes the action deadline and stores it in ``deadline_type``, ``deadline_date`` and
+        ``snooze_date`` fields. Returns True if any of the fields changed. Called automatically by
+        ``save()``, so there is no need to call it explicitly except for backfilling.
+        """
+        deadline = self._compute_deadline()
+        self.__dict__[u'deadline'] = deadline
+        if deadline is None:
+            values = (None, None, None)
+        else:
+            values = (deadline.type, deadline.deadline_date, deadline.snooze_date)
+        changed = values != tuple(getattr(self, f) for f in self.DEADLINE_FIELDS)
+        self.deadline_type, self.deadline_date, self.snooze_date = values
+        return changed
+
+    def _update_following_deadlines(self):
+        u"""
+        CONFIRMATION and EXTENSION actions inherit their deadline from the previous action. If the
+        deadline of this action changed, the deadlines of such following actions must be updated
+        as well. Their ``save()`` continues with the actions following them.
+        """
+        following = self.next_action
+        if following is None:
+            return
+        if following.type not in [self.TYPES.CONFIRMATION, self.TYPES.EXTENSION]:
+            return
+        following.previous_action = self
+        following.save()
+
     @classmethod
     def create(cls, *args, **kwargs):
         advanced_to = kwargs.pop(u'advanced_to', None) or []
@@ -468,6 +581,23 @@ class Action(FormatMixin, models.Model):
 
         return action
 
+    @decorate(prevent_bulk_create=True)
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get(u'update_fields', None)
+
+        # Compute and save deadline fields if saving any field the deadline depends on
+        changed = False
+        if update_fields is None or set(update_fields) & set(self.DEADLINE_SOURCE_FIELDS):
+            changed = self.update_deadline_fields()
+            if update_fields is not None:
+                kwargs[u'update_fields'] = list(update_fields) + [
+                        f for f in self.DEADLINE_FIELDS if f not in update_fields]
+
+        super(Action, self).save(*args, **kwargs)
+
+        if changed:
+            self._update_following_deadlines()
+
     def get_extended_type_display(self):
         u"""
         Return a bit more verbose action type description. It is not based only on the action type.
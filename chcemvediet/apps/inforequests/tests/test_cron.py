@@ -14,10 +14,16 @@ from poleno.utils.test import created_instances
 
 from . import InforequestsTestCaseMixin
 from ..cron import undecided_email_reminder, obligee_deadline_reminder, applicant_deadline_reminder, close_inforequests
+from ..cron import user_interaction_sweep, important_maintenance_sweep
 from ..models import Inforequest, Action
 
 class CronTestCaseMixin(TestCase):
 
+    def _pre_setup(self):
+        super(CronTestCaseMixin, self)._pre_setup()
+        user_interaction_sweep.reset()
+        important_maintenance_sweep.reset()
+
     def _call_runcrons(self):
         # ``runcrons`` command runs ``logging.debug()`` that somehow spoils stderr.
         with mock.patch(u'django_cron.logging'):
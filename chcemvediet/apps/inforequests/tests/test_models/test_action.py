@@ -269,6 +269,42 @@ class ActionTest(InforequestsTestCaseMixin, TestCase):
         action = self._create_action(branch=branch, omit=[u'last_deadline_reminder'])
         self.assertIsNone(action.last_deadline_reminder)
 
+    def test_deadline_fields_are_computed_on_save(self):
+        timewarp.jump(local_datetime_from_local(u'2010-10-05 10:33:00'))
+        _, branch, (request,) = self._create_inforequest_scenario()
+        request = Action.objects.get(pk=request.pk)
+        self.assertEqual(request.deadline_type, Action.DEADLINE_TYPES.OBLIGEE_DEADLINE)
+        self.assertEqual(request.deadline_date, request.deadline.deadline_date)
+        self.assertEqual(request.snooze_date, request.deadline.snooze_date)
+
+    def test_deadline_fields_are_none_for_actions_without_deadline(self):
+        _, branch, (request, disclosure) = self._create_inforequest_scenario(
+                (u'disclosure', dict(disclosure_level=Action.DISCLOSURE_LEVELS.FULL)),
+                )
+        disclosure = Action.objects.get(pk=disclosure.pk)
+        self.assertIsNone(disclosure.deadline_type)
+        self.assertIsNone(disclosure.deadline_date)
+        self.assertIsNone(disclosure.snooze_date)
+
+    def test_deadline_fields_of_following_actions_are_updated_on_snooze(self):
+        timewarp.jump(local_datetime_from_local(u'2010-10-05 10:33:00'))
+        _, branch, (request, confirmation) = self._create_inforequest_scenario(u'confirmation')
+        request.snooze = request.deadline.deadline_date + datetime.timedelta(days=3)
+        request.save(update_fields=[u'snooze'])
+        confirmation = Action.objects.get(pk=confirmation.pk)
+        self.assertEqual(confirmation.snooze_date, request.snooze)
+
+    def test_save_does_not_change_update_fields_argument(self):
+        timewarp.jump(local_datetime_from_local(u'2010-10-05 10:33:00'))
+        _, branch, (request,) = self._create_inforequest_scenario()
+        update_fields = [u'snooze']
+        request.snooze = request.deadline.deadline_date + datetime.timedelta(days=3)
+        request.save(update_fields=update_fields)
+        request.save(update_fields=tuple(update_fields))
+        self.assertEqual(update_fields, [u'snooze'])
+        request = Action.objects.get(pk=request.pk)
+        self.assertEqual(request.snooze_date, request.deadline.snooze_date)
+
     def test_advanced_to_set_relation(self):
         _, branch1, actions = self._create_inforequest_scenario(
                 (u'advancement', [], [], [], []), # Advanced to 4 branches
@@ -709,6 +745,24 @@ class ActionTest(InforequestsTestCaseMixin, TestCase):
         self.assertItemsEqual(result_by_email, [request, confirmation, refusal, extension])
         self.assertItemsEqual(result_by_smail, [appeal, remandment, expiration])
 
+    def test_last_in_branch_and_deadline_query_methods(self):
+        timewarp.jump(local_datetime_from_local(u'2010-10-05 10:33:00'))
+        _, branch, (request, confirmation, refusal) = self._create_inforequest_scenario(
+                u'confirmation',
+                u'refusal',
+                )
+        refusal = Action.objects.get(pk=refusal.pk)
+        deadline_date = refusal.deadline_date
+        self.assertItemsEqual(Action.objects.last_in_branch(), [refusal])
+        self.assertItemsEqual(Action.objects.last_in_branch().applicant_deadlines(), [refusal])
+        self.assertItemsEqual(Action.objects.last_in_branch().obligee_deadlines(), [])
+        self.assertItemsEqual(Action.objects.with_deadline(), [request, confirmation, refusal])
+        self.assertItemsEqual(Action.objects.applicant_deadlines().deadline_before(deadline_date), [])
+        self.assertItemsEqual(Action.objects.applicant_deadlines().deadline_before(
+                deadline_date + datetime.timedelta(days=1)), [refusal])
+        self.assertItemsEqual(Action.objects.applicant_deadlines().snooze_before(
+                deadline_date + datetime.timedelta(days=1)), [refusal])
+
     def test_order_by_pk_query_method(self):
         inforequest = self._create_inforequest()
         branch = self._create_branch(inforequest=inforequest)
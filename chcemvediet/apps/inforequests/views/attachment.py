@@ -1,9 +1,7 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
 from django.db import transaction
-from django.db.models import Q
 from django.views.decorators.http import require_http_methods
-from django.http import Http404
 from django.contrib.sessions.models import Session
 
 from poleno.attachments import views as attachments_views
@@ -27,25 +25,13 @@ def attachment_upload(request):
 @require_http_methods([u'HEAD', u'GET'])
 @login_required(raise_exception=True)
 def attachment_download(request, attachment_pk):
-    permitted = {
-            Session: Q(session_key=request.session.session_key),
-            Message: Q(inforequest__applicant=request.user),
-            WizardDraft: Q(owner=request.user),
-            InforequestDraft: Q(applicant=request.user),
-            Action: Q(branch__inforequest__applicant=request.user),
-            }
-
-    attachment = Attachment.objects.get_or_404(pk=attachment_pk)
-    attached_to_class = attachment.generic_type.model_class()
-
-    try:
-        condition = permitted[attached_to_class]
-    except KeyError:
-        raise Http404()
-
-    try:
-        attached_to_class.objects.filter(condition).get(pk=attachment.generic_id)
-    except attached_to_class.DoesNotExist:
-        raise Http404()
+    # All permitted owners are checked by subqueries within a single query.
+    attachment = Attachment.objects.attached_to(
+            Session.objects.filter(session_key=request.session.session_key),
+            Message.objects.filter(inforequest__applicant=request.user),
+            WizardDraft.objects.filter(owner=request.user),
+            InforequestDraft.objects.filter(applicant=request.user),
+            Action.objects.filter(branch__inforequest__applicant=request.user),
+            ).get_or_404(pk=attachment_pk)
 
     return attachments_views.download(request, attachment)
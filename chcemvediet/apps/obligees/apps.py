@@ -0,0 +1,10 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+from django.apps import AppConfig
+
+
+class ObligeesConfig(AppConfig):
+    name = u'chcemvediet.apps.obligees'
+
+    def ready(self):
+        from . import signals
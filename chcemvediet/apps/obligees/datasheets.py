@@ -20,6 +20,7 @@ from .models import ObligeeTag, ObligeeGroup, Obligee, HistoricalObligee, Oblige
 class ObligeeTagSheet(Sheet):
     label = u'Tagy'
     model = ObligeeTag
+    bulk_save = True
 
     columns = Columns(
             # {{{
@@ -41,6 +42,7 @@ class ObligeeTagSheet(Sheet):
 class ObligeeGroupSheet(Sheet):
     label = u'Hierarchia'
     model = ObligeeGroup
+    bulk_save = True
 
     columns = Columns(
             # {{{
@@ -92,7 +94,9 @@ class ObligeeGroupSheet(Sheet):
 class ObligeeSheet(Sheet):
     label = u'Obligees'
     model = Obligee
+    bulk_save = True
     delete_omitted = False
+    incremental = True
 
     columns = Columns(
             # {{{
@@ -224,6 +228,11 @@ class ObligeeSheet(Sheet):
         self.reset_model(HistoricalObligee)
         self.reset_model(Inforequest)
 
+    def fingerprint(self, row, extra=None):
+        # Imported emails depend on dummy emails settings; See process_row()
+        extra = (extra, getattr(settings, u'OBLIGEE_DUMMY_MAIL', None))
+        return super(ObligeeSheet, self).fingerprint(row, extra)
+
     def process_row(self, row_idx, row):
         values = super(ObligeeSheet, self).process_row(row_idx, row)
 
@@ -238,6 +247,7 @@ class ObligeeSheet(Sheet):
 class ObligeeAliasSheet(Sheet):
     label = u'Aliasy'
     model = ObligeeAlias
+    bulk_save = True
 
     columns = Columns(
             # {{{
@@ -12,6 +12,7 @@ from poleno.utils.template import render_to_string
 from poleno.utils.misc import cached_method
 
 from .models import Obligee
+from .search import lookup
 
 
 class ObligeeWidget(forms.Widget):
@@ -89,12 +90,16 @@ class ObligeeField(forms.Field):
         if value in self.empty_values:
             return None
         # FIXME: Should be ``.get(name=value)``, but there are Obligees with duplicate names, yet.
-        value = Obligee.objects.pending().filter(name=value).order_by_pk().first()
-        if value is None:
+        obligee = Obligee.objects.pending().filter(name=value).order_by_pk().first()
+        if obligee is None:
+            # Users may type an alias or the name without accents instead of choosing the obligee
+            # from the autocomplete.
+            obligee = next(iter(lookup(value)), None)
+        if obligee is None:
             raise ValidationError(_(u'obligees:ObligeeField:error:invalid_obligee'))
-        if self.email_required and not value.emails_parsed:
+        if self.email_required and not obligee.emails_parsed:
             raise ValidationError(_(u'obligees:ObligeeField:error:no_email'))
-        return value
+        return obligee
 
 class MultipleObligeeField(ObligeeField):
     widget = MultipleObligeeWidget
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+from unidecode import unidecode
+
+from django.db import models, migrations
+import poleno.utils.misc
+
+def forward(apps, schema_editor):
+    Obligee = apps.get_model(u'obligees', u'Obligee')
+    ObligeeSearchTerm = apps.get_model(u'obligees', u'ObligeeSearchTerm')
+    obligees = Obligee.objects.filter(status=1).prefetch_related(u'obligeealias_set', u'tags', u'groups')
+    terms = []
+    for obligee in obligees:
+        sources = [(obligee.name, 8), (obligee.official_name, 4)]
+        sources.extend((a.name, 6) for a in obligee.obligeealias_set.all())
+        sources.extend((t.name, 2) for t in obligee.tags.all())
+        sources.extend((g.name, 2) for g in obligee.groups.all())
+        weights = {}
+        for text, weight in sources:
+            for term in re.split(r'[^a-z0-9]+', unidecode(text).lower()):
+                if term:
+                    weights[term] = max(weights.get(term, 0), weight)
+        terms.extend(ObligeeSearchTerm(obligee=obligee, term=t[:255], weight=w) for t, w in weights.items())
+    ObligeeSearchTerm.objects.bulk_create(terms)
+
+def backward(apps, schema_editor):
+    # Search terms are dropped together with their table.
+    pass
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('obligees', '0013_auto_20151213_0838'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ObligeeSearchTerm',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('term', models.CharField(help_text='Transliterated lowercase word from obligee name, official name, alias, tag or group name.', max_length=255, db_index=True)),
+                ('weight', models.SmallIntegerField(help_text='Relevance of the term for the obligee. Terms from obligee name have the highest weight.')),
+                ('obligee', models.ForeignKey(help_text='Obligee the term was extracted from.', to='obligees.Obligee', db_constraint=False)),
+            ],
+            options={
+            },
+            bases=(poleno.utils.misc.FormatMixin, models.Model),
+        ),
+        migrations.RunPython(forward, backward),
+    ]
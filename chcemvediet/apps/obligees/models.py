@@ -11,7 +11,7 @@ from poleno import datacheck
 from poleno.utils.models import FieldChoices, QuerySet
 from poleno.utils.forms import validate_comma_separated_emails
 from poleno.utils.history import register_history
-from poleno.utils.misc import FormatMixin, squeeze, decorate, slugify
+from poleno.utils.misc import FormatMixin, squeeze, slugify
 from chcemvediet.apps.geounits.models import Neighbourhood
 
 
@@ -56,16 +56,15 @@ class ObligeeTag(FormatMixin, models.Model):
 
     objects = ObligeeTagQuerySet.as_manager()
 
-    @decorate(prevent_bulk_create=True)
-    def save(self, *args, **kwargs):
-        update_fields = kwargs.get(u'update_fields', None)
-
+    def prepare_save(self, update_fields=None):
         # Generate and save slug if saving name
         if update_fields is None or u'name' in update_fields:
             self.slug = slugify(self.name)
             if update_fields is not None:
                 update_fields.append(u'slug')
 
+    def save(self, *args, **kwargs):
+        self.prepare_save(kwargs.get(u'update_fields', None))
         super(ObligeeTag, self).save(*args, **kwargs)
 
     def __unicode__(self):
@@ -120,16 +119,15 @@ class ObligeeGroup(FormatMixin, models.Model):
 
     objects = ObligeeGroupQuerySet.as_manager()
 
-    @decorate(prevent_bulk_create=True)
-    def save(self, *args, **kwargs):
-        update_fields = kwargs.get(u'update_fields', None)
-
+    def prepare_save(self, update_fields=None):
         # Generate and save slug if saving name
         if update_fields is None or u'name' in update_fields:
             self.slug = slugify(self.name)
             if update_fields is not None:
                 update_fields.append(u'slug')
 
+    def save(self, *args, **kwargs):
+        self.prepare_save(kwargs.get(u'update_fields', None))
         super(ObligeeGroup, self).save(*args, **kwargs)
 
     def __unicode__(self):
@@ -268,6 +266,9 @@ class Obligee(FormatMixin, models.Model):
     #
     #  -- inforequestdraft_set: by InforequestDraft.obligee
     #     May be empty
+    #
+    #  -- obligeesearchterm_set: by ObligeeSearchTerm.obligee
+    #     May be empty; Pending obligees only
 
     # Backward relations added to other models:
     #
@@ -296,16 +297,15 @@ class Obligee(FormatMixin, models.Model):
     def emails_formatted(self):
         return [formataddr((n, a)) for n, a in getaddresses([self.emails]) if a]
 
-    @decorate(prevent_bulk_create=True)
-    def save(self, *args, **kwargs):
-        update_fields = kwargs.get(u'update_fields', None)
-
+    def prepare_save(self, update_fields=None):
         # Generate and save slug if saving name
         if update_fields is None or u'name' in update_fields:
             self.slug = slugify(self.name)
             if update_fields is not None:
                 update_fields.append(u'slug')
 
+    def save(self, *args, **kwargs):
+        self.prepare_save(kwargs.get(u'update_fields', None))
         super(Obligee, self).save(*args, **kwargs)
 
     def __unicode__(self):
@@ -357,22 +357,55 @@ class ObligeeAlias(FormatMixin, models.Model):
     class Meta:
         verbose_name_plural = u'obligee aliases'
 
-    @decorate(prevent_bulk_create=True)
-    def save(self, *args, **kwargs):
-        update_fields = kwargs.get(u'update_fields', None)
-
+    def prepare_save(self, update_fields=None):
         # Generate and save slug if saving name
         if update_fields is None or u'name' in update_fields:
             self.slug = slugify(self.name)
             if update_fields is not None:
                 update_fields.append(u'slug')
 
+    def save(self, *args, **kwargs):
+        self.prepare_save(kwargs.get(u'update_fields', None))
         super(ObligeeAlias, self).save(*args, **kwargs)
 
     def __unicode__(self):
         return u'[{}] {}'.format(self.pk, self.name)
 
 
+class ObligeeSearchTermQuerySet(QuerySet):
+    def order_by_pk(self):
+        return self.order_by(u'pk')
+
+class ObligeeSearchTerm(FormatMixin, models.Model):
+    # May NOT be NULL; Terms are maintained by ``chcemvediet.apps.obligees.search`` and may refer
+    # to an obligee being deleted for a while, so there is no database constraint.
+    obligee = models.ForeignKey(Obligee, db_constraint=False,
+            help_text=u'Obligee the term was extracted from.')
+
+    # May NOT be empty
+    term = models.CharField(max_length=255, db_index=True,
+            help_text=squeeze(u"""
+                Transliterated lowercase word from obligee name, official name, alias, tag or group
+                name.
+                """))
+
+    # May NOT be NULL
+    weight = models.SmallIntegerField(
+            help_text=squeeze(u"""
+                Relevance of the term for the obligee. Terms from obligee name have the highest
+                weight.
+                """))
+
+    # Indexes:
+    #  -- obligee: ForeignKey
+    #  -- term:    on field
+
+    objects = ObligeeSearchTermQuerySet.as_manager()
+
+    def __unicode__(self):
+        return u'[{}] {}'.format(self.pk, self.term)
+
+
 @datacheck.register
 def datachecks(superficial, autofix):
     u"""
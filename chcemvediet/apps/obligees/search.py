@@ -0,0 +1,279 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import re
+import json
+import time
+import heapq
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from unidecode import unidecode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.forms.models import model_to_dict
+
+from poleno.utils.misc import random_string
+
+from .models import Obligee, ObligeeSearchTerm
+
+
+# Weights of search terms by the obligee attribute they come from.
+NAME_WEIGHT = 8
+ALIAS_WEIGHT = 6
+OFFICIAL_NAME_WEIGHT = 4
+TAG_WEIGHT = 2
+GROUP_WEIGHT = 2
+
+def tokenize(text):
+    u"""
+    Transliterates unicode text to lowercase ascii and splits it to words.
+    """
+    text = unidecode(text).lower()
+    return [w for w in re.split(r'[^a-z0-9]+', text) if w]
+
+def _indexed_obligees():
+    return (Obligee.objects.pending()
+            .prefetch_related(u'obligeealias_set')
+            .prefetch_related(u'tags')
+            .prefetch_related(u'groups')
+            )
+
+def _obligee_names(obligee):
+    sources = [(obligee.name, NAME_WEIGHT), (obligee.official_name, OFFICIAL_NAME_WEIGHT)]
+    sources.extend((a.name, ALIAS_WEIGHT) for a in obligee.obligeealias_set.all())
+    return sources
+
+def _obligee_terms(obligee):
+    sources = _obligee_names(obligee)
+    sources.extend((t.name, TAG_WEIGHT) for t in obligee.tags.all())
+    sources.extend((g.name, GROUP_WEIGHT) for g in obligee.groups.all())
+    weights = {}
+    for text, weight in sources:
+        for term in tokenize(text):
+            weights[term] = max(weights.get(term, 0), weight)
+    return [ObligeeSearchTerm(obligee=obligee, term=t[:255], weight=w) for t, w in weights.items()]
+
+@transaction.atomic
+def index_obligees(pks):
+    u"""
+    Recomputes search terms of obligees with given primary keys. Obligees that do not exist or
+    are not pending have their terms removed.
+    """
+    pks = sorted(set(pks))
+    for i in range(0, len(pks), 500):
+        ObligeeSearchTerm.objects.filter(obligee_id__in=pks[i:i+500]).delete()
+    terms = []
+    for obligee in _indexed_obligees().chunked(pks=pks):
+        terms.extend(_obligee_terms(obligee))
+    ObligeeSearchTerm.objects.bulk_create(terms)
+    invalidate_cache()
+
+@transaction.atomic
+def rebuild_index():
+    u"""
+    Recomputes search terms of all obligees.
+    """
+    ObligeeSearchTerm.objects.all().delete()
+    terms = []
+    for obligee in _indexed_obligees().chunked():
+        terms.extend(_obligee_terms(obligee))
+        if len(terms) > 1000:
+            ObligeeSearchTerm.objects.bulk_create(terms)
+            terms = []
+    ObligeeSearchTerm.objects.bulk_create(terms)
+    invalidate_cache()
+
+
+# Searches are answered from a per-process cache of pending obligees. Processes share only the
+# cache version stored in the django cache. Whenever the version changes, every process reloads its
+# obligees from the database on its next search.
+CACHE_VERSION_KEY = u'obligees.search.version'
+
+def invalidate_cache():
+    u"""
+    Changes the cache version, so every process reloads its cached obligees on its next search.
+    Called whenever the search index changes.
+    """
+    cache.set(CACHE_VERSION_KEY, random_string(16), timeout=None)
+
+def _prefix_range(keys, prefix):
+    # Keys consist of characters ``[a-z0-9 ]`` only and ``{`` sorts after all of them.
+    lo = bisect_left(keys, prefix)
+    hi = bisect_left(keys, prefix + u'{', lo)
+    return xrange(lo, hi)
+
+class _ObligeeCache(object):
+    u"""
+    Compact representation of pending obligees. Obligees are identified by their position in
+    ``pks`` which are ordered by obligee names. Every obligee has its pre-serialized JSON fragment
+    in ``fragments``. Search terms are kept sorted in ``terms``, so terms starting with a given
+    prefix form a continuous range, and ``postings`` hold tuples of ``(position, weight)`` of
+    obligees with the respective terms. Similarly, whole names, official names and aliases of
+    obligees, with their words joined by single spaces, are kept in ``phrases`` with postings in
+    ``phrase_postings``. Aliases are thus collapsed to their obligees.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.loaded = time.time()
+
+        fragments = {}
+        phrases = defaultdict(dict)
+        for obligee in _indexed_obligees().chunked(500):
+            fragments[obligee.pk] = json.dumps({
+                u'label': obligee.name,
+                u'obligee': model_to_dict(obligee),
+                }, cls=DjangoJSONEncoder)
+            for text, weight in _obligee_names(obligee):
+                phrase = u' '.join(tokenize(text))
+                if phrase:
+                    weights = phrases[phrase]
+                    weights[obligee.pk] = max(weights.get(obligee.pk, 0), weight)
+
+        # Obligees created after the previous query are left out, they will be loaded with the
+        # next cache version.
+        ordered = Obligee.objects.pending().order_by_name().values_list(u'pk', flat=True)
+        self.pks = [pk for pk in ordered if pk in fragments]
+        self.fragments = [fragments[pk] for pk in self.pks]
+        positions = {pk: i for i, pk in enumerate(self.pks)}
+
+        postings = defaultdict(list)
+        queryset = ObligeeSearchTerm.objects.values_list(u'obligee_id', u'term', u'weight')
+        for obligee_pk, term, weight in queryset.iterator():
+            if obligee_pk in positions:
+                postings[term].append((positions[obligee_pk], weight))
+        self.terms = sorted(postings)
+        self.postings = [tuple(postings[term]) for term in self.terms]
+
+        self.phrases = sorted(phrases)
+        self.phrase_postings = [tuple((positions[pk], weight)
+                for pk, weight in phrases[phrase].items() if pk in positions)
+                for phrase in self.phrases]
+
+    def expired(self, version):
+        timeout = getattr(settings, u'OBLIGEES_SEARCH_CACHE_TIMEOUT', 600)
+        return version != self.version or time.time() > self.loaded + timeout
+
+    def matches(self, word):
+        u"""
+        Yields tuples ``(position, term, weight)`` of obligees with terms starting with ``word``.
+        """
+        for i in _prefix_range(self.terms, word):
+            term = self.terms[i]
+            for position, weight in self.postings[i]:
+                yield position, term, weight
+
+    def phrase_matches(self, phrase):
+        u"""
+        Yields tuples ``(position, phrase, weight)`` of obligees with names, official names or
+        aliases starting with ``phrase``.
+        """
+        for i in _prefix_range(self.phrases, phrase):
+            matched = self.phrases[i]
+            for position, weight in self.phrase_postings[i]:
+                yield position, matched, weight
+
+_cache_lock = threading.Lock()
+_cache = None
+
+def _cached_obligees():
+    global _cache
+    version = cache.get(CACHE_VERSION_KEY)
+    if version is None:
+        invalidate_cache()
+        version = cache.get(CACHE_VERSION_KEY)
+    with _cache_lock:
+        # The cache version may be changed before the transaction changing the obligees is
+        # committed. Obligees loaded by other processes meanwhile would be outdated until the next
+        # change, so we reload them after a timeout anyway.
+        if _cache is None or _cache.expired(version):
+            _cache = _ObligeeCache(version)
+        return _cache
+
+def _rank(obligees, query, limit):
+    u"""
+    Returns positions of at most ``limit`` best matching obligees. Every word of the query scores
+    for the best term of the obligee it is a prefix of, twice as much if it matches the whole term.
+    Moreover, if the whole query is a prefix of obligee name, official name or alias, the obligee
+    scores twice the weight of the name, or four times the weight if it matches the name exactly.
+    """
+    tokens = tokenize(query)
+    words = sorted(set(tokens), key=len, reverse=True)
+    if not words:
+        return range(min(limit, len(obligees.pks)))
+
+    scores = None
+    for word in words:
+        word_scores = {}
+        for position, term, weight in obligees.matches(word):
+            if scores is not None and position not in scores:
+                continue
+            score = 2*weight if term == word else weight
+            if score > word_scores.get(position, 0):
+                word_scores[position] = score
+        if scores is not None:
+            word_scores = {p: scores[p] + s for p, s in word_scores.items()}
+        scores = word_scores
+        if not scores:
+            return []
+
+    # Phrase matches are restricted to obligees matched by all words, so they only add to scores.
+    query = u' '.join(tokens)
+    phrase_scores = {}
+    for position, phrase, weight in obligees.phrase_matches(query):
+        score = 4*weight if phrase == query else 2*weight
+        if score > phrase_scores.get(position, 0):
+            phrase_scores[position] = score
+    for position, score in phrase_scores.items():
+        if position in scores:
+            scores[position] += score
+
+    # Bounded heap of the best ``limit`` obligees, ties are broken by obligee names.
+    return heapq.nsmallest(limit, scores, key=lambda p: (-scores[p], p))
+
+def _exact(obligees, name):
+    phrase = u' '.join(tokenize(name))
+    scores = {}
+    for position, matched, weight in obligees.phrase_matches(phrase):
+        if phrase and matched == phrase and weight > scores.get(position, 0):
+            scores[position] = weight
+    return sorted(scores, key=lambda p: (-scores[p], p))
+
+def search(query, limit=50):
+    u"""
+    Returns at most ``limit`` pending obligees matching the query. Every word of the query must
+    be a prefix of some search term of the obligee. Obligees are ordered by relevance and then by
+    name. A word matching a term exactly is more relevant than a word matching its prefix, and
+    terms from obligee names are more relevant than terms from aliases, official names, tags and
+    groups. Obligees with a name, official name or alias starting with the whole query, or even
+    equal to it, are more relevant still. Query without any words matches all pending obligees.
+
+    Obligees are matched using the per-process cache and then fetched from the database.
+    """
+    obligees = _cached_obligees()
+    ranked = [obligees.pks[p] for p in _rank(obligees, query, limit)]
+    found = Obligee.objects.in_bulk(ranked)
+    return [found[pk] for pk in ranked if pk in found]
+
+def search_fragments(query, limit=50):
+    u"""
+    Like ``search()``, but returns pre-serialized JSON objects ``{"label": obligee.name,
+    "obligee": model_to_dict(obligee)}`` of the matched obligees. The result is computed from the
+    per-process cache without touching the database, unless the cache is outdated.
+    """
+    obligees = _cached_obligees()
+    return [obligees.fragments[p] for p in _rank(obligees, query, limit)]
+
+def lookup(name):
+    u"""
+    Returns pending obligees with name, official name or alias equal to ``name``, ignoring case,
+    accents and punctuation. Obligees matched by their names go first, followed by obligees
+    matched by aliases and official names.
+    """
+    obligees = _cached_obligees()
+    ranked = [obligees.pks[p] for p in _exact(obligees, name)]
+    found = Obligee.objects.in_bulk(ranked)
+    return [found[pk] for pk in ranked if pk in found]
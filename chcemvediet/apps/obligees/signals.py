@@ -0,0 +1,60 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+from django.dispatch import receiver
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+
+from .models import ObligeeTag, ObligeeGroup, Obligee, ObligeeAlias, ObligeeSearchTerm
+from .search import index_obligees, invalidate_cache
+
+
+@receiver(post_save, sender=Obligee)
+def index_obligee_on_post_save(sender, instance, **kwargs):
+    index_obligees([instance.pk])
+
+@receiver(post_delete, sender=Obligee)
+def delete_search_terms_on_obligee_post_delete(sender, instance, **kwargs):
+    u"""
+    Search terms are deleted with the obligee by cascade. However, deleting obligee aliases before
+    the obligee itself reindexes the obligee, so we need to delete the new terms as well.
+    """
+    ObligeeSearchTerm.objects.filter(obligee_id=instance.pk).delete()
+    invalidate_cache()
+
+@receiver(pre_save, sender=ObligeeAlias)
+def remember_alias_obligee_on_pre_save(sender, instance, **kwargs):
+    # If the alias is moved to another obligee, the original obligee must be reindexed as well.
+    instance._obligees_to_index = list(ObligeeAlias.objects.filter(pk=instance.pk)
+            .values_list(u'obligee_id', flat=True)) if instance.pk else []
+
+@receiver(post_save, sender=ObligeeAlias)
+@receiver(post_delete, sender=ObligeeAlias)
+def index_obligee_on_alias_change(sender, instance, **kwargs):
+    index_obligees(instance.__dict__.pop(u'_obligees_to_index', []) + [instance.obligee_id])
+
+@receiver(m2m_changed, sender=Obligee.tags.through)
+@receiver(m2m_changed, sender=Obligee.groups.through)
+def index_obligees_on_tags_or_groups_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in [u'post_add', u'post_remove', u'post_clear']:
+            index_obligees([instance.pk])
+    elif action == u'pre_clear':
+        instance._obligees_to_index = list(instance.obligee_set.values_list(u'pk', flat=True))
+    elif action == u'post_clear':
+        index_obligees(instance.__dict__.pop(u'_obligees_to_index', []))
+    elif action in [u'post_add', u'post_remove']:
+        index_obligees(pk_set)
+
+@receiver(post_save, sender=ObligeeTag)
+@receiver(post_save, sender=ObligeeGroup)
+def index_obligees_on_tag_or_group_post_save(sender, instance, **kwargs):
+    index_obligees(instance.obligee_set.values_list(u'pk', flat=True))
+
+@receiver(pre_delete, sender=ObligeeTag)
+@receiver(pre_delete, sender=ObligeeGroup)
+def index_obligees_on_tag_or_group_pre_delete(sender, instance, **kwargs):
+    instance._obligees_to_index = list(instance.obligee_set.values_list(u'pk', flat=True))
+
+@receiver(post_delete, sender=ObligeeTag)
+@receiver(post_delete, sender=ObligeeGroup)
+def index_obligees_on_tag_or_group_post_delete(sender, instance, **kwargs):
+    index_obligees(instance.__dict__.pop(u'_obligees_to_index', []))
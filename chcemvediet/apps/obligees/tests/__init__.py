@@ -2,11 +2,26 @@
 # -*- coding: utf-8 -*-
 from django.template import Context, Template
 from django.test import TestCase
+from django.test.utils import override_settings
 
 from ..models import Obligee
+from ..search import invalidate_cache
 
 class ObligeesTestCaseMixin(TestCase):
 
+    def _pre_setup(self):
+        super(ObligeesTestCaseMixin, self)._pre_setup()
+        self.settings_override = override_settings(
+            CACHES={u'default': {u'BACKEND': u'django.core.cache.backends.locmem.LocMemCache'}},
+            )
+        self.settings_override.enable()
+        # Obligees cached for searching survive database rollbacks after previous tests.
+        invalidate_cache()
+
+    def _post_teardown(self):
+        self.settings_override.disable()
+        super(ObligeesTestCaseMixin, self)._post_teardown()
+
     def _create_obligee(self, omit=(), **kwargs):
         defaults = {
                 u'name': u'Default Testing Name',
@@ -116,8 +116,10 @@ class ObligeeFieldWithTextInputWidgetTest(ObligeesTestCaseMixin, TestCase):
         with self.assertNumQueries(0):
             self.assertEqual(field.clean(u'bbb'), oblgs[1])
 
-        # Invalid value
-        with self.assertNumQueries(1):
+        # Invalid value. Values not matching any obligee name are looked up by ``search.lookup()``,
+        # the first lookup loads obligees cached for searching: 1 query for the name and 6 queries
+        # for the cache.
+        with self.assertNumQueries(7):
             with self.assertRaises(ValidationError):
                 field.clean(u'invalid')
         with self.assertNumQueries(0):
@@ -0,0 +1,226 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import json
+
+from django.core.exceptions import ValidationError
+from django.forms.models import model_to_dict
+from django.test import TestCase
+
+from . import ObligeesTestCaseMixin
+from ..models import ObligeeTag, ObligeeGroup, Obligee, ObligeeAlias, ObligeeSearchTerm
+from ..forms import ObligeeField
+from ..search import tokenize, rebuild_index, search, search_fragments, lookup
+
+class ObligeeSearchTest(ObligeesTestCaseMixin, TestCase):
+    u"""
+    Tests obligee search index maintained by ``chcemvediet.apps.obligees.search``.
+    """
+
+    def _create_obligee(self, **kwargs):
+        kwargs.setdefault(u'gender', Obligee.GENDERS.MASCULINE)
+        kwargs.setdefault(u'type', Obligee.TYPES.SECTION_1)
+        kwargs.setdefault(u'iczsj_id', u'default_testing_iczsj')
+        return super(ObligeeSearchTest, self)._create_obligee(**kwargs)
+
+    def _search(self, query, **kwargs):
+        return [o.name for o in search(query, **kwargs)]
+
+    def _terms(self, obligee):
+        return set(ObligeeSearchTerm.objects.filter(obligee=obligee).values_list(u'term', flat=True))
+
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize(u'  Mestský úrad,Bratislava-Petržalka  '),
+                [u'mestsky', u'urad', u'bratislava', u'petrzalka'])
+
+    def test_terms_updated_when_obligee_saved(self):
+        oblg = self._create_obligee(name=u'Aaa Bbb', official_name=u'Ccc')
+        self.assertEqual(self._terms(oblg), {u'aaa', u'bbb', u'ccc'})
+        oblg.name = u'Ddd'
+        oblg.save()
+        self.assertEqual(self._terms(oblg), {u'ddd', u'ccc'})
+
+    def test_terms_removed_when_obligee_dissolved(self):
+        oblg = self._create_obligee(name=u'Aaa')
+        oblg.status = Obligee.STATUSES.DISSOLVED
+        oblg.save()
+        self.assertEqual(self._terms(oblg), set())
+
+    def test_terms_updated_when_alias_saved_or_deleted(self):
+        oblg1 = self._create_obligee(name=u'Aaa')
+        oblg2 = self._create_obligee(name=u'Bbb')
+        alias = ObligeeAlias.objects.create(obligee=oblg1, name=u'Xxx')
+        self.assertEqual(self._terms(oblg1), {u'aaa', u'xxx'})
+        alias.obligee = oblg2
+        alias.save()
+        self.assertEqual(self._terms(oblg1), {u'aaa'})
+        self.assertEqual(self._terms(oblg2), {u'bbb', u'xxx'})
+        alias.delete()
+        self.assertEqual(self._terms(oblg2), {u'bbb'})
+
+    def test_terms_updated_when_tags_and_groups_change(self):
+        oblg = self._create_obligee(name=u'Aaa')
+        tag = ObligeeTag.objects.create(key=u'tag', name=u'Ttt')
+        group = ObligeeGroup.objects.create(key=u'group', name=u'Ggg')
+        oblg.tags.add(tag)
+        group.obligee_set.add(oblg)
+        self.assertEqual(self._terms(oblg), {u'aaa', u'ttt', u'ggg'})
+        tag.name = u'Uuu'
+        tag.save()
+        self.assertEqual(self._terms(oblg), {u'aaa', u'uuu', u'ggg'})
+        group.obligee_set.clear()
+        self.assertEqual(self._terms(oblg), {u'aaa', u'uuu'})
+        tag.delete()
+        self.assertEqual(self._terms(oblg), {u'aaa'})
+
+    def test_terms_deleted_with_obligee(self):
+        oblg = self._create_obligee(name=u'Aaa')
+        ObligeeAlias.objects.create(obligee=oblg, name=u'Xxx')
+        oblg.delete()
+        self.assertFalse(ObligeeSearchTerm.objects.exists())
+
+    def test_rebuild_index(self):
+        oblg1 = self._create_obligee(name=u'Aaa')
+        oblg2 = self._create_obligee(name=u'Bbb')
+        ObligeeSearchTerm.objects.all().delete()
+        rebuild_index()
+        self.assertEqual(self._terms(oblg1), {u'aaa'})
+        self.assertEqual(self._terms(oblg2), {u'bbb'})
+
+    def test_search_matches_word_prefixes(self):
+        names = [u'aaa', u'aaaaaaa', u'aaaxxxx', u'xxxxaaa', u'xxx aaa', u'xxx aaax xxx', u'aa']
+        for name in names:
+            self._create_obligee(name=name)
+        self.assertItemsEqual(self._search(u'aaa'),
+                [u'aaa', u'aaaaaaa', u'aaaxxxx', u'xxx aaa', u'xxx aaax xxx'])
+
+    def test_search_is_case_and_accent_insensitive(self):
+        for name in [u'aáá 1', u'AÄÄ 2', u'aaa 3', u'ddd']:
+            self._create_obligee(name=name)
+        self.assertItemsEqual(self._search(u'ǍaA'), [u'aáá 1', u'AÄÄ 2', u'aaa 3'])
+
+    def test_search_with_multiple_words(self):
+        for name in [u'aaa bbb ccc', u'bbb aaa', u'aaa ccc', u'ddd']:
+            self._create_obligee(name=name)
+        self.assertItemsEqual(self._search(u'++aaa++bbb,ccc++,,++'), [u'aaa bbb ccc'])
+
+    def test_search_matches_aliases_official_names_tags_and_groups(self):
+        oblg1 = self._create_obligee(name=u'Aaa', official_name=u'Official')
+        oblg2 = self._create_obligee(name=u'Bbb')
+        oblg3 = self._create_obligee(name=u'Ccc')
+        oblg4 = self._create_obligee(name=u'Ddd')
+        ObligeeAlias.objects.create(obligee=oblg2, name=u'Alias')
+        oblg3.tags.add(ObligeeTag.objects.create(key=u'tag', name=u'Tag'))
+        oblg4.groups.add(ObligeeGroup.objects.create(key=u'group', name=u'Group'))
+        self.assertEqual(self._search(u'official'), [u'Aaa'])
+        self.assertEqual(self._search(u'alias'), [u'Bbb'])
+        self.assertEqual(self._search(u'tag'), [u'Ccc'])
+        self.assertEqual(self._search(u'group'), [u'Ddd'])
+
+    def test_search_returns_only_pending_obligees(self):
+        self._create_obligee(name=u'aaa 1')
+        self._create_obligee(name=u'aaa 2', status=Obligee.STATUSES.DISSOLVED)
+        self.assertEqual(self._search(u'aaa'), [u'aaa 1'])
+        self.assertEqual(self._search(u''), [u'aaa 1'])
+
+    def test_search_ranks_results_by_relevance_and_name(self):
+        oblg1 = self._create_obligee(name=u'Bbb', official_name=u'Aaa')
+        oblg2 = self._create_obligee(name=u'Ccc aaaxxx')
+        oblg3 = self._create_obligee(name=u'Ddd aaa')
+        oblg4 = self._create_obligee(name=u'Eee')
+        oblg5 = self._create_obligee(name=u'Fff aaa')
+        ObligeeAlias.objects.create(obligee=oblg4, name=u'Aaa')
+        self.assertEqual(self._search(u'aaa'), [u'Eee', u'Bbb', u'Ddd aaa', u'Fff aaa', u'Ccc aaaxxx'])
+
+    def test_search_ranks_whole_name_matches_first(self):
+        oblg1 = self._create_obligee(name=u'Bbb ministerstvo vnutra')
+        oblg2 = self._create_obligee(name=u'Ministerstvo vnútra Slovenskej republiky')
+        oblg3 = self._create_obligee(name=u'Ministerstvo vnútra')
+        oblg4 = self._create_obligee(name=u'Policajný zbor')
+        ObligeeAlias.objects.create(obligee=oblg4, name=u'Ministerstvo vnútra - polícia')
+        self.assertEqual(self._search(u'ministerstvo vnutra'), [u'Ministerstvo vnútra',
+                u'Ministerstvo vnútra Slovenskej republiky', u'Policajný zbor',
+                u'Bbb ministerstvo vnutra'])
+        self.assertEqual(self._search(u'Ministerstvo vn'), [u'Ministerstvo vnútra',
+                u'Ministerstvo vnútra Slovenskej republiky', u'Policajný zbor',
+                u'Bbb ministerstvo vnutra'])
+
+    def test_search_limit(self):
+        for i in range(10):
+            self._create_obligee(name=u'aaa %02d' % i)
+        self.assertEqual(self._search(u'aaa', limit=3), [u'aaa 00', u'aaa 01', u'aaa 02'])
+        self.assertEqual(self._search(u'', limit=3), [u'aaa 00', u'aaa 01', u'aaa 02'])
+        self.assertEqual(self._search(u'aaa 07', limit=3), [u'aaa 07'])
+        self.assertEqual(self._search(u'aaa 0', limit=3), [u'aaa 00', u'aaa 01', u'aaa 02'])
+
+    def test_search_collapses_aliases_to_their_obligee(self):
+        oblg = self._create_obligee(name=u'Aaa xxx')
+        ObligeeAlias.objects.create(obligee=oblg, name=u'Aaa')
+        ObligeeAlias.objects.create(obligee=oblg, name=u'Aaa yyy')
+        self._create_obligee(name=u'Bbb aaa')
+        self.assertEqual(self._search(u'aaa'), [u'Aaa xxx', u'Bbb aaa'])
+
+    def test_lookup(self):
+        oblg1 = self._create_obligee(name=u'Úrad vlády', official_name=u'Úrad vlády SR')
+        oblg2 = self._create_obligee(name=u'Úrad vlády SR 2')
+        oblg3 = self._create_obligee(name=u'Ccc')
+        ObligeeAlias.objects.create(obligee=oblg3, name=u'UV SR')
+        ObligeeAlias.objects.create(obligee=oblg2, name=u'urad vlady')
+        self.assertEqual(lookup(u'urad vlady'), [oblg1, oblg2])
+        self.assertEqual(lookup(u'úrad-vlády-SR'), [oblg1])
+        self.assertEqual(lookup(u'uv sr'), [oblg3])
+        self.assertEqual(lookup(u'urad'), [])
+        self.assertEqual(lookup(u''), [])
+
+    def test_obligee_field_accepts_aliases(self):
+        oblg = self._create_obligee(name=u'Úrad vlády', emails=u'urad@example.com')
+        ObligeeAlias.objects.create(obligee=oblg, name=u'ÚV')
+        field = ObligeeField()
+        self.assertEqual(field.clean(u'Úrad vlády'), oblg)
+        self.assertEqual(field.clean(u'urad vlady'), oblg)
+        self.assertEqual(field.clean(u'uv'), oblg)
+        with self.assertRaises(ValidationError):
+            field.clean(u'urad')
+
+    def test_search_fragments(self):
+        oblg = self._create_obligee(name=u'Aaa')
+        self._create_obligee(name=u'Bbb')
+        oblg.tags.add(ObligeeTag.objects.create(key=u'tag', name=u'Tag'))
+        data = [json.loads(f) for f in search_fragments(u'aaa')]
+        self.assertEqual(data, [{u'label': u'Aaa', u'obligee': model_to_dict(oblg)}])
+
+    def test_search_fragments_answered_from_cache_without_queries(self):
+        self._create_obligee(name=u'Aaa')
+        self._create_obligee(name=u'Bbb')
+        search_fragments(u'')
+        with self.assertNumQueries(0):
+            data = [json.loads(f)[u'label'] for f in search_fragments(u'')]
+        self.assertEqual(data, [u'Aaa', u'Bbb'])
+
+    def test_cache_invalidated_when_obligee_saved_or_deleted(self):
+        oblg = self._create_obligee(name=u'Aaa')
+        self.assertEqual(self._search(u''), [u'Aaa'])
+        oblg.name = u'Bbb'
+        oblg.save()
+        self.assertEqual(self._search(u''), [u'Bbb'])
+        oblg.delete()
+        self.assertEqual(self._search(u''), [])
+
+    def test_cache_invalidated_when_alias_saved_or_deleted(self):
+        oblg = self._create_obligee(name=u'Aaa')
+        self.assertEqual(self._search(u'xxx'), [])
+        alias = ObligeeAlias.objects.create(obligee=oblg, name=u'Xxx')
+        self.assertEqual(self._search(u'xxx'), [u'Aaa'])
+        alias.delete()
+        self.assertEqual(self._search(u'xxx'), [])
+
+    def test_cache_invalidated_when_index_rebuilt(self):
+        self._create_obligee(name=u'Aaa')
+        self.assertEqual(self._search(u'aaa'), [u'Aaa'])
+        ObligeeSearchTerm.objects.all().delete()
+        self.assertEqual(self._search(u'aaa'), [u'Aaa'])
+        rebuild_index()
+        self.assertEqual(self._search(u'aaa'), [u'Aaa'])
+        Obligee.objects.all().update(name=u'Bbb')
+        rebuild_index()
+        self.assertEqual(self._search(u'bbb'), [u'Bbb'])
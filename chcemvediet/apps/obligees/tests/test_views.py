@@ -4,7 +4,6 @@ import random
 import json
 
 from django.core.urlresolvers import reverse
-from django.http import JsonResponse
 from django.test import TestCase
 
 from poleno.utils.test import ViewTestCaseMixin
@@ -74,7 +73,7 @@ class AutocompleteViewTest(ObligeesTestCaseMixin, ViewTestCaseMixin, TestCase):
         oblg2 = self._create_obligee(name=u'Ministry', street=u'Eastend', city=u'Springfield', zip=u'12345', emails=u'ministry@a.com')
         response = self.client.get(reverse(u'obligees:autocomplete'))
         self.assertEqual(response.status_code, 200)
-        self.assertIsInstance(response, JsonResponse)
+        self.assertEqual(response[u'Content-Type'], u'application/json')
         data = json.loads(response.content)
         self.assertEqual(data, [
                 {
@@ -1,17 +1,12 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
-import re
-import operator
-from unidecode import unidecode
-
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.shortcuts import render
-from django.forms.models import model_to_dict
 from django.views.decorators.http import require_http_methods
-from django.db.models import Q
-from django.http import JsonResponse
+from django.http import HttpResponse
 
 from .models import Obligee
+from .search import search_fragments
 
 
 @require_http_methods([u'HEAD', u'GET'])
@@ -34,18 +29,9 @@ def index(request):
 @require_http_methods([u'HEAD', u'GET'])
 def autocomplete(request):
     term = request.GET.get(u'term', u'')
-    term = unidecode(term).lower() # transliterate unicode to ascii
-    words = (w for w in re.split(r'[^a-z0-9]+', term) if w)
-
-    query = reduce(operator.and_, (Q(slug__contains=w) for w in words), Q())
-    obligees = Obligee.objects.pending().filter(query).order_by_name()[:50]
-
-    data = [{
-        u'label': obligee.name,
-        u'obligee': model_to_dict(obligee),
-    } for obligee in obligees]
+    fragments = search_fragments(term, limit=50)
 
     # Note: Jquery-ui autocomplete expects JSON with Array, despite possible problems with
     # poisoning the JavaScript Array constructor.
     # See: https://docs.djangoproject.com/en/1.8/ref/request-response/#serializing-non-dictionary-objects
-    return JsonResponse(data, safe=False)
+    return HttpResponse(b'[' + b','.join(fragments) + b']', content_type=u'application/json')
@@ -5,6 +5,7 @@ from chcemvediet.apps.geounits.datasheets import RegionSheet, DistrictSheet, Mun
 from chcemvediet.apps.geounits.datasheets import NeighbourhoodSheet
 from chcemvediet.apps.obligees.datasheets import ObligeeTagSheet, ObligeeGroupSheet, ObligeeSheet
 from chcemvediet.apps.obligees.datasheets import ObligeeAliasSheet
+from chcemvediet.apps.obligees.search import rebuild_index, invalidate_cache
 
 
 class DataBook(Book):
@@ -19,6 +20,16 @@ class DataBook(Book):
             ObligeeAliasSheet,
             ]
 
+    def do_import(self):
+        super(DataBook, self).do_import()
+        rebuild_index()
+
 class Command(LoadSheetsCommand):
     help = u'Loads .xlsx file with obligees and geounits'
     book = DataBook
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        # The import changes the cache version before its transaction is committed. Change it once
+        # more, so no process keeps obligees it loaded before the commit.
+        invalidate_cache()
@@ -62,6 +62,7 @@ INSTALLED_APPS = (
     u'poleno.mail',
     u'poleno.pages',
     u'poleno.invitations',
+    u'poleno.datasheets',
     # Local to the project
     u'chcemvediet.apps.wizards',
     u'chcemvediet.apps.accounts',
@@ -54,6 +54,7 @@ class AttachmentAdmin(admin.ModelAdmin):
             u'file',
             ]
     readonly_fields = [
+            u'sha256',
             ]
     raw_id_fields = [
             ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attachments', '0003_content_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='sha256',
+            field=models.CharField(help_text='SHA-256 digest of the attachment file content. Automatically computed when creating a new object.', max_length=64, db_index=True, blank=True),
+            preserve_default=True,
+        ),
+    ]
@@ -1,22 +1,37 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
 import datetime
+import hashlib
 import logging
 
 import magic
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files.base import File, ContentFile
 from django.db import models
 from django.db.models import Q
-from django.utils.functional import cached_property
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 
 from poleno import datacheck
 from poleno.utils.models import QuerySet
 from poleno.utils.date import utc_now, utc_datetime_from_local
-from poleno.utils.misc import FormatMixin, random_string, squeeze, decorate
+from poleno.utils.misc import FormatMixin, random_string, squeeze
 
 
+class _DigestFile(File):
+    u"""
+    Wraps a file computing SHA-256 digest of its content while it is being read in chunks, e.g. by
+    storage writing it.
+    """
+    def __init__(self, file):
+        super(_DigestFile, self).__init__(file, name=getattr(file, u'name', None))
+        self.digest = hashlib.sha256()
+
+    def chunks(self, chunk_size=None):
+        for chunk in super(_DigestFile, self).chunks(chunk_size):
+            self.digest.update(chunk)
+            yield chunk
+
 class AttachmentQuerySet(QuerySet):
     def attached_to(self, *args):
         u"""
@@ -43,6 +58,17 @@ class AttachmentQuerySet(QuerySet):
     def order_by_pk(self):
         return self.order_by(u'pk')
 
+    def bulk_create(self, objs, *args, **kwargs):
+        u"""
+        Computes file names, sizes and content types of new attachments and writes their files
+        before inserting them all at once, the same way ``Attachment.save()`` does it for a single
+        new attachment.
+        """
+        objs = list(objs)
+        for obj in objs:
+            obj._prepare_new()
+        return super(AttachmentQuerySet, self).bulk_create(objs, *args, **kwargs)
+
 class Attachment(FormatMixin, models.Model):
     # May NOT be NULL; Generic relation; Index is prefix of [generic_type, generic_id] index
     generic_type = models.ForeignKey(ContentType, db_index=False)
@@ -50,6 +76,8 @@ class Attachment(FormatMixin, models.Model):
     generic_object = generic.GenericForeignKey(u'generic_type', u'generic_id')
 
     # May NOT be NULL; Random local filename is generated in save() when creating a new object.
+    # In content-addressed mode the filename is the SHA-256 digest of the file content and the
+    # file may be shared by several attachments.
     file = models.FileField(upload_to=u'attachments', max_length=255)
 
     # May be empty; May NOT be trusted, set by client.
@@ -79,8 +107,17 @@ class Attachment(FormatMixin, models.Model):
                 Attachment file size in bytes. Automatically computed when creating a new object.
                 """))
 
+    # May be empty for old attachments; Automatically computed in save() when creating a new
+    # object.
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True,
+            help_text=squeeze(u"""
+                SHA-256 digest of the attachment file content. Automatically computed when creating
+                a new object.
+                """))
+
     # Indexes:
     #  -- generic_type, generic_id: index_together
+    #  -- sha256: on field
 
     objects = AttachmentQuerySet.as_manager()
 
@@ -89,7 +126,10 @@ class Attachment(FormatMixin, models.Model):
                 [u'generic_type', u'generic_id'],
                 ]
 
-    @cached_property
+    # Number of bytes from the beginning of the file used to guess its content type.
+    SNIFF_SIZE = 64*1024
+
+    @property
     def content(self):
         try:
             self.file.open(u'rb')
@@ -101,19 +141,92 @@ class Attachment(FormatMixin, models.Model):
         finally:
             self.file.close()
 
-    @decorate(prevent_bulk_create=True)
+    def chunks(self, chunk_size=None):
+        u"""
+        Yields the file content in chunks, so it does not need to be read into memory as a whole.
+        """
+        try:
+            self.file.open(u'rb')
+        except IOError:
+            logger = logging.getLogger(u'poleno.attachments')
+            logger.error(u'{} is missing its file: "{}".'.format(self, self.file.name))
+            raise
+        try:
+            for chunk in self.file.chunks(chunk_size):
+                yield chunk
+        finally:
+            self.file.close()
+
+    @property
+    def refcount(self):
+        u"""
+        Number of attachments sharing the file with this attachment, including the attachment
+        itself if it is saved.
+        """
+        return Attachment.objects.filter(file=self.file.name).count()
+
+    def _prepare_new(self):
+        u"""
+        Computes the content type from the beginning of the new file and writes the file to the
+        storage computing its SHA-256 digest on the fly. The file is never read into memory as a
+        whole.
+        """
+        if self.created is None:
+            self.created = utc_now()
+
+        # Metadata-only clone sharing an already stored file, see ``clone()``.
+        if self.file and self.file._committed:
+            return
+
+        self.file.name = random_string(10)
+        self.size = self.file.size
+        content = self.file.file
+        content.seek(0)
+        self.content_type = magic.from_buffer(content.read(self.SNIFF_SIZE), mime=True)
+
+        if not getattr(settings, u'ATTACHMENTS_CONTENT_ADDRESSED', False):
+            wrapper = _DigestFile(content)
+            self.file.save(self.file.name, wrapper, save=False)
+            self.sha256 = wrapper.digest.hexdigest()
+            return
+
+        # Content-addressed file name must be known before the file is written, so the content is
+        # read twice. If the same content is already stored we just reference it instead of
+        # writing it again. Concurrent uploads of the same new content may end up with two copies
+        # as the storage never overwrites existing files. It's harmless.
+        wrapper = _DigestFile(content)
+        for chunk in wrapper.chunks():
+            pass
+        self.sha256 = wrapper.digest.hexdigest()
+        field = self._meta.get_field(u'file')
+        name = field.generate_filename(self, self.sha256)
+        if field.storage.exists(name):
+            self.file.name = name
+            self.file._committed = True
+        else:
+            self.file.save(self.sha256, content, save=False)
+
     def save(self, *args, **kwargs):
         if self.pk is None: # Creating a new object
-            self.file.name = random_string(10)
-            if self.created is None:
-                self.created = utc_now()
-            self.size = self.file.size
-            self.content_type = magic.from_buffer(self.file.read(), mime=True)
+            self._prepare_new()
 
         super(Attachment, self).save(*args, **kwargs)
 
     def clone(self, generic_object):
-        u""" The returned copy is not saved. """
+        u"""
+        The returned copy is not saved. In content-addressed mode the copy shares the file with the
+        original attachment and the file content is not read at all.
+        """
+        if getattr(settings, u'ATTACHMENTS_CONTENT_ADDRESSED', False) and self.sha256:
+            return Attachment(
+                    generic_object=generic_object,
+                    file=self.file.name,
+                    name=self.name,
+                    content_type=self.content_type,
+                    created=self.created,
+                    size=self.size,
+                    sha256=self.sha256,
+                    )
         return Attachment(
                 generic_object=generic_object,
                 file=ContentFile(self.content),
@@ -128,7 +241,7 @@ class Attachment(FormatMixin, models.Model):
 def datachecks(superficial, autofix):
     u"""
     Checks that every ``Attachment`` instance has its file working, and there are not any orphaned
-    attachment files.
+    attachment files. Files shared by several attachments are checked only once.
     """
     # This check is a bit slow. We skip it if running from cron or the user asked for
     # superficial tests only.
@@ -136,9 +249,12 @@ def datachecks(superficial, autofix):
         return
 
     attachments = Attachment.objects.all()
-    attachment_names = {a.file.name for a in attachments}
+    attachment_names = set()
 
     for attachment in attachments:
+        if attachment.file.name in attachment_names:
+            continue
+        attachment_names.add(attachment.file.name)
         try:
             try:
                 attachment.file.open(u'rb')
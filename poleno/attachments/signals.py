@@ -10,6 +10,9 @@ from .models import Attachment
 def delete_file_on_attachment_post_delete(sender, instance, **kwargs):
     u"""
     Django ``FileField`` does not delete associated files when deleted. We need to delete them
-    manually.
+    manually. Files shared by other attachments in content-addressed mode are kept until their
+    last attachment is deleted.
     """
+    if Attachment.objects.filter(file=instance.file.name).exists():
+        return
     instance.file.delete(save=False)
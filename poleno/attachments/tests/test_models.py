@@ -1,7 +1,10 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+import os
 import random
+import hashlib
 import datetime
+import mock
 from testfixtures import TempDirectory
 
 from django.core.files.base import ContentFile
@@ -13,6 +16,7 @@ from django.test.utils import override_settings
 
 from poleno.timewarp import timewarp
 from poleno.utils.date import utc_now, utc_datetime_from_local, local_datetime_from_local
+from poleno.utils.misc import random_string
 
 from ..models import Attachment
 
@@ -196,6 +200,82 @@ class AttachmentModelTest(TestCase):
         self.assertEqual(new.generic_id, self.user2.pk)
         self.assertEqual(new.generic_object, self.user2)
 
+    def test_content_type_sniffed_from_file_prefix(self):
+        content = u'x' * (3 * Attachment.SNIFF_SIZE)
+        with mock.patch(u'poleno.attachments.models.magic.from_buffer', return_value=u'text/plain') as from_buffer:
+            obj = self._create_instance(file=ContentFile(content))
+        self.assertEqual(from_buffer.call_args[0][0], content[:Attachment.SNIFF_SIZE])
+        self.assertEqual(obj.size, len(content))
+        self.assertEqual(obj.content, content)
+
+    def test_file_written_in_chunks(self):
+        content = random_string(3 * ContentFile.DEFAULT_CHUNK_SIZE)
+        obj = self._create_instance(file=ContentFile(content))
+        self.assertEqual(obj.size, len(content))
+        self.assertEqual(obj.sha256, hashlib.sha256(content).hexdigest())
+        self.assertEqual(obj.content, content)
+
+    def test_sha256_field_with_default_value_if_omitted(self):
+        obj = self._create_instance(file=ContentFile(u'content'))
+        self.assertEqual(obj.sha256, u'ed7002b439e9ac845f22357d822bac1444730fbdb6016d3ec9432297b9ec9f73')
+
+    @override_settings(ATTACHMENTS_CONTENT_ADDRESSED=True)
+    def test_content_addressed_file_name(self):
+        obj = self._create_instance(file=ContentFile(u'content'))
+        self.assertEqual(obj.file.name, u'attachments/{}'.format(obj.sha256))
+        self.assertEqual(obj.content, u'content')
+
+    @override_settings(ATTACHMENTS_CONTENT_ADDRESSED=True)
+    def test_content_addressed_same_content_shares_file(self):
+        obj1 = self._create_instance(file=ContentFile(u'content'))
+        obj2 = self._create_instance(file=ContentFile(u'content'))
+        obj3 = self._create_instance(file=ContentFile(u'other'))
+        self.assertEqual(obj1.file.name, obj2.file.name)
+        self.assertNotEqual(obj1.file.name, obj3.file.name)
+        self.assertEqual(obj1.refcount, 2)
+        self.assertEqual(obj3.refcount, 1)
+        self.assertEqual(len(os.listdir(os.path.join(self.tempdir.path, u'attachments'))), 2)
+
+    @override_settings(ATTACHMENTS_CONTENT_ADDRESSED=True)
+    def test_content_addressed_clone_shares_file(self):
+        obj = self._create_instance()
+        new = obj.clone(self.user2)
+        with mock.patch.object(Attachment, u'content') as content:
+            new.save()
+        self.assertFalse(content.called)
+        self.assertEqual(new.file.name, obj.file.name)
+        self.assertEqual(new.sha256, obj.sha256)
+        self.assertEqual(new.size, obj.size)
+        self.assertEqual(new.content_type, obj.content_type)
+        self.assertEqual(new.generic_object, self.user2)
+        self.assertEqual(obj.refcount, 2)
+        self.assertEqual(Attachment.objects.get(pk=new.pk).content, u'content')
+
+    @override_settings(ATTACHMENTS_CONTENT_ADDRESSED=True)
+    def test_content_addressed_bulk_create_shares_file(self):
+        obj = self._create_instance(file=ContentFile(u'content'))
+        objs = [
+                Attachment(generic_object=self.user, file=ContentFile(u'content'), name=u'a.txt'),
+                obj.clone(self.user2),
+                ]
+        Attachment.objects.bulk_create(objs)
+        self.assertEqual(obj.refcount, 3)
+        self.assertEqual(len(os.listdir(os.path.join(self.tempdir.path, u'attachments'))), 1)
+
+    @override_settings(ATTACHMENTS_CONTENT_ADDRESSED=True)
+    def test_content_addressed_shared_file_deleted_with_last_attachment(self):
+        obj1 = self._create_instance(file=ContentFile(u'content'))
+        obj2 = obj1.clone(self.user2)
+        obj2.save()
+        path = os.path.join(self.tempdir.path, obj1.file.name)
+
+        obj1.delete()
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(Attachment.objects.get(pk=obj2.pk).content, u'content')
+
+        obj2.delete()
+        self.assertFalse(os.path.exists(path))
+
     def test_repr(self):
         obj = self._create_instance()
         self.assertEqual(repr(obj), u'<Attachment: %s>' % obj.pk)
@@ -224,6 +304,23 @@ class AttachmentModelTest(TestCase):
         result = Attachment.objects.attached_to(User, self.user, User.objects.filter(pk=self.user2.pk), self.user2)
         self.assertItemsEqual(result, [obj1, obj2])
 
+    def test_attached_to_query_method_with_querysets_uses_single_query(self):
+        obj1 = self._create_instance(generic_object=self.user)
+        obj2 = self._create_instance(generic_object=self.user2)
+        ContentType.objects.get_for_models(User, ContentType)
+        with self.assertNumQueries(1):
+            result = Attachment.objects.attached_to(
+                    User.objects.filter(username=u'john'),
+                    ContentType.objects.filter(pk=-1),
+                    ).get_or_none(pk=obj1.pk)
+        self.assertEqual(result, obj1)
+        with self.assertNumQueries(1):
+            result = Attachment.objects.attached_to(
+                    User.objects.filter(username=u'john'),
+                    ContentType.objects.filter(pk=-1),
+                    ).get_or_none(pk=obj2.pk)
+        self.assertIsNone(result)
+
     def test_attached_to_query_method_with_invalid_argument(self):
         with self.assertRaisesMessage(TypeError, u'Expecting QuerySet, Model instance, or Model class.'):
             result = Attachment.objects.attached_to(object)
@@ -235,3 +332,17 @@ class AttachmentModelTest(TestCase):
         sample = random.sample(objs, 10)
         result = Attachment.objects.filter(pk__in=(d.pk for d in sample)).order_by_pk().reverse()
         self.assertEqual(list(result), sorted(sample, key=lambda d: -d.pk))
+
+    def test_bulk_create_query_method(self):
+        objs = [
+                Attachment(generic_object=self.user, file=ContentFile(u'content'), name=u'a.txt'),
+                Attachment(generic_object=self.user2, file=ContentFile(u'<html></html>'), name=u'b.html'),
+                ]
+        with self.assertNumQueries(1):
+            Attachment.objects.bulk_create(objs)
+        result = Attachment.objects.order_by_pk()
+        self.assertEqual([(a.generic_object, a.name, a.size, a.content_type, a.content) for a in result], [
+                (self.user, u'a.txt', 7, u'text/plain', u'content'),
+                (self.user2, u'b.html', 13, u'text/html', u'<html></html>'),
+                ])
+        self.assertNotEqual(result[0].file.name, result[1].file.name)
@@ -7,7 +7,8 @@ from testfixtures import TempDirectory
 
 from django.core.files.base import ContentFile
 from django.conf.urls import patterns, url
-from django.http import HttpResponseNotModified, FileResponse, JsonResponse
+from django.http import HttpResponse, HttpResponseNotModified, FileResponse, JsonResponse
+from django.http import StreamingHttpResponse
 from django.contrib.auth.models import User
 from django.utils.http import http_date
 from django.test import TestCase
@@ -89,6 +90,80 @@ class AttachmentViewsTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(u''.join(response.streaming_content), u'content')
 
+    def _create_range_instance(self):
+        return Attachment.objects.create(
+                generic_object=self.user,
+                file=ContentFile(u'0123456789'),
+                name=u'filename',
+                content_type=u'text/plain',
+                )
+
+    def test_download_accepts_ranges(self):
+        obj = self._create_range_instance()
+        response = self.client.get(u'/download/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response[u'Accept-Ranges'], u'bytes')
+
+    def test_download_with_single_range(self):
+        obj = self._create_range_instance()
+        response = self.client.get(u'/download/', HTTP_RANGE=u'bytes=2-5')
+        self.assertIs(type(response), StreamingHttpResponse)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response[u'Content-Range'], u'bytes 2-5/10')
+        self.assertEqual(response[u'Content-Length'], u'4')
+        self.assertEqual(u''.join(response.streaming_content), u'2345')
+
+    def test_download_with_open_and_suffix_ranges(self):
+        obj = self._create_range_instance()
+        response = self.client.get(u'/download/', HTTP_RANGE=u'bytes=7-')
+        self.assertEqual(response[u'Content-Range'], u'bytes 7-9/10')
+        self.assertEqual(u''.join(response.streaming_content), u'789')
+        response = self.client.get(u'/download/', HTTP_RANGE=u'bytes=-4')
+        self.assertEqual(response[u'Content-Range'], u'bytes 6-9/10')
+        self.assertEqual(u''.join(response.streaming_content), u'6789')
+        response = self.client.get(u'/download/', HTTP_RANGE=u'bytes=8-100')
+        self.assertEqual(response[u'Content-Range'], u'bytes 8-9/10')
+        self.assertEqual(u''.join(response.streaming_content), u'89')
+
+    def test_download_with_multiple_ranges(self):
+        obj = self._create_range_instance()
+        response = self.client.get(u'/download/', HTTP_RANGE=u'bytes=0-1, 5-6')
+        self.assertEqual(response.status_code, 206)
+        content_type, boundary = response[u'Content-Type'].split(u'; boundary=')
+        self.assertEqual(content_type, u'multipart/byteranges')
+        content = u''.join(response.streaming_content)
+        self.assertEqual(response[u'Content-Length'], str(len(content)))
+        self.assertEqual(content, (
+                u'\r\n--{0}\r\nContent-Type: text/plain\r\nContent-Range: bytes 0-1/10\r\n\r\n01'
+                u'\r\n--{0}\r\nContent-Type: text/plain\r\nContent-Range: bytes 5-6/10\r\n\r\n56'
+                u'\r\n--{0}--\r\n').format(boundary))
+
+    def test_download_with_unsatisfiable_range(self):
+        obj = self._create_range_instance()
+        response = self.client.get(u'/download/', HTTP_RANGE=u'bytes=10-20')
+        self.assertIs(type(response), HttpResponse)
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response[u'Content-Range'], u'bytes */10')
+
+    def test_download_with_invalid_range_sends_whole_file(self):
+        obj = self._create_range_instance()
+        for header in [u'bytes=5-2', u'bytes=a-b', u'items=0-1', u'bytes']:
+            response = self.client.get(u'/download/', HTTP_RANGE=header)
+            self.assertIs(type(response), FileResponse)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(u''.join(response.streaming_content), u'0123456789')
+
+    def test_download_with_if_range(self):
+        obj = self._create_range_instance()
+        response = self.client.get(u'/download/')
+        last_modified = response[u'Last-Modified']
+        response = self.client.get(u'/download/', HTTP_RANGE=u'bytes=2-5', HTTP_IF_RANGE=last_modified)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(u''.join(response.streaming_content), u'2345')
+        response = self.client.get(u'/download/', HTTP_RANGE=u'bytes=2-5', HTTP_IF_RANGE=http_date(0))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(u''.join(response.streaming_content), u'0123456789')
+
     def test_upload(self):
         response = self.client.post(u'/upload/', {u'files': ContentFile(u'uploaded', name=u'filename')})
         self.assertIs(type(response), JsonResponse)
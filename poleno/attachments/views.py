@@ -29,4 +29,5 @@ def upload(request, generic_object, download_url_func):
 
 def download(request, attachment):
     path = os.path.join(settings.MEDIA_ROOT, attachment.file.name)
-    return send_file_response(request, path, attachment.name, attachment.content_type)
+    return send_file_response(request, path, attachment.name, attachment.content_type,
+            accept_ranges=True)
@@ -4,6 +4,8 @@ import logging
 
 from django_cron import CronJobBase, Schedule
 
+from poleno.utils.date import local_now
+
 
 default_app_config = 'poleno.cron.apps.CronConfig'
 cron_logger = logging.getLogger(u'poleno.cron')
@@ -38,3 +40,64 @@ def cron_job(**kwargs):
         CronJob.__name__ = function.__name__
         return CronJob
     return decorator
+
+class CronSweep(object):
+    u"""
+    Shared scan for cron jobs run at the same times. Every job registered with the sweep provides a
+    function returning primary keys of its candidate objects and a matcher. When the first of the
+    jobs is run in a cron slot, the sweep loads the union of all candidates from ``queryset`` in
+    chunks of ``chunk_size`` objects and hands every loaded object to matchers of all jobs it
+    is a candidate for. The database cost of loading the objects is paid once per cron slot no
+    matter how many jobs share the sweep. Matchers return lists of primary keys of matched objects
+    and only these lists are kept.
+
+    Every job gets the result of the sweep only once. If the job asks for it again, e.g. when it is
+    retried later in the same slot, the sweep is run again. Jobs should check the matched objects
+    again before acting on them, as jobs run before them in the same slot may have changed them.
+
+    Example:
+        sweep = CronSweep([u'09:00'], lambda: Model.objects.prefetch_related(u'items'))
+        sweep.register(u'job',
+                lambda: Model.objects.values_list(u'pk', flat=True),
+                lambda obj: [obj.pk] if obj.is_interesting else [])
+
+        @cron_job(run_at_times=[u'09:00'])
+        def job():
+            for obj in Model.objects.chunked(pks=sweep.matched(u'job')):
+                pass
+    """
+
+    def __init__(self, run_at_times, queryset, chunk_size=100):
+        self.run_at_times = run_at_times
+        self.queryset = queryset
+        self.chunk_size = chunk_size
+        self.jobs = {}
+        self.reset()
+
+    def reset(self):
+        self.slot = None
+        self.results = {}
+
+    def register(self, name, candidates, matcher):
+        self.jobs[name] = (candidates, matcher)
+
+    def current_slot(self):
+        now = local_now()
+        time = now.strftime(u'%H:%M')
+        return now.date(), max([t for t in self.run_at_times if t <= time] or [None])
+
+    def run(self):
+        candidates = dict((name, set(c())) for name, (c, _) in self.jobs.items())
+        results = dict((name, []) for name in self.jobs)
+        pks = sorted(set().union(*candidates.values()))
+        for obj in self.queryset().chunked(self.chunk_size, pks=pks):
+            for name, (_, matcher) in self.jobs.items():
+                if obj.pk in candidates[name]:
+                    results[name].extend(matcher(obj))
+        self.slot = self.current_slot()
+        self.results = results
+
+    def matched(self, name):
+        if self.slot != self.current_slot() or name not in self.results:
+            self.run()
+        return self.results.pop(name)
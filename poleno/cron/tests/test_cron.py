@@ -1,6 +1,7 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
 import datetime
+import mock
 
 from django.test import TestCase
 from django_cron import CronJobBase, CronJobLog
@@ -9,7 +10,7 @@ from poleno.timewarp import timewarp
 from poleno.utils.date import local_datetime_from_local, utc_now
 
 from . import CronTestCaseMixin
-from .. import cron_job
+from .. import cron_job, CronSweep
 from ..cron import clear_old_cronlogs
 
 class CronJobTest(CronTestCaseMixin, TestCase):
@@ -296,6 +297,55 @@ class CronJobTest(CronTestCaseMixin, TestCase):
                 )
         timewarp.reset()
 
+class CronSweepTest(TestCase):
+    u"""
+    Tests ``CronSweep`` class.
+    """
+
+    def setUp(self):
+        timewarp.enable()
+        timewarp.jump(local_datetime_from_local(u'2010-10-05 10:10:00'))
+
+    def tearDown(self):
+        timewarp.reset()
+
+    def _create_sweep(self, **kwargs):
+        loaded = []
+        def chunked(chunk_size, pks):
+            loaded.append((chunk_size, pks))
+            return [mock.Mock(pk=pk) for pk in pks]
+        queryset = mock.Mock(chunked=chunked)
+        sweep = CronSweep([u'09:00', u'10:00'], lambda: queryset, **kwargs)
+        sweep.register(u'even', lambda: [2, 4, 6], lambda o: [o.pk] if o.pk != 4 else [])
+        sweep.register(u'odd', lambda: [1, 3, 5, 6], lambda o: [o.pk * 10] if o.pk % 2 else [])
+        return sweep, loaded
+
+    def test_union_of_candidates_is_loaded_once_in_chunks(self):
+        sweep, loaded = self._create_sweep(chunk_size=4)
+        self.assertEqual(sweep.matched(u'even'), [2, 6])
+        self.assertEqual(sweep.matched(u'odd'), [10, 30, 50])
+        self.assertEqual(loaded, [(4, [1, 2, 3, 4, 5, 6])])
+
+    def test_sweep_is_run_again_if_job_asks_again(self):
+        sweep, loaded = self._create_sweep()
+        self.assertEqual(sweep.matched(u'even'), [2, 6])
+        self.assertEqual(sweep.matched(u'even'), [2, 6])
+        self.assertEqual(len(loaded), 2)
+
+    def test_sweep_is_run_again_in_next_slot(self):
+        sweep, loaded = self._create_sweep()
+        self.assertEqual(sweep.matched(u'even'), [2, 6])
+        timewarp.jump(local_datetime_from_local(u'2010-10-06 10:10:00'))
+        self.assertEqual(sweep.matched(u'odd'), [10, 30, 50])
+        self.assertEqual(len(loaded), 2)
+
+    def test_reset_discards_results(self):
+        sweep, loaded = self._create_sweep()
+        self.assertEqual(sweep.matched(u'even'), [2, 6])
+        sweep.reset()
+        self.assertEqual(sweep.matched(u'odd'), [10, 30, 50])
+        self.assertEqual(len(loaded), 2)
+
 class ClearOldCronlogsCronjobTest(TestCase):
     u"""
     Tests ``poleno.cron.cron.clear_old_cronlogs`` cron job.
@@ -37,6 +37,16 @@ class Column(object):
         self.post_coerce_validators = post_coerce_validators # post coerce
         self.field = field
 
+    @property
+    def validates_other_rows(self):
+        return self.unique
+
+    def from_text(self, value):
+        u"""
+        Converts the value read from a text file to the value type expected by the column.
+        """
+        return unicode(value)
+
     def validate_type(self, value):
         if self.value_type is None:
             return
@@ -113,15 +123,31 @@ class Column(object):
 
     def do_post_ceorce_validation(self, sheet, row_idx, value):
         self.validate_blank(value)
-        self.validate_unique(sheet, row_idx, value)
         self.validate_post_coerce_validators(value)
 
-    def do_import(self, sheet, row_idx, value):
+    def do_parse(self, sheet, row_idx, value):
+        u"""
+        Validates and coerces the value independently of other rows and of the database, so it may
+        run in a worker process. In such case ``sheet`` is ``None``.
+        """
         self.do_pre_coerce_validation(sheet, row_idx, value)
         value = self.do_coerce(sheet, row_idx, value)
         self.do_post_ceorce_validation(sheet, row_idx, value)
         return value
 
+    def do_resolve(self, sheet, row_idx, value):
+        u"""
+        Validates the parsed value against other rows of the sheet and resolves it against the
+        database. Always runs in the main process, row by row.
+        """
+        self.validate_unique(sheet, row_idx, value)
+        return value
+
+    def do_import(self, sheet, row_idx, value):
+        value = self.do_parse(sheet, row_idx, value)
+        value = self.do_resolve(sheet, row_idx, value)
+        return value
+
     def value_repr(self, value):
         return common_repr(value)
 
@@ -138,7 +164,11 @@ class TextColumn(Column):
         self.min_length = min_length # pre coerce
         self.max_length = max_length # pre coerce
         self.regex = regex # pre coerce
-        self.unique_slug = unique_slug # pre coerce
+        self.unique_slug = unique_slug # post coerce
+
+    @property
+    def validates_other_rows(self):
+        return self.unique or self.unique_slug
 
     def validate_min_length(self, value):
         if self.min_length is None:
@@ -183,7 +213,10 @@ class TextColumn(Column):
         self.validate_min_length(value)
         self.validate_max_length(value)
         self.validate_regex(value)
+
+    def do_resolve(self, sheet, row_idx, value):
         self.validate_unique_slug(sheet, row_idx, value)
+        return super(TextColumn, self).do_resolve(sheet, row_idx, value)
 
 class NumericColumn(Column):
     value_type = Number
@@ -193,6 +226,15 @@ class NumericColumn(Column):
         self.min_value = min_value # pre coerce
         self.max_value = max_value # pre coerce
 
+    def from_text(self, value):
+        # Values which are not numbers are left for validate_type() to report.
+        for value_type in [int, float]:
+            try:
+                return value_type(value)
+            except ValueError:
+                pass
+        return unicode(value)
+
     def validate_min_value(self, value):
         if self.min_value is None:
             return
@@ -217,6 +259,12 @@ class NumericColumn(Column):
 class FloatColumn(NumericColumn):
     value_type = Real
 
+    def from_text(self, value):
+        try:
+            return float(value)
+        except ValueError:
+            return unicode(value)
+
 class IntegerColumn(NumericColumn):
     value_type = Integral
 
@@ -239,28 +287,60 @@ class ForeignKeyColumn(Column):
         self.to_model = to_model
         self.to_field = to_field
 
+    @property
+    def to_model_field(self):
+        if self.to_field == u'pk':
+            return self.to_model._meta.pk
+        return self.to_model._meta.get_field(self.to_field)
+
+    def get_relation_map(self, sheet):
+        u"""
+        Returns a map of all ``to_model`` instances by their ``to_field`` values. The map is loaded
+        only once per sheet and target model and shared by all columns and cells relating to them.
+        Values shared by multiple instances are mapped to ``None``.
+        """
+        if not hasattr(sheet, u'_relation_map_cache'):
+            sheet._relation_map_cache = {}
+        key = (self.to_model, self.to_field)
+        if key not in sheet._relation_map_cache:
+            attname = self.to_model_field.attname
+            relation_map = {}
+            for obj in self.to_model.objects.all().iterator():
+                value = getattr(obj, attname)
+                relation_map[value] = None if value in relation_map else obj
+            sheet._relation_map_cache[key] = relation_map
+        return sheet._relation_map_cache[key]
+
     def apply_relation(self, sheet, value):
         try:
-            obj = self.to_model.objects.get(**{self.to_field: unicode(value)})
-        except self.to_model.DoesNotExist:
+            key = self.to_model_field.to_python(unicode(value))
+        except ValidationError as e:
+            raise CellError(u'relation_type', u'Invalid value {} for {}: {}',
+                    self.value_repr(value), self.to_field, u'; '.join(e.messages))
+        relation_map = self.get_relation_map(sheet)
+        if key not in relation_map:
             raise CellError(u'relation_not_found', u'There is no {} with {}={}',
                     self.to_model.__name__, self.to_field, self.value_repr(value))
-        except self.to_model.MultipleObjectsReturned:
+        obj = relation_map[key]
+        if obj is None:
             raise CellError(u'relation_found_more', u'There are multiple {} with {}={}',
                     self.to_model.__name__, self.to_field, self.value_repr(value))
-        except Exception as e:
-            raise CellError(u'relation_type', u'Invalid value {} for {}: {}',
-                    self.value_repr(value), self.to_field, e)
         if obj in sheet.book.marked_for_deletion:
             raise CellError(u'deleted', u'{} with {}={} was omitted and is going to be deleted',
                     self.to_model.__name__, self.to_field, self.value_repr(value))
         return obj
 
-    def do_coerce(self, sheet, row_idx, value):
-        value = super(ForeignKeyColumn, self).do_coerce(sheet, row_idx, value)
-        value = self.apply_relation(sheet, value)
+    def do_parse(self, sheet, row_idx, value):
+        # Post coerce validation applies to related objects, so it's postponed to do_resolve().
+        self.do_pre_coerce_validation(sheet, row_idx, value)
+        value = self.do_coerce(sheet, row_idx, value)
         return value
 
+    def do_resolve(self, sheet, row_idx, value):
+        value = self.apply_relation(sheet, value)
+        self.do_post_ceorce_validation(sheet, row_idx, value)
+        return super(ForeignKeyColumn, self).do_resolve(sheet, row_idx, value)
+
 class ManyToManyColumn(ForeignKeyColumn):
     value_type = basestring
 
@@ -1,17 +1,21 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
-from collections import defaultdict, OrderedDict
+import hashlib
+from collections import defaultdict, deque, OrderedDict
+from multiprocessing import Pool, cpu_count
 from optparse import make_option
-from openpyxl import load_workbook
 
 from django.core.management.base import BaseCommand, CommandError
 from django.core.management.color import color_style
-from django.db import transaction, DEFAULT_DB_ALIAS
-from django.contrib.admin.utils import NestedObjects
+from django.db import models, transaction, connections, router, DEFAULT_DB_ALIAS
+from django.db.models.deletion import Collector
 from django.utils.text import capfirst
+from django.utils.timezone import now
 
 from poleno.utils.misc import squeeze, Bunch
 
+from .sources import TextValue, open_source
+
 
 def common_repr(value):
     if isinstance(value, basestring):
@@ -31,6 +35,10 @@ class CellError(Exception):
         msg = msg.format(*args, **kwargs) if args or kwargs else msg
         super(CellError, self).__init__(msg)
 
+    def __reduce__(self):
+        # Cell errors are passed from worker processes; See Sheet.parse_rows()
+        return (CellError, (self.code, self.args[0]))
+
 class RollbackDryRun(Exception):
     pass
 
@@ -40,13 +48,22 @@ class Sheet(object):
     model = None
     ignore_superfluous_columns = False
     delete_omitted = True
+    bulk_save = False
+    incremental = False
+    parse_chunk_size = 1000
     columns = None
 
-    def __init__(self, book, ws):
+    def __init__(self, book, source):
         self.book = book
         self.importer = book.importer
-        self.ws = ws
+        self.source = source
         self.column_map = None
+        self.skip_rows = False
+        self._fingerprints = {}
+        self._stored_fingerprints = {}
+        self._existing_pks = set()
+        self._skipped_pks = set()
+        self._skipped_rows = set()
 
     def error(self, code, msg, *args, **kwargs):
         if code:
@@ -66,20 +83,27 @@ class Sheet(object):
     def do_reset(self):
         self.reset_model(self.model)
 
+    def rows(self):
+        # Read errors must abort the import, otherwise the rows not read would be deleted.
+        try:
+            for row in self.source.rows(self.label):
+                yield row
+        except Exception as e:
+            raise CommandError(u'Could not read sheet "{}": {}'.format(self.label, e))
+
     def validate_structure(self):
         errors = 0
 
         self.column_map = {}
-        row = next(self.ws.rows, [])
-        for col_idx, column in enumerate(row):
-            if column.value is None or column.value.startswith(u'#'):
+        row = next(self.rows(), [])
+        for col_idx, value in enumerate(row):
+            if value is None or value.startswith(u'#'):
                 continue
-            if column.value in self.column_map:
-                self.error(None, u'Sheet "{}" contains duplicate column: {}',
-                        self.label, column.value)
+            if value in self.column_map:
+                self.error(None, u'Sheet "{}" contains duplicate column: {}', self.label, value)
                 errors += 1
             else:
-                self.column_map[column.value] = col_idx
+                self.column_map[unicode(value)] = col_idx
 
         expected_columns = set(c.label for c in self.columns.__dict__.values())
         found_columns = set(self.column_map)
@@ -96,22 +120,154 @@ class Sheet(object):
         if errors:
             raise RollingError(errors)
 
-    def process_cell(self, row_idx, row, column):
+    @classmethod
+    def parse_cell(cls, column_map, row_idx, row, column):
         try:
-            col_idx = self.column_map[column.label]
+            col_idx = column_map[column.label]
         except KeyError:
-            self.cell_error(u'missing', row_idx, column, u'Missing column')
-            raise RollingError
+            raise CellError(u'missing', u'Missing column')
 
         try:
-            value = row[col_idx].value
+            value = row[col_idx]
         except IndexError:
             value = None
         if value is None:
             value = column.default
+        elif isinstance(value, TextValue):
+            value = column.from_text(value)
+
+        return column.do_parse(None, row_idx, value)
+
+    @classmethod
+    def parse_rows(cls, column_map, rows):
+        u"""
+        Parses cells of given ``(row_idx, values, skipped)`` triples. Returns ``(row_idx, parsed)``
+        pairs, where ``parsed`` maps column labels to parsed values or to ``CellError`` raised while
+        parsing them. Only columns validated against other rows are parsed for skipped rows.
+        Depends neither on other rows nor on the database, so it may run in a worker process.
+        """
+        res = []
+        for row_idx, row, skipped in rows:
+            parsed = {}
+            for column in cls.columns.__dict__.values():
+                if skipped and not column.validates_other_rows:
+                    continue
+                try:
+                    parsed[column.label] = cls.parse_cell(column_map, row_idx, row, column)
+                except CellError as e:
+                    parsed[column.label] = e
+            res.append((row_idx, parsed))
+        return res
+
+    @property
+    def fingerprint_sheet(self):
+        opts = self.model._meta
+        return u'{}.{}'.format(opts.app_label, opts.object_name)
+
+    def fingerprint(self, row, extra=None):
+        u"""
+        Returns SHA1 hash of raw cell values of the row. Override it and pass ``extra`` if the
+        imported values depend on anything else but the row.
+        """
+        values = []
+        for column in sorted(self.columns.__dict__.values(), key=lambda c: c.label):
+            col_idx = self.column_map.get(column.label)
+            value = row[col_idx] if col_idx is not None and col_idx < len(row) else None
+            values.append((column.label, value))
+        return hashlib.sha1(repr((values, extra))).hexdigest()
+
+    def load_fingerprints(self):
+        from .models import RowFingerprint
+        # Rows may be skipped only if rows of all the sheets they relate to are unchanged, otherwise
+        # their relations could have changed as well.
+        related_models = set(c.to_model for c in self.columns.__dict__.values()
+                if hasattr(c, u'to_model'))
+        self.skip_rows = (not self.importer.full
+                and not (related_models & self.book.changed_models))
+        if self.skip_rows:
+            self._stored_fingerprints = dict(RowFingerprint.objects
+                    .sheet(self.fingerprint_sheet).values_list(u'key', u'fingerprint'))
+            self._existing_pks = set(self.model.objects.values_list(u'pk', flat=True))
+
+    def save_fingerprints(self):
+        from .models import RowFingerprint
+        RowFingerprint.objects.sheet(self.fingerprint_sheet).delete()
+        RowFingerprint.objects.bulk_create([
+                RowFingerprint(sheet=self.fingerprint_sheet, key=key, fingerprint=fingerprint)
+                for key, fingerprint in self._fingerprints.items()])
+
+    def skip_row(self, row_idx, row):
+        u"""
+        Records the fingerprint of the row and decides whether the row may be skipped. The row is
+        skipped if its instance exists and the row is the same as it was in the last successful
+        import. Duplicate rows follow the decision made for the first row with the same ``pk``.
+        """
+        try:
+            pk = self.parse_cell(self.column_map, row_idx, row, self.columns.pk)
+        except CellError:
+            return False
+        key = unicode(pk)
+        if key in self._fingerprints:
+            return pk in self._skipped_pks
+        fingerprint = self.fingerprint(row)
+        self._fingerprints[key] = fingerprint
+        if not self.skip_rows or pk not in self._existing_pks:
+            return False
+        if self._stored_fingerprints.get(key) != fingerprint:
+            return False
+        self._skipped_pks.add(pk)
+        return True
+
+    def read_chunks(self, rows):
+        chunk = []
+        for row_idx, values in enumerate(rows, start=1):
+            if row_idx == 1 or all(v is None for v in values):
+                continue
+            skipped = self.incremental and self.skip_row(row_idx, values)
+            if skipped:
+                self._skipped_rows.add(row_idx)
+            chunk.append((row_idx, values, skipped))
+            if len(chunk) >= self.parse_chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def parse_chunks(self, chunks):
+        u"""
+        Parses chunks of rows in the importer worker processes and yields their results in order.
+        Chunks are read in this process, so read errors are raised here, and only a few chunks are
+        read ahead of the parsed ones.
+        """
+        pool = self.importer.pool
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(_parse_rows, [(self.__class__, self.column_map, chunk)]))
+            if len(pending) > 2 * self.importer.jobs:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    def parsed_rows(self, rows):
+        u"""
+        Yields ``(row_idx, parsed)`` pairs of all nonempty rows but the header in their order.
+        Chunks of rows are parsed in the importer worker processes, if there are any.
+        """
+        chunks = self.read_chunks(rows)
+        if self.importer.pool is None:
+            results = (self.parse_rows(self.column_map, c) for c in chunks)
+        else:
+            results = self.parse_chunks(chunks)
+        for result in results:
+            for row_idx, parsed in result:
+                yield row_idx, parsed
 
+    def process_cell(self, row_idx, row, column):
         try:
-            return column.do_import(self, row_idx, value)
+            value = row[column.label]
+            if isinstance(value, CellError):
+                raise value
+            return column.do_resolve(self, row_idx, value)
         except CellError as e:
             self.cell_error(e.code, row_idx, column, e)
             raise RollingError
@@ -128,14 +284,29 @@ class Sheet(object):
             raise RollingError(errors)
         return res
 
+    def process_skipped_row(self, row_idx, row):
+        # Skipped rows are not imported, but other rows must still be validated against them.
+        errors = 0
+        for column in self.columns.__dict__.values():
+            if column.label in row:
+                try:
+                    self.process_cell(row_idx, row, column)
+                except RollingError as e:
+                    errors += e.count
+        if errors:
+            raise RollingError(errors)
+
     def process_rows(self, rows):
         res = OrderedDict()
         errors = 0
-        for row_idx, row in enumerate(rows, start=1):
-            if row_idx == 1 or all(c.value is None for c in row):
-                continue
+        if self.incremental:
+            self.load_fingerprints()
+        for row_idx, row in self.parsed_rows(rows):
             try:
-                res[row_idx] = self.process_row(row_idx, row)
+                if row_idx in self._skipped_rows:
+                    self.process_skipped_row(row_idx, row)
+                else:
+                    res[row_idx] = self.process_row(row_idx, row)
             except RollingError as e:
                 errors += e.count
         if errors:
@@ -156,9 +327,79 @@ class Sheet(object):
             raise RollingError(errors)
         return res
 
+    def bulk_begin(self):
+        self._bulk_objects = []
+        self._bulk_relations = {}
+        for column in self.columns.__dict__.values():
+            if column.field is not None and column.field.is_related:
+                column.field.bulk_load(self)
+
+    def bulk_update(self, objs):
+        u"""
+        Updates all fields of given instances with a single ``UPDATE`` statement per batch of
+        instances, setting every column with ``CASE`` on the primary key.
+        """
+        opts = self.model._meta
+        fields = [f for f in opts.concrete_fields if not f.primary_key]
+        connection = connections[router.db_for_write(self.model)]
+        qn = connection.ops.quote_name
+        # Keep the number of query parameters below the SQLite limit of 999.
+        batch_size = max(1, 900 // (2*len(fields) + 1))
+        for i in range(0, len(objs), batch_size):
+            batch = objs[i:i+batch_size]
+            pks = [opts.pk.get_db_prep_value(obj.pk, connection) for obj in batch]
+            sets = []
+            params = []
+            for field in fields:
+                sets.append(u'{} = CASE {} {} END'.format(qn(field.column), qn(opts.pk.column),
+                        u' '.join([u'WHEN %s THEN %s'] * len(batch))))
+                for obj, pk in zip(batch, pks):
+                    params.append(pk)
+                    params.append(field.get_db_prep_save(getattr(obj, field.attname), connection))
+            params.extend(pks)
+            with connection.cursor() as cursor:
+                cursor.execute(u'UPDATE {} SET {} WHERE {} IN ({})'.format(
+                        qn(opts.db_table), u', '.join(sets), qn(opts.pk.column),
+                        u', '.join([u'%s'] * len(batch))), params)
+
+    def bulk_history(self, objs):
+        u"""
+        Creates historical records of given ``(instance, created)`` pairs if the model has its
+        history registered. Bulk save mode does not emit ``post_save`` signals that create them
+        otherwise.
+        """
+        opts = self.model._meta
+        manager_name = getattr(opts, u'simple_history_manager_attribute', None)
+        if manager_name is None:
+            return
+        history_model = getattr(self.model, manager_name).model
+        history_date = now()
+        history_model.objects.bulk_create([history_model(
+                history_date=history_date,
+                history_type=u'+' if created else u'~',
+                history_user=None,
+                **{f.attname: getattr(obj, f.attname) for f in opts.fields}
+                ) for obj, created in objs])
+
+    def bulk_write(self):
+        created = [obj for obj, c in self._bulk_objects if c]
+        changed = [obj for obj, c in self._bulk_objects if not c]
+        # Models computing some of their fields in their ``save()`` methods compute them in
+        # ``prepare_save()`` methods called by ``bulk_create()`` as well.
+        if hasattr(self.model, u'prepare_save'):
+            for obj in changed:
+                obj.prepare_save()
+        self.model.objects.bulk_create(created)
+        self.bulk_update(changed)
+        self.bulk_history(self._bulk_objects)
+        for column in self.columns.__dict__.values():
+            if column.field is not None and column.field.is_related:
+                column.field.bulk_write(self)
+
     def save_object(self, fields, original):
         # Save only if the instance is new or changed to prevent excessive change history. Many to
-        # many relations may only be saved after the instance is created.
+        # many relations may only be saved after the instance is created. In bulk save mode the
+        # instances and their relations are gathered and written only after all rows are saved.
         obj = original or self.model()
         has_changed = False
         for column in self.columns.__dict__.values():
@@ -168,13 +409,20 @@ class Sheet(object):
                 if not field.is_related and field.has_changed(obj, value):
                     field.save(obj, value)
                     has_changed = True
-        if has_changed:
+        if has_changed and self.bulk_save:
+            self._bulk_objects.append((obj, original is None))
+        elif has_changed:
             obj.save()
         for column in self.columns.__dict__.values():
             if column.field is not None:
                 field = column.field
                 value = fields[field.name]
-                if field.is_related and field.has_changed(obj, value):
+                if not field.is_related:
+                    continue
+                if self.bulk_save and field.bulk_has_changed(self, obj, value):
+                    field.bulk_save(self, obj, value)
+                    has_changed = True
+                elif not self.bulk_save and field.has_changed(obj, value):
                     field.save(obj, value)
                     has_changed = True
         return obj, has_changed
@@ -183,6 +431,11 @@ class Sheet(object):
         errors = 0
         stats = Bunch(created=0, changed=0, unchanged=0, deleted=0)
         originals = {o.pk: o for o in self.model.objects.all()}
+        for pk in self._skipped_pks:
+            del originals[pk]
+            stats.unchanged += 1
+        if self.bulk_save:
+            self.bulk_begin()
         for row_idx, values in rows.items():
             try:
                 pk = values[self.columns.pk.label]
@@ -207,6 +460,8 @@ class Sheet(object):
         # all sheets are imported to prevent unintentional cascades.
         if errors:
             raise RollingError(errors)
+        if self.bulk_save:
+            self.bulk_write()
         for obj in originals.values():
             if self.delete_omitted:
                 self.book.marked_for_deletion[obj] = self
@@ -228,7 +483,7 @@ class Sheet(object):
             errors += e.count
 
         try:
-            rows = self.process_rows(self.ws.rows)
+            rows = self.process_rows(self.rows())
             stats = self.save_objects(rows)
         except RollingError as e:
             errors += e.count
@@ -237,57 +492,44 @@ class Sheet(object):
             self.importer.write(1, u'Importing {} failed.', self.model.__name__)
             raise RollingError(errors)
 
+        if stats.created or stats.changed or stats.deleted:
+            self.book.changed_models.add(self.model)
+        if self.incremental:
+            self.save_fingerprints()
+        if self._skipped_pks:
+            self.importer.write(1, u'Skipped {} unchanged rows of {}',
+                    len(self._skipped_pks), self.model.__name__)
+
         self.importer.write(1,
                 u'Imported {}: {} created, {} changed, {} unchanged and {} marked for deletion',
                 self.model.__name__, stats.created, stats.changed, stats.unchanged, stats.deleted)
 
-    def _collect_related_format(self, collected, level=0):
-        res = []
-        for obj in collected:
-            if isinstance(obj, list):
-                res.extend(self._collect_related_format(obj, level=level+1))
-            else:
-                res.append(u'\n\t{}-- {}: {}'.format(u'    '*level,
-                        capfirst(obj._meta.verbose_name), common_repr(obj)))
-        return res
-
-    def _collect_related(self, obj):
-        collector = NestedObjects(using=DEFAULT_DB_ALIAS)
-        collector.collect([obj])
-        collected = collector.nested()
-        return u''.join(self._collect_related_format(collected))
-
-    def delete_object(self, obj):
-        inputed = self.importer.input_yes_no(
-                u'{} was omitted. All the following related items will be deleted with it:{}',
-                u'Are you sure, you want to delete it?',
-                self.obj_repr(obj), self._collect_related(obj),
-                default=u'N')
-        if inputed != u'Y':
-            raise RollingError
-        obj.delete()
-
     def obj_repr(self, obj):
         return common_repr(obj)
 
+def _parse_rows(args):
+    sheet_class, column_map, rows = args
+    return sheet_class.parse_rows(column_map, rows)
+
 class Book(object):
     sheets = None
 
-    def __init__(self, importer, wbs):
+    def __init__(self, importer, sources):
         self.importer = importer
-        self.wbs = wbs
+        self.sources = sources
         self.marked_for_deletion = None
+        self.changed_models = None
         self.sheet_map = None
 
     def validate_structure(self):
         self.sheet_map = {}
-        for wb in self.wbs:
-            for sheet in wb.get_sheet_names():
+        for source in self.sources:
+            for sheet in source.sheet_names():
                 if sheet.startswith(u'#'):
                     continue
                 if sheet in self.sheet_map:
                     raise CommandError(u'The files contain duplicate sheet: {}'.format(sheet))
-                self.sheet_map[sheet] = wb[sheet]
+                self.sheet_map[sheet] = source
 
         expected_sheets = set(s.label for s in self.sheets)
         found_sheets = set(self.sheet_map.keys())
@@ -320,36 +562,101 @@ class Book(object):
         sheets = []
         for sheet in self.sheets:
             if sheet.label in self.sheet_map:
-                ws = self.sheet_map[sheet.label]
-                sheets.append(sheet(self, ws))
+                source = self.sheet_map[sheet.label]
+                sheets.append(sheet(self, source))
 
         if self.importer.reset:
             for sheet in reversed(sheets):
                 sheet.do_reset()
 
         self.marked_for_deletion = OrderedDict()
+        self.changed_models = set()
         for sheet in sheets:
             try:
                 sheet.do_import()
             except RollingError as e:
                 errors += e.count
 
-        for obj, sheet in reversed(self.marked_for_deletion.items()):
-            try:
-                sheet.delete_object(obj)
-            except RollingError as e:
-                errors += e.count
+        try:
+            self.delete_marked()
+        except RollingError as e:
+            errors += e.count
+
+        if errors:
+            raise RollingError(errors)
 
+    def plan_deletion(self):
+        u"""
+        Collects all instances marked for deletion together with all their related instances
+        that would be deleted with them in a single collector. Returns the collector and the
+        number of instances it is going to delete per model.
+        """
+        marked = OrderedDict()
+        for obj in self.marked_for_deletion:
+            marked.setdefault(obj.__class__, []).append(obj)
+
+        errors = 0
+        collector = Collector(using=DEFAULT_DB_ALIAS)
+        for model, objs in marked.items():
+            try:
+                collector.collect(objs)
+            except models.ProtectedError as e:
+                self.importer.error(None,
+                        u'Omitted {} can not be deleted, the following items refer to them:{}',
+                        model._meta.verbose_name_plural,
+                        u''.join(u'\n\t-- {}'.format(common_repr(o)) for o in e.protected_objects))
+                errors += len(objs)
         if errors:
             raise RollingError(errors)
 
+        counts = defaultdict(int)
+        for model, instances in collector.data.items():
+            counts[model] += len(instances)
+        for queryset in collector.fast_deletes:
+            counts[queryset.model] += queryset.count()
+        return collector, counts
+
+    def delete_marked(self):
+        if not self.marked_for_deletion:
+            return
+
+        for obj, sheet in self.marked_for_deletion.items():
+            self.importer.write(2, u'Omitted {}', sheet.obj_repr(obj))
+
+        collector, counts = self.plan_deletion()
+        omitted = defaultdict(int)
+        for obj in self.marked_for_deletion:
+            omitted[obj.__class__] += 1
+        omitted_lines = []
+        related_lines = []
+        for model, count in sorted(counts.items(), key=lambda i: unicode(i[0]._meta.verbose_name)):
+            name = capfirst(model._meta.verbose_name_plural)
+            if omitted[model]:
+                omitted_lines.append(u'\n\t-- {}: {}'.format(name, omitted[model]))
+            if count > omitted[model]:
+                related_lines.append(u'\n\t-- {}: {}'.format(name, count - omitted[model]))
+
+        inputed = self.importer.input_yes_no(
+                u'The following items were omitted:{}\n'
+                u'All the following related items will be deleted with them:{}',
+                u'Are you sure, you want to delete them?',
+                u''.join(omitted_lines), u''.join(related_lines) or u'\n\t-- Nothing',
+                default=u'N')
+        if inputed != u'Y':
+            raise RollingError(len(self.marked_for_deletion))
+        collector.delete()
+
 class Importer(object):
 
     def __init__(self, book, options, stdout):
         self.reset = options[u'reset']
         self.dry_run = options[u'dry_run']
+        self.full = options[u'full']
+        self.encoding = options[u'encoding']
         self.assume = options[u'assume']
         self.verbosity = int(options[u'verbosity'])
+        self.jobs = int(options[u'jobs'] or cpu_count())
+        self.pool = None
         self.stdout = stdout
         self.color_style = color_style()
         self.book = book
@@ -415,18 +722,26 @@ class Importer(object):
         else:
             self.write(0, u'Importing: {}', u', '.join(filenames))
 
-        wbs = []
+        sources = []
         for filename in filenames:
             try:
-                wb = load_workbook(filename, read_only=True)
+                source = open_source(filename, self.encoding)
             except Exception as e:
                 raise CommandError(u'Could not read input file: {}'.format(e))
-            wbs.append(wb)
+            sources.append(source)
 
+        # Worker processes only parse cells and never touch the database connection inherited
+        # from this process.
+        if self.jobs > 1:
+            self.pool = Pool(self.jobs)
         try:
-            self.book(self, wbs).do_import()
+            self.book(self, sources).do_import()
         except RollingError as e:
             raise CommandError(u'Detected {} errors; Rolled back'.format(e.count))
+        finally:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool = None
 
         if self.dry_run:
             self.write(0, u'Rolled back (dry run)')
@@ -436,7 +751,7 @@ class Importer(object):
 
 
 class LoadSheetsCommand(BaseCommand):
-    help = u'Loads .xlsx files with data'
+    help = u'Loads .xlsx, .csv or .tsv files with data'
     args = u'file [file ...]'
     option_list = BaseCommand.option_list + (
         make_option(u'--dry-run', action=u'store_true', default=False,
@@ -449,10 +764,25 @@ class LoadSheetsCommand(BaseCommand):
                 Discard current data before imporing the files. Only data from sheets present in
                 the files are discarded. Data from missing sheets are left untouched.
                 """)),
+        make_option(u'--full', action=u'store_true', default=False,
+            help=squeeze(u"""
+                Process all rows, including rows which did not change since the last successful
+                import. Use it if the data were changed other way than by importing the files.
+                """)),
         make_option(u'--assume', choices=[u'yes', u'no', u'default'],
             help=squeeze(u"""
                 Assume yes/no/default answer to all yes/no questions.
                 """)),
+        make_option(u'--encoding', default=u'utf-8',
+            help=squeeze(u"""
+                Encoding of .csv and .tsv files. Each of them contains a single sheet named after
+                the file, optionally gzipped. Defaults to utf-8.
+                """)),
+        make_option(u'--jobs', type=u'int',
+            help=squeeze(u"""
+                Number of worker processes parsing the files. Defaults to the number of CPUs. Use
+                1 to parse the files in the main process.
+                """)),
         )
     importer = Importer
     book = None
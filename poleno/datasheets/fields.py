@@ -1,5 +1,7 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+from collections import defaultdict
+
 from django.core.exceptions import ObjectDoesNotExist
 
 from poleno.utils.misc import ensure_tuple
@@ -98,10 +100,9 @@ class ForeignKeyField(Field):
             return None
 
     def has_changed(self, obj, value):
-        try:
-            return getattr(obj, self.name) != value
-        except ObjectDoesNotExist:
-            return True
+        # Compare primary keys not to fetch the related object of every row.
+        attname = obj._meta.get_field(self.name).attname
+        return getattr(obj, attname) != (value.pk if value is not None else None)
 
 class ManyToManyField(Field):
     is_related = True
@@ -111,3 +112,50 @@ class ManyToManyField(Field):
 
     def has_changed(self, obj, value):
         return set(getattr(obj, self.name).all()) != set(value)
+
+    def through(self, sheet):
+        field = sheet.model._meta.get_field(self.name)
+        through = field.rel.through
+        source = through._meta.get_field(field.m2m_field_name())
+        target = through._meta.get_field(field.m2m_reverse_field_name())
+        return through, source.attname, target.attname
+
+    def bulk_load(self, sheet):
+        u"""
+        Loads current relations of all sheet model instances at once for bulk save mode. Maps
+        every instance to its related instances and the primary keys of their intermediate rows.
+        """
+        through, source, target = self.through(sheet)
+        current = defaultdict(dict)
+        queryset = through.objects.values_list(u'pk', source, target)
+        for through_pk, source_pk, target_pk in queryset.iterator():
+            current[source_pk][target_pk] = through_pk
+        sheet._bulk_relations[self.name] = (current, {})
+
+    def bulk_has_changed(self, sheet, obj, value):
+        current, _ = sheet._bulk_relations[self.name]
+        return set(current.get(obj.pk, {})) != set(v.pk for v in value)
+
+    def bulk_save(self, sheet, obj, value):
+        _, changed = sheet._bulk_relations[self.name]
+        changed[obj.pk] = set(v.pk for v in value)
+
+    def bulk_write(self, sheet):
+        u"""
+        Deletes intermediate rows of removed relations and creates rows of added relations
+        gathered by ``bulk_save()``.
+        """
+        through, source, target = self.through(sheet)
+        current, changed = sheet._bulk_relations[self.name]
+        removed = []
+        added = []
+        for source_pk, target_pks in changed.items():
+            for target_pk, through_pk in current.get(source_pk, {}).items():
+                if target_pk not in target_pks:
+                    removed.append(through_pk)
+            for target_pk in target_pks:
+                if target_pk not in current.get(source_pk, {}):
+                    added.append(through(**{source: source_pk, target: target_pk}))
+        for i in range(0, len(removed), 500):
+            through.objects.filter(pk__in=removed[i:i+500]).delete()
+        through.objects.bulk_create(added)
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import poleno.utils.misc
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RowFingerprint',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('sheet', models.CharField(help_text='Model imported from the sheet in "app_label.ModelName" format.', max_length=255)),
+                ('key', models.CharField(help_text='Primary key of the imported row.', max_length=255)),
+                ('fingerprint', models.CharField(help_text='SHA1 hash of the cell values of the row as it was imported the last time. Rows with unchanged fingerprints are skipped by incremental imports.', max_length=40)),
+            ],
+            options={
+            },
+            bases=(poleno.utils.misc.FormatMixin, models.Model),
+        ),
+        migrations.AlterUniqueTogether(
+            name='rowfingerprint',
+            unique_together=set([('sheet', 'key')]),
+        ),
+    ]
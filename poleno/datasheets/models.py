@@ -0,0 +1,44 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+from django.db import models
+
+from poleno.utils.models import QuerySet
+from poleno.utils.misc import FormatMixin, squeeze
+
+
+class RowFingerprintQuerySet(QuerySet):
+    def sheet(self, sheet):
+        return self.filter(sheet=sheet)
+
+class RowFingerprint(FormatMixin, models.Model):
+    # May NOT be empty
+    sheet = models.CharField(max_length=255,
+            help_text=squeeze(u"""
+                Model imported from the sheet in "app_label.ModelName" format.
+                """))
+
+    # May NOT be empty
+    key = models.CharField(max_length=255,
+            help_text=squeeze(u"""
+                Primary key of the imported row.
+                """))
+
+    # May NOT be empty
+    fingerprint = models.CharField(max_length=40,
+            help_text=squeeze(u"""
+                SHA1 hash of the cell values of the row as it was imported the last time. Rows
+                with unchanged fingerprints are skipped by incremental imports.
+                """))
+
+    objects = RowFingerprintQuerySet.as_manager()
+
+    class Meta:
+        unique_together = [
+                [u'sheet', u'key'],
+                ]
+
+    # Indexes:
+    #  -- sheet, key: unique_together
+
+    def __unicode__(self):
+        return u'[{}] {} {}'.format(self.pk, self.sheet, self.key)
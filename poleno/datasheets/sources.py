@@ -0,0 +1,93 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import os
+import csv
+import gzip
+from openpyxl import load_workbook
+
+
+class TextValue(unicode):
+    u"""
+    Cell value read from a text file. Text files do not distinguish value types, so the value is
+    converted by the column it belongs to; See ``Column.from_text()``.
+    """
+    pass
+
+class Source(object):
+    u"""
+    Source of sheet rows. Rows are yielded lazily as lists of cell values, with ``None`` for empty
+    cells. Rows of a sheet may be iterated repeatedly, every time from the beginning.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def sheet_names(self):
+        raise NotImplementedError
+
+    def rows(self, name):
+        raise NotImplementedError
+
+class WorkbookSource(Source):
+    u"""
+    Excel workbook with any number of sheets.
+    """
+
+    def __init__(self, filename):
+        super(WorkbookSource, self).__init__(filename)
+        self.wb = load_workbook(filename, read_only=True)
+
+    def sheet_names(self):
+        return self.wb.get_sheet_names()
+
+    def rows(self, name):
+        for row in self.wb[name].rows:
+            yield [c.value for c in row]
+
+class CsvSource(Source):
+    u"""
+    CSV or TSV file, optionally gzipped, with a single sheet named after the file. For instance,
+    ``/path/to/REGPJ.csv.gz`` contains sheet ``REGPJ``.
+    """
+
+    def __init__(self, filename, delimiter, compressed=False, encoding=u'utf-8'):
+        super(CsvSource, self).__init__(filename)
+        self.delimiter = delimiter
+        self.compressed = compressed
+        self.encoding = encoding
+        self.name = os.path.basename(filename).split(u'.')[0]
+        # Fail early if the file can't be read.
+        self.open().close()
+
+    def open(self):
+        if self.compressed:
+            return gzip.open(self.filename, u'rb')
+        return open(self.filename, u'rb')
+
+    def sheet_names(self):
+        return [self.name]
+
+    def rows(self, name):
+        assert name == self.name
+        with self.open() as f:
+            # Python 2 csv module works with byte strings only.
+            for row_idx, row in enumerate(csv.reader(f, delimiter=str(self.delimiter))):
+                values = [TextValue(v.decode(self.encoding)) if v else None for v in row]
+                if row_idx == 0 and values and values[0] is not None:
+                    values[0] = TextValue(values[0].lstrip(u'\ufeff'))
+                yield values
+
+def open_source(filename, encoding=u'utf-8'):
+    u"""
+    Opens the source according to the file extension: ``.csv`` and ``.tsv`` files, optionally
+    with ``.gz`` extension, are read as text files and all other files as Excel workbooks.
+    """
+    name = filename.lower()
+    compressed = name.endswith(u'.gz')
+    if compressed:
+        name = name[:-3]
+    if name.endswith(u'.csv'):
+        return CsvSource(filename, u',', compressed, encoding)
+    if name.endswith(u'.tsv'):
+        return CsvSource(filename, u'\t', compressed, encoding)
+    return WorkbookSource(filename)
@@ -0,0 +1,158 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+from StringIO import StringIO
+from testfixtures import TempDirectory
+
+from django.core.management.base import OutputWrapper
+from django.db import models
+from django.test import TestCase
+
+from poleno.utils.models import QuerySet
+from poleno.utils.history import register_history
+from poleno.utils.misc import slugify
+
+from .. import Field, ManyToManyField, Columns, TextColumn, IntegerColumn, ManyToManyColumn
+from .. import Sheet, Book, Importer
+
+class DatasheetsTestTag(models.Model):
+    name = models.CharField(max_length=255)
+    slug = models.CharField(max_length=255)
+    objects = QuerySet.as_manager()
+
+    class Meta:
+        app_label = u'utils'
+
+    def prepare_save(self, update_fields=None):
+        if update_fields is None or u'name' in update_fields:
+            self.slug = slugify(self.name)
+            if update_fields is not None:
+                update_fields.append(u'slug')
+
+    def save(self, *args, **kwargs):
+        self.prepare_save(kwargs.get(u'update_fields', None))
+        super(DatasheetsTestTag, self).save(*args, **kwargs)
+
+@register_history
+class DatasheetsTestItem(models.Model):
+    name = models.CharField(max_length=255)
+    slug = models.CharField(max_length=255)
+    tags = models.ManyToManyField(DatasheetsTestTag)
+    objects = QuerySet.as_manager()
+
+    class Meta:
+        app_label = u'utils'
+        verbose_name = u'item'
+
+    def prepare_save(self, update_fields=None):
+        if update_fields is None or u'name' in update_fields:
+            self.slug = slugify(self.name)
+            if update_fields is not None:
+                update_fields.append(u'slug')
+
+    def save(self, *args, **kwargs):
+        self.prepare_save(kwargs.get(u'update_fields', None))
+        super(DatasheetsTestItem, self).save(*args, **kwargs)
+
+class DatasheetsTestComment(models.Model):
+    item = models.ForeignKey(DatasheetsTestItem)
+
+    class Meta:
+        app_label = u'utils'
+        verbose_name = u'comment'
+
+class DatasheetsTestLock(models.Model):
+    item = models.ForeignKey(DatasheetsTestItem, on_delete=models.PROTECT)
+
+    class Meta:
+        app_label = u'utils'
+        verbose_name = u'lock'
+
+    def __unicode__(self):
+        return u'Lock of {}'.format(self.item.name)
+
+class TagSheet(Sheet):
+    label = u'Tags'
+    model = DatasheetsTestTag
+    bulk_save = True
+    incremental = True
+
+    columns = Columns(
+            pk=IntegerColumn(u'ID',
+                unique=True, min_value=1,
+                field=Field(),
+                ),
+            name=TextColumn(u'Name',
+                unique_slug=True, max_length=255,
+                field=Field(),
+                ),
+            )
+
+class ItemSheet(Sheet):
+    label = u'Items'
+    model = DatasheetsTestItem
+    bulk_save = True
+    incremental = True
+
+    columns = Columns(
+            pk=IntegerColumn(u'ID',
+                unique=True, min_value=1,
+                field=Field(),
+                ),
+            name=TextColumn(u'Name',
+                unique_slug=True, max_length=255,
+                field=Field(),
+                ),
+            tags=ManyToManyColumn(u'Tags', DatasheetsTestTag,
+                blank=True,
+                field=ManyToManyField(),
+                ),
+            )
+
+class TestBook(Book):
+    sheets = [TagSheet, ItemSheet]
+
+
+class DatasheetsTestCaseMixin(TestCase):
+
+    def _pre_setup(self):
+        super(DatasheetsTestCaseMixin, self)._pre_setup()
+        self.tempdir = TempDirectory()
+
+    def _post_teardown(self):
+        self.tempdir.cleanup()
+        super(DatasheetsTestCaseMixin, self)._post_teardown()
+
+
+    def _write_file(self, filename, rows, delimiter=u',', encoding=u'utf-8'):
+        content = u''.join(delimiter.join(r) + u'\n' for r in rows)
+        return self.tempdir.write(filename, content.encode(encoding))
+
+    def _tags_file(self, *rows):
+        return self._write_file(u'Tags.csv', [[u'ID', u'Name']] + list(rows))
+
+    def _items_file(self, *rows):
+        return self._write_file(u'Items.csv', [[u'ID', u'Name', u'Tags']] + list(rows))
+
+    def _import(self, filenames, book=TestBook, **kwargs):
+        options = {
+                u'reset': False,
+                u'dry_run': False,
+                u'full': False,
+                u'encoding': u'utf-8',
+                u'assume': u'yes',
+                u'verbosity': 1,
+                u'jobs': 1,
+                }
+        options.update(kwargs)
+        self.output = StringIO()
+        importer = Importer(book, options, OutputWrapper(self.output))
+        importer.do_import(filenames)
+        return self.output.getvalue()
+
+    def _create_tag(self, pk, name):
+        return DatasheetsTestTag.objects.create(pk=pk, name=name)
+
+    def _create_item(self, pk, name, tags=()):
+        item = DatasheetsTestItem.objects.create(pk=pk, name=name)
+        item.tags = tags
+        return item
@@ -0,0 +1,66 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+from django.test import TestCase
+
+from .. import Column, TextColumn, NumericColumn, FloatColumn, IntegerColumn, CellError
+from ..sources import TextValue
+
+class FromTextTest(TestCase):
+    u"""
+    Tests ``Column.from_text()`` conversion of values read from text files. Checks that numeric
+    columns convert numbers and leave other values for type validation.
+    """
+
+    def _convert(self, column, value):
+        res = column.from_text(TextValue(value))
+        self.assertNotIsInstance(res, TextValue)
+        return res
+
+    def test_column_returns_unicode(self):
+        res = self._convert(Column(u'Column'), u'123')
+        self.assertEqual(res, u'123')
+        self.assertIs(type(res), unicode)
+
+    def test_text_column_returns_unicode(self):
+        res = self._convert(TextColumn(u'Column'), u'Modrý')
+        self.assertEqual(res, u'Modrý')
+        self.assertIs(type(res), unicode)
+
+    def test_numeric_column_converts_integers(self):
+        res = self._convert(NumericColumn(u'Column'), u'-42')
+        self.assertEqual(res, -42)
+        self.assertIs(type(res), int)
+
+    def test_numeric_column_converts_floats(self):
+        res = self._convert(NumericColumn(u'Column'), u'4.25')
+        self.assertEqual(res, 4.25)
+        self.assertIs(type(res), float)
+
+    def test_numeric_column_leaves_other_values(self):
+        res = self._convert(NumericColumn(u'Column'), u'forty two')
+        self.assertEqual(res, u'forty two')
+        self.assertIs(type(res), unicode)
+
+    def test_float_column_converts_integers_to_floats(self):
+        res = self._convert(FloatColumn(u'Column'), u'42')
+        self.assertEqual(res, 42.0)
+        self.assertIs(type(res), float)
+
+    def test_float_column_leaves_other_values(self):
+        res = self._convert(FloatColumn(u'Column'), u'forty two')
+        self.assertEqual(res, u'forty two')
+        self.assertIs(type(res), unicode)
+
+    def test_integer_column_converts_integers(self):
+        column = IntegerColumn(u'Column')
+        self.assertEqual(column.do_parse(None, 2, self._convert(column, u'42')), 42)
+
+    def test_integer_column_rejects_floats(self):
+        column = IntegerColumn(u'Column')
+        with self.assertRaisesMessage(CellError, u'Expecting Integral but found float'):
+            column.do_parse(None, 2, self._convert(column, u'4.25'))
+
+    def test_integer_column_rejects_other_values(self):
+        column = IntegerColumn(u'Column')
+        with self.assertRaisesMessage(CellError, u'Expecting Integral but found unicode'):
+            column.do_parse(None, 2, self._convert(column, u'forty two'))
@@ -0,0 +1,309 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import mock
+
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from . import DatasheetsTestCaseMixin, DatasheetsTestTag, DatasheetsTestItem, ItemSheet
+from . import DatasheetsTestComment, DatasheetsTestLock
+from ..models import RowFingerprint
+
+class BulkSaveTest(DatasheetsTestCaseMixin, TestCase):
+    u"""
+    Tests importing sheets in bulk save mode. Checks that created and changed instances are written
+    with their derived fields, that their history is recorded and that their many to many
+    relations are added and removed.
+    """
+
+    def test_created_instances_are_inserted_with_derived_fields(self):
+        self._import([
+                self._tags_file([u'1', u'Red Tag'], [u'2', u'Blue Tag']),
+                self._items_file([u'1', u'First Item', u'1 2'], [u'2', u'Second Item', u'']),
+                ])
+        self.assertEqual(list(DatasheetsTestTag.objects.order_by(u'pk').values_list(u'pk', u'name', u'slug')), [
+                (1, u'Red Tag', u'red-tag'),
+                (2, u'Blue Tag', u'blue-tag'),
+                ])
+        self.assertEqual(list(DatasheetsTestItem.objects.order_by(u'pk').values_list(u'pk', u'name', u'slug')), [
+                (1, u'First Item', u'first-item'),
+                (2, u'Second Item', u'second-item'),
+                ])
+
+    def test_bulk_update_writes_all_columns_of_changed_instances(self):
+        self._create_item(1, u'First Item')
+        self._create_item(2, u'Second Item')
+        self._create_item(3, u'Third Item')
+        self._import([
+                self._tags_file(),
+                self._items_file([u'1', u'First Changed', u''], [u'2', u'Second Item', u''],
+                    [u'3', u'Third Changed', u'']),
+                ])
+        self.assertEqual(list(DatasheetsTestItem.objects.order_by(u'pk').values_list(u'pk', u'name', u'slug')), [
+                (1, u'First Changed', u'first-changed'),
+                (2, u'Second Item', u'second-item'),
+                (3, u'Third Changed', u'third-changed'),
+                ])
+        self.assertIn(u'Imported DatasheetsTestItem: 0 created, 2 changed, 1 unchanged', self.output.getvalue())
+
+    def test_bulk_history_records_created_and_changed_instances(self):
+        self._create_item(1, u'First Item')
+        self._create_item(2, u'Second Item')
+        DatasheetsTestItem.history.all().delete()
+        self._import([
+                self._tags_file(),
+                self._items_file([u'1', u'First Changed', u''], [u'2', u'Second Item', u''],
+                    [u'3', u'Third Item', u'']),
+                ])
+        self.assertEqual(sorted(DatasheetsTestItem.history.values_list(u'id', u'history_type', u'name', u'slug')), [
+                (1, u'~', u'First Changed', u'first-changed'),
+                (3, u'+', u'Third Item', u'third-item'),
+                ])
+
+    def test_many_to_many_relations_are_added_and_removed(self):
+        tags = [self._create_tag(pk, u'Tag {}'.format(pk)) for pk in [1, 2, 3]]
+        self._create_item(1, u'First Item', [tags[0], tags[1]])
+        self._create_item(2, u'Second Item', [tags[0]])
+        self._create_item(3, u'Third Item', [tags[2]])
+        through = DatasheetsTestItem.tags.through
+        kept = through.objects.get(datasheetstestitem_id=1, datasheetstesttag_id=1)
+        self._import([
+                self._tags_file([u'1', u'Tag 1'], [u'2', u'Tag 2'], [u'3', u'Tag 3']),
+                self._items_file([u'1', u'First Item', u'1 3'], [u'2', u'Second Item', u''],
+                    [u'3', u'Third Item', u'3'], [u'4', u'Fourth Item', u'2 3']),
+                ])
+        self.assertEqual(sorted(through.objects.values_list(u'datasheetstestitem_id', u'datasheetstesttag_id')), [
+                (1, 1), (1, 3), (3, 3), (4, 2), (4, 3),
+                ])
+        # Intermediate rows of unchanged relations are kept.
+        self.assertTrue(through.objects.filter(pk=kept.pk).exists())
+        # Changed relations do not change the instances themselves.
+        self.assertFalse(DatasheetsTestItem.history.filter(history_type=u'~').exists())
+
+class ParallelParsingTest(DatasheetsTestCaseMixin, TestCase):
+    u"""
+    Tests parsing rows in worker processes. Checks that rows are imported in their order and that
+    read errors abort the import before any omitted instances are marked for deletion.
+    """
+
+    def _items_rows(self, count):
+        return [[unicode(pk), u'Item {}'.format(pk), u''] for pk in range(1, count+1)]
+
+    def test_rows_are_imported_in_order(self):
+        with mock.patch.object(ItemSheet, u'parse_chunk_size', 2):
+            self._import([self._tags_file(), self._items_file(*self._items_rows(11))], jobs=2)
+        self.assertEqual(list(DatasheetsTestItem.objects.order_by(u'pk').values_list(u'pk', u'name')),
+                [(pk, u'Item {}'.format(pk)) for pk in range(1, 12)])
+
+    def test_cell_errors_are_reported_from_worker_processes(self):
+        rows = self._items_rows(5)
+        rows[3][0] = u'invalid'
+        with mock.patch.object(ItemSheet, u'parse_chunk_size', 2):
+            with self.assertRaisesMessage(CommandError, u'Detected 1 errors; Rolled back'):
+                self._import([self._tags_file(), self._items_file(*rows)], jobs=2)
+        self.assertIn(u'Invalid value in row 5 of "Items.ID": Expecting Integral but found unicode',
+                self.output.getvalue())
+
+    def _read_error_test(self, jobs):
+        for pk in range(1, 8):
+            self._create_item(pk, u'Item {}'.format(pk))
+        rows = self._items_rows(7)
+        # The very first chunk can't be read, before any chunk is passed to worker processes.
+        rows[0][1] = u'Modrý'
+        filename = self._write_file(u'Items.csv', [[u'ID', u'Name', u'Tags']] + rows,
+                encoding=u'cp1250')
+        with mock.patch.object(ItemSheet, u'parse_chunk_size', 2):
+            with self.assertRaisesMessage(CommandError, u'Could not read sheet "Items": '):
+                self._import([self._tags_file(), filename], jobs=jobs)
+        self.assertNotIn(u'Imported DatasheetsTestItem', self.output.getvalue())
+        self.assertEqual(DatasheetsTestItem.objects.count(), 7)
+
+    def test_read_error_aborts_import_in_worker_processes(self):
+        self._read_error_test(jobs=2)
+
+    def test_read_error_aborts_import_in_main_process(self):
+        self._read_error_test(jobs=1)
+
+class IncrementalImportTest(DatasheetsTestCaseMixin, TestCase):
+    u"""
+    Tests incremental imports. Checks that rows unchanged since the last successful import are
+    skipped unless the rows of sheets they relate to changed or a full import is requested, and
+    that skipped rows are still validated against other rows.
+    """
+
+    def _files(self, tags=None, items=None):
+        if tags is None:
+            tags = [[u'1', u'Red Tag'], [u'2', u'Blue Tag']]
+        if items is None:
+            items = [[u'1', u'First Item', u'1'], [u'2', u'Second Item', u'1 2'],
+                    [u'3', u'Third Item', u'']]
+        return [self._tags_file(*tags), self._items_file(*items)]
+
+    def _fingerprints(self, sheet):
+        return dict(RowFingerprint.objects.sheet(sheet).values_list(u'key', u'fingerprint'))
+
+    def test_first_import_saves_fingerprints_and_skips_nothing(self):
+        output = self._import(self._files())
+        self.assertNotIn(u'Skipped', output)
+        self.assertItemsEqual(self._fingerprints(u'utils.DatasheetsTestTag'), [u'1', u'2'])
+        self.assertItemsEqual(self._fingerprints(u'utils.DatasheetsTestItem'), [u'1', u'2', u'3'])
+
+    def test_unchanged_rows_are_skipped(self):
+        self._import(self._files())
+        fingerprints = self._fingerprints(u'utils.DatasheetsTestItem')
+        output = self._import(self._files(items=[[u'1', u'First Item', u'1'],
+                [u'2', u'Second Changed', u'1 2'], [u'3', u'Third Item', u'']]))
+        self.assertIn(u'Skipped 2 unchanged rows of DatasheetsTestTag', output)
+        self.assertIn(u'Skipped 2 unchanged rows of DatasheetsTestItem', output)
+        self.assertIn(u'Imported DatasheetsTestItem: 0 created, 1 changed, 2 unchanged', output)
+        self.assertEqual(DatasheetsTestItem.objects.get(pk=2).name, u'Second Changed')
+        new_fingerprints = self._fingerprints(u'utils.DatasheetsTestItem')
+        self.assertEqual(new_fingerprints[u'1'], fingerprints[u'1'])
+        self.assertNotEqual(new_fingerprints[u'2'], fingerprints[u'2'])
+
+    def test_skipped_rows_are_not_reimported(self):
+        self._import(self._files())
+        DatasheetsTestItem.objects.filter(pk=1).update(name=u'Changed Elsewhere')
+        self._import(self._files())
+        self.assertEqual(DatasheetsTestItem.objects.get(pk=1).name, u'Changed Elsewhere')
+
+    def test_full_import_reprocesses_all_rows(self):
+        self._import(self._files())
+        DatasheetsTestItem.objects.filter(pk=1).update(name=u'Changed Elsewhere')
+        output = self._import(self._files(), full=True)
+        self.assertNotIn(u'Skipped', output)
+        self.assertIn(u'Imported DatasheetsTestItem: 0 created, 1 changed, 2 unchanged', output)
+        self.assertEqual(DatasheetsTestItem.objects.get(pk=1).name, u'First Item')
+
+    def test_rows_are_reprocessed_if_related_sheet_changed(self):
+        self._import(self._files())
+        DatasheetsTestItem.objects.get(pk=1).tags.clear()
+        output = self._import(self._files(tags=[[u'1', u'Red Tag'], [u'2', u'Blue Changed']]))
+        self.assertIn(u'Skipped 1 unchanged rows of DatasheetsTestTag', output)
+        self.assertNotIn(u'rows of DatasheetsTestItem', output)
+        self.assertIn(u'Imported DatasheetsTestItem: 0 created, 1 changed, 2 unchanged', output)
+        self.assertEqual(list(DatasheetsTestItem.objects.get(pk=1).tags.values_list(u'pk', flat=True)), [1])
+
+    def test_instances_of_rows_not_imported_before_are_not_skipped(self):
+        self._import(self._files())
+        DatasheetsTestItem.objects.filter(pk=3).delete()
+        output = self._import(self._files())
+        self.assertIn(u'Skipped 2 unchanged rows of DatasheetsTestItem', output)
+        self.assertIn(u'Imported DatasheetsTestItem: 1 created, 0 changed, 2 unchanged', output)
+        self.assertEqual(DatasheetsTestItem.objects.get(pk=3).name, u'Third Item')
+
+    def test_omitted_rows_are_deleted_and_forgotten(self):
+        self._import(self._files())
+        output = self._import(self._files(items=[[u'1', u'First Item', u'1'],
+                [u'3', u'Third Item', u'']]))
+        self.assertIn(u'Skipped 2 unchanged rows of DatasheetsTestItem', output)
+        self.assertIn(u'Imported DatasheetsTestItem: 0 created, 0 changed, 2 unchanged and 1 marked for deletion', output)
+        self.assertFalse(DatasheetsTestItem.objects.filter(pk=2).exists())
+        self.assertItemsEqual(self._fingerprints(u'utils.DatasheetsTestItem'), [u'1', u'3'])
+
+    def test_new_row_colliding_with_skipped_row_slug(self):
+        self._import(self._files())
+        fingerprints = self._fingerprints(u'utils.DatasheetsTestItem')
+        with self.assertRaisesMessage(CommandError, u'Detected 1 errors; Rolled back'):
+            self._import(self._files(items=[[u'1', u'First Item', u'1'],
+                    [u'2', u'Second Item', u'1 2'], [u'3', u'Third Item', u''],
+                    [u'4', u'first item', u'']]))
+        self.assertIn(u'Expecting value with unique slug but "first item" has the same slug as "First Item" in row 2',
+                self.output.getvalue())
+        self.assertFalse(DatasheetsTestItem.objects.filter(pk=4).exists())
+        self.assertEqual(self._fingerprints(u'utils.DatasheetsTestItem'), fingerprints)
+
+    def test_new_row_colliding_with_skipped_row_pk(self):
+        self._import(self._files())
+        with self.assertRaisesMessage(CommandError, u'Detected 1 errors; Rolled back'):
+            self._import(self._files(items=[[u'1', u'First Item', u'1'],
+                    [u'2', u'Second Item', u'1 2'], [u'3', u'Third Item', u''],
+                    [u'1', u'Fourth Item', u'']]))
+        self.assertIn(u'Expecting unique value but 1 is in row 2 as well', self.output.getvalue())
+
+class TextFilesImportTest(DatasheetsTestCaseMixin, TestCase):
+    u"""
+    Tests importing sheets from text files. Checks that files are decoded with ``--encoding`` and
+    that numbers are converted by the columns they belong to.
+    """
+
+    def test_import_with_encoding(self):
+        self._import([
+                self._write_file(u'Tags.csv', [[u'ID', u'Name'], [u'1', u'Modrý']], encoding=u'cp1250'),
+                self._items_file(),
+                ], encoding=u'cp1250')
+        self.assertEqual(list(DatasheetsTestTag.objects.values_list(u'pk', u'name')), [(1, u'Modrý')])
+
+    def test_import_tsv_file(self):
+        self._import([
+                self._write_file(u'Tags.tsv', [[u'ID', u'Name'], [u'1', u'Red, Blue']], delimiter=u'\t'),
+                self._items_file([u'1', u'First Item', u'1']),
+                ])
+        self.assertEqual(list(DatasheetsTestTag.objects.values_list(u'pk', u'name')), [(1, u'Red, Blue')])
+        self.assertEqual(list(DatasheetsTestItem.objects.get(pk=1).tags.all()), list(DatasheetsTestTag.objects.all()))
+
+    def test_invalid_number(self):
+        with self.assertRaisesMessage(CommandError, u'Detected 1 errors; Rolled back'):
+            self._import([self._tags_file([u'1.5', u'Red Tag']), self._items_file()])
+        self.assertIn(u'Invalid value in row 2 of "Tags.ID": Expecting Integral but found float',
+                self.output.getvalue())
+
+class DeleteOmittedTest(DatasheetsTestCaseMixin, TestCase):
+    u"""
+    Tests deleting instances omitted from the sheets. Checks that the instances and the related
+    instances deleted with them are counted per model, that protected instances are reported and
+    that the import is rolled back unless the deletion is confirmed.
+    """
+
+    def setUp(self):
+        items = [self._create_item(pk, name) for pk, name in
+                [(1, u'First Item'), (2, u'Second Item'), (3, u'Third Item')]]
+        for item in [items[0], items[0], items[1]]:
+            DatasheetsTestComment.objects.create(item=item)
+
+    def _files(self, *pks):
+        names = {1: u'First Item', 2: u'Second Item', 3: u'Third Item'}
+        return [self._tags_file(), self._items_file(*[[unicode(pk), names[pk], u''] for pk in pks])]
+
+    def test_omitted_and_related_instances_are_counted_per_model(self):
+        output = self._import(self._files(3))
+        self.assertIn(u'The following items were omitted:\n\t-- Items: 2\n'
+                u'All the following related items will be deleted with them:\n\t-- Comments: 3\n',
+                output)
+        self.assertEqual(list(DatasheetsTestItem.objects.values_list(u'pk', flat=True)), [3])
+        self.assertFalse(DatasheetsTestComment.objects.exists())
+
+    def test_omitted_instances_without_related_instances(self):
+        output = self._import(self._files(1, 2))
+        self.assertIn(u'The following items were omitted:\n\t-- Items: 1\n'
+                u'All the following related items will be deleted with them:\n\t-- Nothing\n',
+                output)
+        self.assertEqual(sorted(DatasheetsTestItem.objects.values_list(u'pk', flat=True)), [1, 2])
+        self.assertEqual(DatasheetsTestComment.objects.count(), 3)
+
+    def test_nothing_omitted(self):
+        output = self._import(self._files(1, 2, 3))
+        self.assertNotIn(u'omitted', output)
+        self.assertEqual(DatasheetsTestItem.objects.count(), 3)
+
+    def test_protected_instances_are_reported(self):
+        DatasheetsTestLock.objects.create(item=DatasheetsTestItem.objects.get(pk=1))
+        with self.assertRaisesMessage(CommandError, u'Detected 2 errors; Rolled back'):
+            self._import(self._files(3))
+        self.assertIn(u'Error: Omitted items can not be deleted, the following items refer to them:'
+                u'\n\t-- <DatasheetsTestLock: Lock of First Item>', self.output.getvalue())
+        self.assertNotIn(u'Are you sure', self.output.getvalue())
+        self.assertEqual(DatasheetsTestItem.objects.count(), 3)
+        self.assertEqual(DatasheetsTestComment.objects.count(), 3)
+
+    def test_no_answer_rolls_back(self):
+        with self.assertRaisesMessage(CommandError, u'Detected 2 errors; Rolled back'):
+            self._import(self._files(3), assume=u'no')
+        self.assertIn(u'Are you sure, you want to delete them? Yes/No/Abort [N]: No', self.output.getvalue())
+        self.assertEqual(DatasheetsTestItem.objects.count(), 3)
+        self.assertEqual(DatasheetsTestComment.objects.count(), 3)
+
+    def test_default_answer_rolls_back(self):
+        with self.assertRaisesMessage(CommandError, u'Detected 2 errors; Rolled back'):
+            self._import(self._files(3), assume=u'default')
+        self.assertEqual(DatasheetsTestItem.objects.count(), 3)
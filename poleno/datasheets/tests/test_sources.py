@@ -0,0 +1,122 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import gzip
+from openpyxl import Workbook
+from testfixtures import TempDirectory
+
+from django.test import TestCase
+
+from ..sources import TextValue, CsvSource, WorkbookSource, open_source
+
+class SourcesTest(TestCase):
+    u"""
+    Tests ``open_source()`` and ``CsvSource``. Checks that files are opened by their extensions,
+    that text files are decoded and that their cells are read as ``TextValue``.
+    """
+
+    def setUp(self):
+        self.tempdir = TempDirectory()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+
+    def _write(self, filename, content):
+        return self.tempdir.write(filename, content)
+
+    def _write_gzip(self, filename, content):
+        path = self.tempdir.getpath(filename)
+        with gzip.open(path, u'wb') as f:
+            f.write(content)
+        return path
+
+    def _rows(self, source, name):
+        return [list(r) for r in source.rows(name)]
+
+
+    def test_csv_file(self):
+        source = open_source(self._write(u'Items.csv', b'ID,Name\n1,"Red, Blue"\n'))
+        self.assertIsInstance(source, CsvSource)
+        self.assertEqual(source.sheet_names(), [u'Items'])
+        self.assertEqual(self._rows(source, u'Items'), [[u'ID', u'Name'], [u'1', u'Red, Blue']])
+
+    def test_tsv_file(self):
+        source = open_source(self._write(u'Items.tsv', b'ID\tName\n1\tRed, Blue\n'))
+        self.assertIsInstance(source, CsvSource)
+        self.assertEqual(source.sheet_names(), [u'Items'])
+        self.assertEqual(self._rows(source, u'Items'), [[u'ID', u'Name'], [u'1', u'Red, Blue']])
+
+    def test_gzipped_csv_file(self):
+        source = open_source(self._write_gzip(u'Items.csv.gz', b'ID,Name\n1,Red\n'))
+        self.assertEqual(source.sheet_names(), [u'Items'])
+        self.assertEqual(self._rows(source, u'Items'), [[u'ID', u'Name'], [u'1', u'Red']])
+
+    def test_gzipped_tsv_file(self):
+        source = open_source(self._write_gzip(u'Items.tsv.gz', b'ID\tName\n1\tRed\n'))
+        self.assertEqual(source.sheet_names(), [u'Items'])
+        self.assertEqual(self._rows(source, u'Items'), [[u'ID', u'Name'], [u'1', u'Red']])
+
+    def test_extensions_are_case_insensitive(self):
+        source = open_source(self._write(u'Items.CSV', b'ID\n1\n'))
+        self.assertIsInstance(source, CsvSource)
+        self.assertEqual(source.sheet_names(), [u'Items'])
+
+    def test_sheet_is_named_after_file_without_all_extensions(self):
+        source = open_source(self._write(u'Items.2016.csv', b'ID\n'))
+        self.assertEqual(source.sheet_names(), [u'Items'])
+
+    def test_other_files_are_read_as_workbooks(self):
+        wb = Workbook()
+        wb.active.title = u'Items'
+        wb.active.append([u'ID', u'Name'])
+        wb.active.append([1, u'Red'])
+        path = self.tempdir.getpath(u'book.xlsx')
+        wb.save(path)
+        source = open_source(path)
+        self.assertIsInstance(source, WorkbookSource)
+        self.assertEqual(source.sheet_names(), [u'Items'])
+        self.assertEqual(self._rows(source, u'Items'), [[u'ID', u'Name'], [1, u'Red']])
+
+    def test_missing_file_fails_early(self):
+        with self.assertRaises(IOError):
+            open_source(self.tempdir.getpath(u'Missing.csv'))
+
+    def test_cells_are_text_values(self):
+        source = open_source(self._write(u'Items.csv', b'ID,Name\n1,Red\n'))
+        for row in source.rows(u'Items'):
+            for value in row:
+                self.assertIsInstance(value, TextValue)
+
+    def test_empty_cells_are_none(self):
+        source = open_source(self._write(u'Items.csv', b'ID,Name,Tags\n1,,\n'))
+        self.assertEqual(self._rows(source, u'Items'), [[u'ID', u'Name', u'Tags'], [u'1', None, None]])
+
+    def test_rows_may_be_read_repeatedly(self):
+        source = open_source(self._write(u'Items.csv', b'ID\n1\n'))
+        self.assertEqual(self._rows(source, u'Items'), [[u'ID'], [u'1']])
+        self.assertEqual(self._rows(source, u'Items'), [[u'ID'], [u'1']])
+
+    def test_utf8_encoding_by_default(self):
+        source = open_source(self._write(u'Items.csv', u'ID,Name\n1,Modrý\n'.encode(u'utf-8')))
+        self.assertEqual(self._rows(source, u'Items'), [[u'ID', u'Name'], [u'1', u'Modrý']])
+
+    def test_custom_encoding(self):
+        path = self._write(u'Items.csv', u'ID,Name\n1,Modrý\n'.encode(u'cp1250'))
+        source = open_source(path, u'cp1250')
+        self.assertEqual(self._rows(source, u'Items'), [[u'ID', u'Name'], [u'1', u'Modrý']])
+
+    def test_wrong_encoding_raises_error_while_reading(self):
+        path = self._write(u'Items.csv', u'ID,Name\n1,Modrý\n'.encode(u'cp1250'))
+        source = open_source(path)
+        with self.assertRaises(UnicodeDecodeError):
+            self._rows(source, u'Items')
+
+    def test_bom_is_stripped_from_header(self):
+        path = self._write(u'Items.csv', u'\ufeffID,Name\n1,\ufeffRed\n'.encode(u'utf-8'))
+        source = open_source(path)
+        self.assertEqual(self._rows(source, u'Items'), [[u'ID', u'Name'], [u'1', u'\ufeffRed']])
+
+    def test_bom_is_stripped_from_gzipped_header(self):
+        path = self._write_gzip(u'Items.tsv.gz', u'\ufeffID\tName\n'.encode(u'utf-8'))
+        source = open_source(path)
+        self.assertEqual(self._rows(source, u'Items'), [[u'ID', u'Name']])
@@ -58,6 +58,9 @@ class MessageAdmin(admin.ModelAdmin):
     exclude = [
             ]
     readonly_fields = [
+            u'claim_token',
+            u'claim_expires',
+            u'attempts',
             ]
     raw_id_fields = [
             ]
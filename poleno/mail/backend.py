@@ -80,13 +80,5 @@ class EmailBackend(BaseEmailBackend):
                 html=html or u'',
                 headers=headers,
                 )
-        msg.save()
+        msg.save_with_related(recipients, attachments)
         message.instance = msg
-
-        for recipient in recipients:
-            recipient.message = msg
-            recipient.save()
-
-        for attachment in attachments:
-            attachment.generic_object = msg
-            attachment.save()
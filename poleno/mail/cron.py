@@ -1,8 +1,10 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+import Queue
+import threading
 import traceback
 
-from django.db import transaction
+from django.db import connection, transaction
 from django.conf import settings
 from django.utils.module_loading import import_by_path
 
@@ -14,6 +16,47 @@ from .models import Message
 from .signals import message_sent, message_received
 
 
+def _send_message(transport, message):
+    try:
+        with transaction.atomic():
+            # Lock the message row, so concurrent cron processes never send the same message twice.
+            # If our claim expired and another process has claimed or sent the message since we
+            # claimed it, skip it.
+            locked = (Message.objects
+                    .select_for_update()
+                    .not_processed()
+                    .filter(pk=message.pk, claim_token=message.claim_token)
+                    .values_list(u'pk', flat=True)
+                    )
+            if not list(locked):
+                return
+            transport.send_message(message)
+            message.processed = utc_now()
+            message.save(update_fields=[u'processed'])
+            message_sent.send(sender=None, message=message)
+            nop() # To let tests raise testing exception here.
+        cron_logger.info(u'Sent email: {}'.format(message))
+    except Exception:
+        trace = unicode(traceback.format_exc(), u'utf-8')
+        cron_logger.error(u'Seding email failed: {}\n{}'.format(message, trace))
+        message.release(failed=True)
+
+def _send_worker(klass, queue):
+    # Every worker thread uses its own transport connection and its own database connection.
+    try:
+        with klass() as transport:
+            while True:
+                try:
+                    message = queue.get_nowait()
+                except Queue.Empty:
+                    break
+                _send_message(transport, message)
+    except Exception:
+        trace = unicode(traceback.format_exc(), u'utf-8')
+        cron_logger.error(u'Mail sending worker failed:\n{}'.format(trace))
+    finally:
+        connection.close()
+
 @cron_job(run_every_mins=1)
 def mail():
     # Get inbound mail
@@ -25,23 +68,27 @@ def mail():
             while True:
                 try:
                     with transaction.atomic():
-                        message = next(messages)
+                        # Whatever the transport does after the last message, e.g. remembering
+                        # skipped messages, must be commited as well.
+                        message = next(messages, None)
+                        if message is None:
+                            break
                         nop() # To let tests raise testing exception here.
                     cron_logger.info(u'Received email: {}'.format(message))
-                except StopIteration:
-                    break
                 except Exception:
                     trace = unicode(traceback.format_exc(), u'utf-8')
                     cron_logger.error(u'Receiving emails failed:\n{}'.format(trace))
                     break
 
-    # Process inbound mail; At most 10 messages in one batch
+    # Process inbound mail; At most ``EMAIL_INBOUND_BATCH_SIZE`` messages in one batch. Messages
+    # are claimed first, so concurrent cron processes never process the same message twice. Failed
+    # messages are retried later with exponential backoff.
+    batch_size = getattr(settings, u'EMAIL_INBOUND_BATCH_SIZE', 10)
     messages = (Message.objects
             .inbound()
-            .not_processed()
-            .order_by_pk()
             .prefetch_related(Message.prefetch_recipients())
-            )[:10]
+            .claim(batch_size)
+            )
     for message in messages:
         try:
             with transaction.atomic():
@@ -53,29 +100,34 @@ def mail():
         except Exception:
             trace = unicode(traceback.format_exc(), u'utf-8')
             cron_logger.error(u'Processing received email failed: {}\n{}'.format(message, trace))
+            message.release(failed=True)
 
-    # Send outbound mail; At most 10 messages in one batch
+    # Send outbound mail; At most ``EMAIL_OUTBOUND_BATCH_SIZE`` messages in one batch. With
+    # ``EMAIL_OUTBOUND_WORKERS`` greater than one, the batch is sent by a pool of worker threads.
+    # Messages are claimed the same way as inbound messages.
     path = getattr(settings, u'EMAIL_OUTBOUND_TRANSPORT', None)
     if path:
+        batch_size = getattr(settings, u'EMAIL_OUTBOUND_BATCH_SIZE', 10)
+        workers = getattr(settings, u'EMAIL_OUTBOUND_WORKERS', 1)
         messages = (Message.objects
                 .outbound()
-                .not_processed()
-                .order_by_pk()
                 .prefetch_related(Message.prefetch_recipients())
                 .prefetch_related(Message.prefetch_attachments())
-                )[:10]
+                .claim(batch_size)
+                )
         if messages:
             klass = import_by_path(path)
-            with klass() as transport:
+            if workers > 1:
+                queue = Queue.Queue()
                 for message in messages:
-                    try:
-                        with transaction.atomic():
-                            transport.send_message(message)
-                            message.processed = utc_now()
-                            message.save(update_fields=[u'processed'])
-                            message_sent.send(sender=None, message=message)
-                            nop() # To let tests raise testing exception here.
-                        cron_logger.info(u'Sent email: {}'.format(message))
-                    except Exception:
-                        trace = unicode(traceback.format_exc(), u'utf-8')
-                        cron_logger.error(u'Seding email failed: {}\n{}'.format(message, trace))
+                    queue.put(message)
+                threads = [threading.Thread(target=_send_worker, args=(klass, queue))
+                        for i in range(min(workers, len(messages)))]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            else:
+                with klass() as transport:
+                    for message in messages:
+                        _send_message(transport, message)
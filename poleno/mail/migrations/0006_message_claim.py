@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mail', '0005_address_name_encoding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='attempts',
+            field=models.IntegerField(default=0, help_text='Number of attempts to process the message.'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='claim_expires',
+            field=models.DateTimeField(help_text='Date and time the last claim of the message expires. Until then no other worker may claim the message.', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='claim_token',
+            field=models.CharField(help_text='Token of the worker that claimed the message for processing for the last time.', max_length=32, db_index=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='next_attempt',
+            field=models.DateTimeField(help_text='Date and time before which the message may not be processed again after its last attempt failed. Leave blank if you want the application to process it right away.', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AlterIndexTogether(
+            name='message',
+            index_together=set([('processed', 'next_attempt'), ('created', 'id'), ('processed', 'id')]),
+        ),
+    ]
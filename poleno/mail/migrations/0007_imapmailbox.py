@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import poleno.utils.misc
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mail', '0006_message_claim'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImapMailbox',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(help_text='IMAP mailbox identifier, e.g. "username@host:port".', unique=True, max_length=255)),
+                ('uidvalidity', models.BigIntegerField(default=0, help_text='UIDVALIDITY of the mailbox the last UID was seen in. If the mailbox UIDVALIDITY changes, its UIDs are no longer valid and the mailbox is read from the beginning.')),
+                ('last_uid', models.BigIntegerField(default=0, help_text='The highest UID of a message fetched from the mailbox. Only messages with higher UIDs are fetched next time.')),
+            ],
+            options={
+            },
+            bases=(poleno.utils.misc.FormatMixin, models.Model),
+        ),
+    ]
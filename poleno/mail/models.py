@@ -1,9 +1,12 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+import datetime
+import uuid
 from email.utils import formataddr, parseaddr
 
-from django.db import models
-from django.db.models import Prefetch
+from django.db import models, transaction
+from django.db.models import Prefetch, Q, F
+from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 from django.utils.html import escape
 from django.utils.functional import cached_property
@@ -13,6 +16,7 @@ from jsonfield import JSONField
 
 from poleno.attachments.models import Attachment
 from poleno.utils.models import FieldChoices, QuerySet, join_lookup
+from poleno.utils.date import utc_now
 from poleno.utils.misc import FormatMixin, squeeze
 
 
@@ -25,6 +29,39 @@ class MessageQuerySet(QuerySet):
         return self.filter(processed__isnull=False)
     def not_processed(self):
         return self.filter(processed__isnull=True)
+    def available(self, now=None):
+        u"""
+        Not processed messages that are neither claimed by any worker with an unexpired lease, nor
+        postponed after a failed attempt.
+        """
+        if now is None:
+            now = utc_now()
+        return (self.not_processed()
+                .filter(Q(next_attempt__isnull=True) | Q(next_attempt__lte=now))
+                .filter(Q(claim_expires__isnull=True) | Q(claim_expires__lte=now))
+                )
+    def claim(self, count, lease=None):
+        u"""
+        Claims at most ``count`` available messages of the queryset ordered by ``pk`` for a single
+        worker and returns a queryset of the claimed messages. The claim expires after ``lease``
+        (``EMAIL_CLAIM_LEASE`` seconds by default), so messages claimed by crashed workers are
+        eventually processed by others. The messages are claimed with a single conditional update,
+        so messages claimed by concurrent workers meanwhile are skipped. Every claim counts as an
+        attempt to process the message.
+        """
+        if lease is None:
+            lease = datetime.timedelta(seconds=getattr(settings, u'EMAIL_CLAIM_LEASE', 600))
+        now = utc_now()
+        token = uuid.uuid4().hex
+        pks = list(self.available(now).order_by_pk().values_list(u'pk', flat=True)[:count])
+        if not pks:
+            return self.none()
+        (Message.objects
+                .filter(pk__in=pks)
+                .available(now)
+                .update(claim_token=token, claim_expires=now+lease, attempts=F(u'attempts')+1)
+                )
+        return self.filter(claim_token=token).order_by_pk()
     def order_by_pk(self):
         return self.order_by(u'pk')
     def order_by_created(self):
@@ -96,6 +133,32 @@ class Message(FormatMixin, models.Model):
                 messages it contains all message headers.
                 """))
 
+    # May be empty; Empty if the message was never claimed
+    claim_token = models.CharField(blank=True, max_length=32, db_index=True,
+            help_text=squeeze(u"""
+                Token of the worker that claimed the message for processing for the last time.
+                """))
+
+    # NULL if the message was never claimed
+    claim_expires = models.DateTimeField(blank=True, null=True,
+            help_text=squeeze(u"""
+                Date and time the last claim of the message expires. Until then no other worker
+                may claim the message.
+                """))
+
+    # May NOT be NULL
+    attempts = models.IntegerField(default=0,
+            help_text=squeeze(u"""
+                Number of attempts to process the message.
+                """))
+
+    # NULL if the message may be processed right away
+    next_attempt = models.DateTimeField(blank=True, null=True,
+            help_text=squeeze(u"""
+                Date and time before which the message may not be processed again after its last
+                attempt failed. Leave blank if you want the application to process it right away.
+                """))
+
     # May be empty; Backward generic relation
     attachment_set = generic.GenericRelation(u'attachments.Attachment',
             content_type_field=u'generic_type', object_id_field=u'generic_id')
@@ -106,8 +169,10 @@ class Message(FormatMixin, models.Model):
     #     Should NOT be empty
 
     # Indexes:
-    #  -- processed, id: index_together
-    #  -- created, id:   index_together
+    #  -- processed, id:           index_together
+    #  -- created, id:             index_together
+    #  -- processed, next_attempt: index_together
+    #  -- claim_token:             on field
 
     objects = MessageQuerySet.as_manager()
 
@@ -115,6 +180,7 @@ class Message(FormatMixin, models.Model):
         index_together = [
                 [u'processed', u'id'],
                 [u'created', u'id'],
+                [u'processed', u'next_attempt'],
                 ]
 
     @property
@@ -125,6 +191,43 @@ class Message(FormatMixin, models.Model):
     def from_formatted(self, value):
         self.from_name, self.from_mail = parseaddr(value)
 
+    def save_with_related(self, recipients, attachments):
+        u"""
+        Saves a new message together with its new ``recipients`` and ``attachments`` in one
+        transaction. Recipients and attachments are inserted with one bulk query each, so the
+        number of queries does not depend on their count. Saved recipients and attachments do not
+        get their ``pk`` set.
+        """
+        with transaction.atomic():
+            self.save()
+            for recipient in recipients:
+                recipient.message = self
+            Recipient.objects.bulk_create(recipients)
+            for attachment in attachments:
+                attachment.generic_object = self
+            Attachment.objects.bulk_create(attachments)
+
+    @property
+    def retry_delay(self):
+        u"""
+        Delay before the next attempt to process the message after its last attempt failed. The
+        delay doubles with every attempt, starting at ``EMAIL_RETRY_DELAY`` seconds and capped at
+        ``EMAIL_RETRY_MAX_DELAY`` seconds.
+        """
+        delay = getattr(settings, u'EMAIL_RETRY_DELAY', 60)
+        max_delay = getattr(settings, u'EMAIL_RETRY_MAX_DELAY', 24*60*60)
+        return datetime.timedelta(seconds=min(delay * 2 ** max(self.attempts-1, 0), max_delay))
+
+    def release(self, failed=False):
+        u"""
+        Releases the message claimed with ``MessageQuerySet.claim()`` so other workers may claim
+        it right away. If ``failed`` is True, the next attempt is postponed by ``retry_delay``.
+        Saves only the claim fields.
+        """
+        self.claim_expires = None
+        self.next_attempt = utc_now() + self.retry_delay if failed else None
+        self.save(update_fields=[u'claim_expires', u'next_attempt'])
+
     @staticmethod
     def prefetch_attachments(path=None, queryset=None):
         u"""
@@ -309,3 +412,31 @@ class Recipient(FormatMixin, models.Model):
 
     def __unicode__(self):
         return u'[{}] {}'.format(self.pk, self.mail)
+
+
+class ImapMailbox(FormatMixin, models.Model):
+    # May NOT be empty; Unique
+    name = models.CharField(max_length=255, unique=True,
+            help_text=squeeze(u"""
+                IMAP mailbox identifier, e.g. "username@host:port".
+                """))
+
+    # May NOT be NULL
+    uidvalidity = models.BigIntegerField(default=0,
+            help_text=squeeze(u"""
+                UIDVALIDITY of the mailbox the last UID was seen in. If the mailbox UIDVALIDITY
+                changes, its UIDs are no longer valid and the mailbox is read from the beginning.
+                """))
+
+    # May NOT be NULL
+    last_uid = models.BigIntegerField(default=0,
+            help_text=squeeze(u"""
+                The highest UID of a message fetched from the mailbox. Only messages with higher
+                UIDs are fetched next time.
+                """))
+
+    # Indexes:
+    #  -- name: unique
+
+    def __unicode__(self):
+        return format(self.pk)
@@ -1,9 +1,12 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
 import datetime
+import threading
+import contextlib
 import mock
 
 from django.core.management import call_command
+from django.db import connections, DEFAULT_DB_ALIAS
 from django.test import TestCase
 
 from poleno.timewarp import timewarp
@@ -13,6 +16,7 @@ from poleno.utils.test import override_signals, created_instances
 
 from . import MailTestCaseMixin
 from ..models import Message
+from .. import cron
 from ..cron import mail as mail_cron_job
 from ..signals import message_sent, message_received
 
@@ -46,6 +50,27 @@ class MailCronjobTest(MailTestCaseMixin, TestCase):
                         message_received.connect(message_received_receiver)
                     mail_cron_job().do()
 
+    @contextlib.contextmanager
+    def _shared_connection(self):
+        u"""
+        Lets worker threads use the test database connection, so they see the uncommitted testing
+        data. Messages are sent one at a time, as the connection may not run concurrent
+        transactions.
+        """
+        conn = connections[DEFAULT_DB_ALIAS]
+        lock = threading.Lock()
+        send_message = cron._send_message
+        def locked_send_message(transport, message):
+            connections[DEFAULT_DB_ALIAS] = conn
+            with lock:
+                send_message(transport, message)
+        conn.allow_thread_sharing = True
+        try:
+            with mock.patch(u'poleno.mail.cron._send_message', locked_send_message):
+                with mock.patch.object(conn, u'close'):
+                    yield
+        finally:
+            conn.allow_thread_sharing = False
 
     def test_job_is_run_with_empty_logs(self):
         with mock_cron_jobs() as mock_jobs:
@@ -121,6 +146,76 @@ class MailCronjobTest(MailTestCaseMixin, TestCase):
         self.assertRegexpMatches(logger.mock_calls[1][1][0], u'Seding email failed: <Message: %s>' % msgs[1].pk)
         self.assertRegexpMatches(logger.mock_calls[2][1][0], u'Sent email: <Message: %s>' % msgs[2].pk)
 
+    def test_outbound_transport_batch_size_is_configurable(self):
+        msgs = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None) for i in range(20)]
+        method = mock.Mock()
+        with self.settings(EMAIL_OUTBOUND_BATCH_SIZE=5):
+            self._run_mail_cron_job(outbound=True, send_message_method=method)
+
+        # We expect first 5 messages (sorted by their ``pk``) to be sent.
+        msgs = Message.objects.filter(pk__in=sorted(m.pk for m in msgs)[:5])
+        self.assertItemsEqual(Message.objects.processed(), msgs)
+        self.assertItemsEqual(method.mock_calls, [mock.call(m) for m in msgs])
+
+    def test_outbound_transport_skips_message_sent_by_concurrent_process(self):
+        msgs = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None) for i in range(3)]
+        def method(message):
+            # Simulate a concurrent cron process sending the second message meanwhile.
+            Message.objects.filter(pk=msgs[1].pk).update(processed=utc_now())
+        method = mock.Mock(side_effect=method)
+        self._run_mail_cron_job(outbound=True, send_message_method=method)
+        self.assertItemsEqual(method.mock_calls, [mock.call(msgs[0]), mock.call(msgs[2])])
+
+    def test_outbound_transport_postpones_failed_message(self):
+        msg = self._create_message(type=Message.TYPES.OUTBOUND, processed=None)
+        method = mock.Mock(side_effect=Exception)
+        with mock.patch(u'poleno.mail.cron.cron_logger'):
+            self._run_mail_cron_job(outbound=True, send_message_method=method)
+            self._run_mail_cron_job(outbound=True, send_message_method=method)
+        msg = Message.objects.get(pk=msg.pk)
+        self.assertIsNone(msg.processed)
+        self.assertEqual(msg.attempts, 1)
+        self.assertAlmostEqual(msg.next_attempt, utc_now() + datetime.timedelta(seconds=60), delta=datetime.timedelta(seconds=10))
+        self.assertEqual(method.call_count, 1)
+
+    def test_outbound_transport_skips_messages_claimed_by_concurrent_process(self):
+        msgs = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None) for i in range(3)]
+        Message.objects.filter(pk=msgs[1].pk).claim(1)
+        method = mock.Mock()
+        self._run_mail_cron_job(outbound=True, send_message_method=method)
+        self.assertItemsEqual(method.mock_calls, [mock.call(msgs[0]), mock.call(msgs[2])])
+
+    def test_outbound_transport_with_multiple_workers(self):
+        u"""
+        Checks that with ``EMAIL_OUTBOUND_WORKERS`` greater than one every queued message is sent
+        exactly once, every worker thread uses its own transport and a failing message is released
+        and postponed.
+        """
+        msgs = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None) for i in range(6)]
+        sent = []
+        threads = {}
+        def method(transport, message):
+            threads.setdefault(transport, set()).add(threading.current_thread().ident)
+            if message.pk == msgs[3].pk:
+                raise Exception
+            sent.append(message.pk)
+
+        with self.settings(EMAIL_OUTBOUND_WORKERS=2):
+            with self._shared_connection():
+                with mock.patch(u'poleno.mail.cron.cron_logger'):
+                    self._run_mail_cron_job(outbound=True, send_message_method=method)
+
+        self.assertItemsEqual(sent, [m.pk for m in msgs if m.pk != msgs[3].pk])
+        self.assertItemsEqual(Message.objects.processed(), [m for m in msgs if m.pk != msgs[3].pk])
+        for idents in threads.values():
+            self.assertEqual(len(idents), 1)
+            self.assertNotIn(threading.current_thread().ident, idents)
+        msg = Message.objects.get(pk=msgs[3].pk)
+        self.assertIsNone(msg.processed)
+        self.assertIsNone(msg.claim_expires)
+        self.assertEqual(msg.attempts, 1)
+        self.assertAlmostEqual(msg.next_attempt, utc_now() + datetime.timedelta(seconds=60), delta=datetime.timedelta(seconds=10))
+
     def test_inbound_transport(self):
         u"""
         Checks that ``message_received`` signal is emmited for all messages returned by the
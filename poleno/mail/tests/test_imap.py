@@ -1,6 +1,9 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+import re
 import mock
+import email
+import base64
 import datetime
 from textwrap import dedent
 
@@ -11,8 +14,9 @@ from poleno.utils.date import utc_now
 from poleno.utils.test import override_signals
 
 from . import MailTestCaseMixin
-from ..models import Message, Recipient
+from ..models import Message, Recipient, ImapMailbox
 from ..cron import mail as mail_cron_job
+from ..transports.imap import ImapTransport
 from ..signals import message_sent, message_received
 
 class ImapTransportTest(MailTestCaseMixin, TestCase):
@@ -477,3 +481,345 @@ class ImapTransportTest(MailTestCaseMixin, TestCase):
                 --===============1111111111==--"""))
         transport = self._run_mail_cron_job(mails=[mail])
         self.assertEqual(Message.objects.count(), 0)
+
+class ImapTransportIncrementalTest(ImapTransportTest):
+    u"""
+    Tests ``ImapTransport`` mail transport class in incremental mode. Runs all ``ImapTransportTest``
+    tests checking received messages with incremental mode enabled as well.
+    """
+
+    def _bodystructure(self, part):
+        def quote(value):
+            return u'"%s"' % value.replace(u'\\', u'\\\\').replace(u'"', u'\\"')
+        def params(values):
+            if not values:
+                return u'NIL'
+            return u'(%s)' % u' '.join(u'%s %s' % (quote(k.upper()), quote(v)) for k, v in values)
+
+        if part.is_multipart():
+            subparts = u''.join(self._bodystructure(p) for p in part.get_payload())
+            boundary = params([(u'boundary', part.get_boundary())])
+            return u'(%s %s %s NIL NIL NIL)' % (subparts, quote(part.get_content_subtype().upper()), boundary)
+
+        maintype, subtype = part.get_content_type().upper().split(u'/')
+        payload = part.get_payload()
+        encoding = part.get(u'Content-Transfer-Encoding', u'7bit').upper()
+        fields = [quote(maintype), quote(subtype), params((part.get_params() or [])[1:]), u'NIL', u'NIL', quote(encoding), str(len(payload))]
+        if maintype == u'TEXT':
+            fields.append(str(payload.count(u'\n') + 1))
+        disposition = part.get_params(header=u'Content-Disposition')
+        if disposition:
+            disposition = u'(%s %s)' % (quote(disposition[0][0].upper()), params(disposition[1:]))
+        fields += [u'NIL', disposition or u'NIL', u'NIL', u'NIL']
+        return u'(%s)' % u' '.join(fields)
+
+    def _part_content(self, part, number):
+        for k in number.split(u'.'):
+            if part.is_multipart():
+                part = part.get_payload(int(k) - 1)
+        return part.get_payload()
+
+    def _mock_transport(self, mails=[], uids=None, uidvalidity=u'7'):
+        if uids is None:
+            uids = [10 + k for k in range(len(mails))]
+        mailbox = dict(zip(uids, mails))
+
+        def fetch(k, items):
+            mail = mailbox[k]
+            if items == u'(RFC822.SIZE)':
+                return [u'%s (UID %s RFC822.SIZE %s)' % (k, k, len(mail))]
+            if items == u'(RFC822)':
+                return [(u'%s (UID %s RFC822 {%s}' % (k, k, len(mail)), mail), u')']
+            if items == u'(BODY.PEEK[HEADER] BODYSTRUCTURE)':
+                header = mail.split(u'\n\n', 1)[0] + u'\n\n'
+                structure = self._bodystructure(email.message_from_string(mail))
+                return [(u'%s (UID %s BODY[HEADER] {%s}' % (k, k, len(header)), header), u' BODYSTRUCTURE %s)' % structure]
+            number, offset, length = re.match(r'^\(BODY\.PEEK\[([\d.]+)\]<(\d+)\.(\d+)>\)$', items).groups()
+            content = self._part_content(email.message_from_string(mail), number)
+            chunk = content[int(offset):int(offset)+int(length)]
+            return [(u'%s (UID %s BODY[%s]<%s> {%s}' % (k, k, number, offset, len(chunk)), chunk), u')']
+
+        def uid(command, *args):
+            if command == u'SEARCH':
+                first = int(args[2].split(u':')[0])
+                found = [k for k in sorted(mailbox) if k >= first] or sorted(mailbox)[-1:]
+                return [u'OK', [u' '.join(str(k) for k in found)]]
+            if command == u'FETCH':
+                first, _, last = args[0].partition(u':')
+                response = []
+                for k in sorted(mailbox):
+                    if int(first) <= k <= int(last or first):
+                        response.extend(fetch(k, args[1]))
+                return [u'OK', response]
+            return [u'OK', [None]]
+
+        def status(name, items):
+            if uidvalidity is None:
+                return [u'OK', [u'"%s" ()' % name]]
+            return [u'OK', [u'"%s" (UIDVALIDITY %s)' % (name, uidvalidity)]]
+
+        transport = mock.Mock()
+        # Untagged responses are consumed by ``response()`` like imaplib does.
+        transport.return_value.response.side_effect = [[u'UIDVALIDITY', [uidvalidity]]] + [[u'UIDVALIDITY', [None]]] * 10
+        transport.return_value.status.side_effect = status
+        transport.return_value.uid.side_effect = uid
+        return transport
+
+    def _overrides(self, **override_settings):
+        overrides = {
+                u'EMAIL_OUTBOUND_TRANSPORT': None,
+                u'EMAIL_INBOUND_TRANSPORT': u'poleno.mail.transports.imap.ImapTransport',
+                u'IMAP_SSL': False,
+                u'IMAP_HOST': u'defaulttestinghost',
+                u'IMAP_PORT': 1234,
+                u'IMAP_USERNAME': u'defaulttestingusername',
+                u'IMAP_PASSWORD': u'defaulttestingsecret',
+                u'IMAP_INCREMENTAL': True,
+                u'IMAP_BATCH_SIZE': 3,
+                }
+        overrides.update(override_settings)
+        return overrides
+
+    def _run_mail_cron_job(self, transport=None, ssl_transport=None, mails=[], uids=None, uidvalidity=u'7', delete_settings=(), **override_settings):
+        overrides = self._overrides(**override_settings)
+        transport = self._mock_transport(mails, uids, uidvalidity)
+        imap4 = transport if not overrides[u'IMAP_SSL'] else None
+        imap4ssl = transport if overrides[u'IMAP_SSL'] else None
+
+        with self.settings(**overrides):
+            for name in delete_settings:
+                delattr(settings, name)
+            with mock.patch.multiple(u'poleno.mail.transports.imap', IMAP4=imap4, IMAP4_SSL=imap4ssl):
+                with override_signals(message_sent, message_received):
+                    mail_cron_job().do()
+
+        return transport
+
+    def test_transport_calls_with_empty_inbox(self):
+        transport = self._run_mail_cron_job(IMAP_HOST=u'testhost.com', IMAP_PORT=2000, IMAP_USERNAME=u'TestUser', IMAP_PASSWORD=u'big_secret')
+        self.assertEqual(transport.mock_calls, [
+            mock.call(u'testhost.com', 2000),
+            mock.call().login(u'TestUser', u'big_secret'),
+            mock.call().select(),
+            mock.call().status(u'INBOX', u'(UIDVALIDITY)'),
+            mock.call().uid(u'SEARCH', None, u'UID', u'1:*'),
+            mock.call().close(),
+            mock.call().logout(),
+            ])
+
+    def test_transport_calls_with_nonempty_inbox(self):
+        mails = [self._create_mail() for k in range(4)]
+        transport = self._run_mail_cron_job(mails=mails, IMAP_HOST=u'testhost.com', IMAP_PORT=2000, IMAP_USERNAME=u'TestUser', IMAP_PASSWORD=u'big_secret')
+        self.assertEqual(transport.mock_calls, [
+            mock.call(u'testhost.com', 2000),
+            mock.call().login(u'TestUser', u'big_secret'),
+            mock.call().select(),
+            mock.call().status(u'INBOX', u'(UIDVALIDITY)'),
+            mock.call().uid(u'SEARCH', None, u'UID', u'1:*'),
+            mock.call().uid(u'FETCH', u'10:13', u'(RFC822.SIZE)'),
+            mock.call().uid(u'FETCH', u'10:12', u'(RFC822)'),
+            mock.call().uid(u'STORE', u'10', u'+FLAGS', u'\\Deleted'),
+            mock.call().uid(u'STORE', u'11', u'+FLAGS', u'\\Deleted'),
+            mock.call().uid(u'STORE', u'12', u'+FLAGS', u'\\Deleted'),
+            mock.call().expunge(),
+            mock.call().uid(u'FETCH', u'13:13', u'(RFC822)'),
+            mock.call().uid(u'STORE', u'13', u'+FLAGS', u'\\Deleted'),
+            mock.call().expunge(),
+            mock.call().close(),
+            mock.call().logout(),
+            ])
+
+    def test_mail_stored_to_database_and_deleted_from_imap(self):
+        mail = self._create_mail()
+        transport = self._run_mail_cron_job(mails=[mail])
+        transport.return_value.uid.assert_any_call(u'STORE', u'10', u'+FLAGS', u'\\Deleted')
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_mail_stored_to_database_and_deleted_from_imap_with_multiple_mails_in_inbox(self):
+        mails = [self._create_mail() for k in range(10)]
+        transport = self._run_mail_cron_job(mails=mails)
+        for k in range(10):
+            transport.return_value.uid.assert_any_call(u'STORE', str(10 + k), u'+FLAGS', u'\\Deleted')
+        self.assertEqual(Message.objects.count(), 10)
+
+    def test_last_uid_is_remembered(self):
+        mails = [self._create_mail() for k in range(2)]
+        self._run_mail_cron_job(mails=mails)
+        self.assertEqual(ImapMailbox.objects.get().last_uid, 11)
+
+        # Messages seen before are not fetched again even if they were not deleted.
+        transport = self._run_mail_cron_job(mails=mails + [self._create_mail()])
+        transport.return_value.uid.assert_any_call(u'SEARCH', None, u'UID', u'12:*')
+        transport.return_value.uid.assert_any_call(u'FETCH', u'12:12', u'(RFC822)')
+        self.assertEqual(Message.objects.count(), 3)
+        self.assertEqual(ImapMailbox.objects.get().last_uid, 12)
+
+    def test_highest_uid_returned_for_empty_range_is_ignored(self):
+        mails = [self._create_mail() for k in range(2)]
+        self._run_mail_cron_job(mails=mails)
+        transport = self._run_mail_cron_job(mails=mails)
+        self.assertEqual(Message.objects.count(), 2)
+        self.assertNotIn(u'FETCH', [c[1][0] for c in transport.return_value.uid.mock_calls])
+
+    def test_changed_uidvalidity_resets_last_uid(self):
+        mails = [self._create_mail() for k in range(2)]
+        self._run_mail_cron_job(mails=mails)
+        transport = self._run_mail_cron_job(mails=mails, uidvalidity=u'8')
+        transport.return_value.uid.assert_any_call(u'SEARCH', None, u'UID', u'1:*')
+        self.assertEqual(Message.objects.count(), 4)
+
+    def test_mail_failing_to_parse_is_skipped_next_time(self):
+        mail = self._create_mail(body=dedent(u"""\
+                --===============1111111111==
+                MIME-Version: 1.0
+                Content-Type: text/plain; charset="invalid"
+                Content-Transfer-Encoding: 7bit
+
+                Text content
+                --===============1111111111==--"""))
+        self._run_mail_cron_job(mails=[mail])
+        transport = self._run_mail_cron_job(mails=[mail])
+        self.assertEqual(Message.objects.count(), 0)
+        self.assertNotIn(u'FETCH', [c[1][0] for c in transport.return_value.uid.mock_calls])
+
+    def test_uidvalidity_is_read_again_on_the_same_connection(self):
+        mails = [self._create_mail() for k in range(2)]
+        transport = self._mock_transport(mails)
+        with self.settings(**self._overrides()):
+            with mock.patch.multiple(u'poleno.mail.transports.imap', IMAP4=transport, IMAP4_SSL=None):
+                with ImapTransport() as imap:
+                    self.assertEqual(len(list(imap.get_messages())), 2)
+                    self.assertEqual(len(list(imap.get_messages())), 0)
+        transport.return_value.uid.assert_any_call(u'SEARCH', None, u'UID', u'12:*')
+        self.assertEqual(ImapMailbox.objects.get().uidvalidity, 7)
+        self.assertEqual(ImapMailbox.objects.get().last_uid, 11)
+        self.assertEqual(Message.objects.count(), 2)
+
+    def test_missing_uidvalidity_fails_without_resetting_last_uid(self):
+        mails = [self._create_mail() for k in range(2)]
+        self._run_mail_cron_job(mails=mails)
+        transport = self._run_mail_cron_job(mails=mails, uidvalidity=None)
+        self.assertEqual(transport.return_value.uid.mock_calls, [])
+        self.assertEqual(ImapMailbox.objects.get().last_uid, 11)
+        self.assertEqual(Message.objects.count(), 2)
+
+    def test_batches_are_limited_by_size(self):
+        mails = [self._create_mail() for k in range(4)]
+        transport = self._run_mail_cron_job(mails=mails, IMAP_BATCH_SIZE=10, IMAP_BATCH_BYTES=2*len(mails[0]))
+        fetches = [c for c in transport.return_value.uid.mock_calls if c[1][0] == u'FETCH']
+        self.assertEqual(fetches, [
+            mock.call(u'FETCH', u'10:13', u'(RFC822.SIZE)'),
+            mock.call(u'FETCH', u'10:11', u'(RFC822)'),
+            mock.call(u'FETCH', u'12:13', u'(RFC822)'),
+            ])
+        self.assertEqual(Message.objects.count(), 4)
+
+    def test_large_mail_is_fetched_alone_in_chunks(self):
+        content = u'x' * 150
+        large = self._create_mail(body=dedent(u"""\
+                --===============1111111111==
+                MIME-Version: 1.0
+                Content-Type: application/pdf
+                Content-Transfer-Encoding: 7bit
+                Content-Disposition: attachment; filename="filename.pdf"
+
+                %s
+                --===============1111111111==--""" % content))
+        mails = [self._create_mail(), large, self._create_mail()]
+        transport = self._run_mail_cron_job(mails=mails, IMAP_SPOOL_SIZE=len(large) - 1)
+        fetches = [c for c in transport.return_value.uid.mock_calls if c[1][0] == u'FETCH']
+        self.assertEqual(fetches, [
+            mock.call(u'FETCH', u'10:12', u'(RFC822.SIZE)'),
+            mock.call(u'FETCH', u'10:10', u'(RFC822)'),
+            mock.call(u'FETCH', u'11', u'(BODY.PEEK[HEADER] BODYSTRUCTURE)'),
+            mock.call(u'FETCH', u'11', u'(BODY.PEEK[1]<0.%s>)' % (len(large) - 1)),
+            mock.call(u'FETCH', u'12:12', u'(RFC822)'),
+            ])
+        self.assertEqual(Message.objects.count(), 3)
+        attchs = Message.objects.order_by(u'pk')[1].attachment_set.all()
+        self.assertEqual(len(attchs), 1)
+        self.assertEqual(attchs[0].name, u'filename.pdf')
+        self.assertEqual(attchs[0].content, content)
+
+    def test_large_mail_parts_are_decoded_in_chunks(self):
+        content = b''.join(chr(k) for k in range(256)) * 2
+        mail = self._create_mail(body=dedent(u"""\
+                --===============1111111111==
+                MIME-Version: 1.0
+                Content-Type: text/plain; charset="utf-8"
+                Content-Transfer-Encoding: quoted-printable
+
+                Text content with a soft line break which is longer than a single chunk of=
+                 the message part, so it is decoded from several chunks =3D
+                --===============1111111111==
+                MIME-Version: 1.0
+                Content-Type: application/octet-stream
+                Content-Transfer-Encoding: base64
+                Content-Disposition: attachment; filename="filename.bin"
+
+                %s
+                --===============1111111111==--""" % base64.encodestring(content).strip().replace(b'\n', u'\n                ')))
+        transport = self._run_mail_cron_job(mails=[mail], IMAP_SPOOL_SIZE=30)
+        transport.return_value.uid.assert_any_call(u'FETCH', u'10', u'(BODY.PEEK[2]<30.30>)')
+        msg = Message.objects.get()
+        attchs = msg.attachment_set.all()
+        self.assertEqual(msg.text, u'Text content with a soft line break which is longer than a single chunk of the message part, so it is decoded from several chunks =')
+        self.assertEqual(len(attchs), 1)
+        self.assertEqual(attchs[0].name, u'filename.bin')
+        self.assertEqual(attchs[0].size, len(content))
+        self.assertEqual(attchs[0].content, content)
+
+class ImapTransportStreamedTest(ImapTransportIncrementalTest):
+    u"""
+    Tests ``ImapTransport`` mail transport class in incremental mode with all mails large enough
+    to be fetched one by one in chunks. Runs all ``ImapTransportTest`` tests checking received
+    messages with the mails fetched in chunks as well.
+    """
+
+    def _overrides(self, **override_settings):
+        overrides = {u'IMAP_SPOOL_SIZE': 16}
+        overrides.update(override_settings)
+        return super(ImapTransportStreamedTest, self)._overrides(**overrides)
+
+    def test_transport_calls_with_nonempty_inbox(self):
+        mails = [self._create_mail() for k in range(2)]
+        transport = self._run_mail_cron_job(mails=mails, IMAP_HOST=u'testhost.com', IMAP_PORT=2000, IMAP_USERNAME=u'TestUser', IMAP_PASSWORD=u'big_secret')
+        self.assertEqual(transport.mock_calls, [
+            mock.call(u'testhost.com', 2000),
+            mock.call().login(u'TestUser', u'big_secret'),
+            mock.call().select(),
+            mock.call().status(u'INBOX', u'(UIDVALIDITY)'),
+            mock.call().uid(u'SEARCH', None, u'UID', u'1:*'),
+            mock.call().uid(u'FETCH', u'10:11', u'(RFC822.SIZE)'),
+            mock.call().uid(u'FETCH', u'10', u'(BODY.PEEK[HEADER] BODYSTRUCTURE)'),
+            mock.call().uid(u'FETCH', u'10', u'(BODY.PEEK[1]<0.16>)'),
+            mock.call().uid(u'FETCH', u'10', u'(BODY.PEEK[1]<16.16>)'),
+            mock.call().uid(u'STORE', u'10', u'+FLAGS', u'\\Deleted'),
+            mock.call().expunge(),
+            mock.call().uid(u'FETCH', u'11', u'(BODY.PEEK[HEADER] BODYSTRUCTURE)'),
+            mock.call().uid(u'FETCH', u'11', u'(BODY.PEEK[1]<0.16>)'),
+            mock.call().uid(u'FETCH', u'11', u'(BODY.PEEK[1]<16.16>)'),
+            mock.call().uid(u'STORE', u'11', u'+FLAGS', u'\\Deleted'),
+            mock.call().expunge(),
+            mock.call().close(),
+            mock.call().logout(),
+            ])
+
+    def test_last_uid_is_remembered(self):
+        mails = [self._create_mail() for k in range(2)]
+        self._run_mail_cron_job(mails=mails)
+        self.assertEqual(ImapMailbox.objects.get().last_uid, 11)
+
+        # Messages seen before are not fetched again even if they were not deleted.
+        transport = self._run_mail_cron_job(mails=mails + [self._create_mail()])
+        transport.return_value.uid.assert_any_call(u'SEARCH', None, u'UID', u'12:*')
+        transport.return_value.uid.assert_any_call(u'FETCH', u'12', u'(BODY.PEEK[HEADER] BODYSTRUCTURE)')
+        self.assertEqual(Message.objects.count(), 3)
+        self.assertEqual(ImapMailbox.objects.get().last_uid, 12)
+
+    def test_batches_are_limited_by_size(self):
+        mails = [self._create_mail() for k in range(2)]
+        transport = self._run_mail_cron_job(mails=mails, IMAP_BATCH_SIZE=10, IMAP_BATCH_BYTES=10*len(mails[0]))
+        fetches = [c[1][1] for c in transport.return_value.uid.mock_calls if c[1][0] == u'FETCH']
+        self.assertNotIn(u'(RFC822)', fetches)
+        self.assertEqual(Message.objects.count(), 2)
@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 import json
 import mock
+import base64
+import random
 import datetime
 import contextlib
 
@@ -19,7 +21,7 @@ from . import MailTestCaseMixin
 from ..models import Message, Recipient
 from ..cron import mail as mail_cron_job
 from ..signals import message_sent, message_received
-from ..transports.mandrill.signals import webhook_event, message_status_webhook_event, inbound_email_webhook_event
+from ..transports.mandrill.signals import webhook_event, webhook_events, message_status_webhook_events, inbound_email_webhook_event
 
 class MandrillTransportTest(MailTestCaseMixin, TestCase):
     u"""
@@ -55,9 +57,10 @@ class MandrillTransportTest(MailTestCaseMixin, TestCase):
         overrides.update(override_settings)
 
         requests = mock.Mock()
-        requests.post.return_value.status_code = status_code
-        requests.post.return_value.text = u'Response text'
-        requests.post.return_value.json.return_value = response
+        session = requests.Session.return_value
+        session.post.return_value.status_code = status_code
+        session.post.return_value.text = u'Response text'
+        session.post.return_value.json.return_value = response
 
         with self.settings(**overrides):
             for name in delete_settings:
@@ -66,7 +69,9 @@ class MandrillTransportTest(MailTestCaseMixin, TestCase):
                 with override_signals(message_sent, message_received):
                     mail_cron_job().do()
 
-        posts = [Bunch(url=call[0][0], data=json.loads(call[1][u'data'])) for call in requests.post.call_args_list]
+        self.assertEqual(requests.post.call_count, 0)
+        self.assertEqual(requests.Session.call_count, session.close.call_count)
+        posts = [Bunch(url=call[0][0], data=json.loads(b''.join(call[1][u'data']))) for call in session.post.call_args_list]
         return posts
 
 
@@ -219,6 +224,14 @@ class MandrillTransportTest(MailTestCaseMixin, TestCase):
             {u'content': u'KGF0dGFjaG1lbnQgY29udGVudCk=', u'type': u'application/pdf', u'name': u'filename.pdf'},
             ])
 
+    def test_message_large_attachment_encoded_in_chunks(self):
+        msg = self._create_message()
+        rcpt = self._create_recipient(message=msg)
+        content = b''.join(chr(random.randrange(256)) for i in range(200000))
+        attch = self._create_attachment(generic_object=msg, content=content, name=u'filename.bin')
+        requests = self._run_mail_cron_job()
+        self.assertEqual(requests[0].data[u'message'][u'attachments'][0][u'content'], base64.b64encode(content))
+
     def test_response_id_saved_as_recipient_remote_id(self):
         msg = self._create_message()
         rcpt = self._create_recipient(message=msg, mail=u'rcpt@a.com')
@@ -314,7 +327,7 @@ class WebhookViewTest(MailTestCaseMixin, ViewTestCaseMixin, TestCase):
         with self.settings(**overrides):
             for name in delete_settings:
                 delattr(settings, name)
-            with override_signals(webhook_event):
+            with override_signals(webhook_event, webhook_events):
                 yield
 
     def _webhook_url(self, secret_name=u'default_testing_secret_name', secret=u'default_testing_secret'):
@@ -434,6 +447,26 @@ class WebhookViewTest(MailTestCaseMixin, ViewTestCaseMixin, TestCase):
             mock.call(signal=webhook_event, data={u'_id': u'remote-3', u'event': u'click'}, event_type=u'click', sender=None),
             ])
 
+    def test_post_request_with_valid_data_emits_webhook_events_batch(self):
+        with self._overrides(MANDRILL_WEBHOOK_URL=u'https://testhost/', MANDRILL_WEBHOOK_KEYS=[u'testkey']):
+            receiver = mock.Mock()
+            webhook_events.connect(receiver)
+            response = self.client.post(self._webhook_url(), secure=True,
+                    data={u'mandrill_events': json.dumps([
+                        {u'event': u'deferral', u'_id': u'remote-1'},
+                        {u'event': u'soft_bounce', u'_id': u'remote-2'},
+                        {u'event': u'click', u'_id': u'remote-3'},
+                        ])},
+                    HTTP_X_MANDRILL_SIGNATURE=u'e/e0y1qBZghx4pyHFFoRrtgqmWg=')
+        self._check_response(response)
+        self.assertItemsEqual(receiver.mock_calls, [
+            mock.call(signal=webhook_events, sender=None, events=[
+                (u'deferral', {u'_id': u'remote-1', u'event': u'deferral'}),
+                (u'soft_bounce', {u'_id': u'remote-2', u'event': u'soft_bounce'}),
+                (u'click', {u'_id': u'remote-3', u'event': u'click'}),
+                ]),
+            ])
+
     def test_post_request_with_valid_data_rolls_back_if_exception_raised(self):
         def receiver(*args, **kwargs):
             self._create_message()
@@ -462,7 +495,7 @@ class WebhookViewTest(MailTestCaseMixin, ViewTestCaseMixin, TestCase):
 
 class MessageStatusWebhookEventTest(MailTestCaseMixin, TestCase):
     u"""
-    Tests ``message_status_webhook_event()`` event receiver.
+    Tests ``message_status_webhook_events()`` event receiver.
     """
 
     def _create_message(self, **kwargs):
@@ -475,12 +508,12 @@ class MessageStatusWebhookEventTest(MailTestCaseMixin, TestCase):
 
 
     def test_event_receiver_is_registered(self):
-        self.assertIn(message_status_webhook_event, webhook_event._live_receivers(sender=None))
+        self.assertIn(message_status_webhook_events, webhook_events._live_receivers(sender=None))
 
     def _test_event_type_changing_recipient_status(self, event_type, status):
         msg = self._create_message()
         rcpt = self._create_recipient(message=msg, remote_id=u'remote-1')
-        message_status_webhook_event(sender=None, event_type=event_type, data={u'_id': u'remote-1'})
+        message_status_webhook_events(sender=None, events=[(event_type, {u'_id': u'remote-1'})])
         rcpt = Recipient.objects.get(pk=rcpt.pk)
         self.assertEqual(rcpt.status, status)
         self.assertEqual(rcpt.status_details, event_type)
@@ -512,7 +545,7 @@ class MessageStatusWebhookEventTest(MailTestCaseMixin, TestCase):
     def test_event_type_inbound_does_nothing(self):
         msg = self._create_message()
         rcpt = self._create_recipient(message=msg, remote_id=u'remote-1', status=Recipient.STATUSES.UNDEFINED, status_details=u'details')
-        message_status_webhook_event(sender=None, event_type=u'inbound', data={u'_id': u'remote-1'})
+        message_status_webhook_events(sender=None, events=[(u'inbound', {u'_id': u'remote-1'})])
         rcpt = Recipient.objects.get(pk=rcpt.pk)
         self.assertEqual(rcpt.status, Recipient.STATUSES.UNDEFINED)
         self.assertEqual(rcpt.status_details, u'details')
@@ -520,7 +553,7 @@ class MessageStatusWebhookEventTest(MailTestCaseMixin, TestCase):
     def test_other_event_types_do_nothing(self):
         msg = self._create_message()
         rcpt = self._create_recipient(message=msg, remote_id=u'remote-1', status=Recipient.STATUSES.UNDEFINED, status_details=u'details')
-        message_status_webhook_event(sender=None, event_type=u'other', data={u'_id': u'remote-1'})
+        message_status_webhook_events(sender=None, events=[(u'other', {u'_id': u'remote-1'})])
         rcpt = Recipient.objects.get(pk=rcpt.pk)
         self.assertEqual(rcpt.status, Recipient.STATUSES.UNDEFINED)
         self.assertEqual(rcpt.status_details, u'details')
@@ -529,7 +562,7 @@ class MessageStatusWebhookEventTest(MailTestCaseMixin, TestCase):
         msg = self._create_message()
         rcpt1 = self._create_recipient(message=msg, remote_id=u'remote-1', status=Recipient.STATUSES.UNDEFINED, status_details=u'details')
         rcpt2 = self._create_recipient(message=msg, remote_id=u'remote-1', status=Recipient.STATUSES.UNDEFINED, status_details=u'details')
-        message_status_webhook_event(sender=None, event_type=u'deferral', data={u'_id': u'remote-1'})
+        message_status_webhook_events(sender=None, events=[(u'deferral', {u'_id': u'remote-1'})])
         rcpt1 = Recipient.objects.get(pk=rcpt1.pk)
         rcpt2 = Recipient.objects.get(pk=rcpt2.pk)
         self.assertEqual(rcpt1.status, Recipient.STATUSES.UNDEFINED)
@@ -540,11 +573,33 @@ class MessageStatusWebhookEventTest(MailTestCaseMixin, TestCase):
     def test_remote_id_matching_no_recipients_does_nothing(self):
         msg = self._create_message()
         rcpt = self._create_recipient(message=msg, remote_id=u'remote-1', status=Recipient.STATUSES.UNDEFINED, status_details=u'details')
-        message_status_webhook_event(sender=None, event_type=u'deferral', data={u'_id': u'remote-2'})
+        message_status_webhook_events(sender=None, events=[(u'deferral', {u'_id': u'remote-2'})])
         rcpt = Recipient.objects.get(pk=rcpt.pk)
         self.assertEqual(rcpt.status, Recipient.STATUSES.UNDEFINED)
         self.assertEqual(rcpt.status_details, u'details')
 
+    def test_only_latest_event_for_recipient_is_applied(self):
+        msg = self._create_message()
+        rcpt = self._create_recipient(message=msg, remote_id=u'remote-1')
+        message_status_webhook_events(sender=None, events=[
+            (u'open', {u'_id': u'remote-1', u'ts': 1400000020}),
+            (u'send', {u'_id': u'remote-1', u'ts': 1400000010}),
+            ])
+        rcpt = Recipient.objects.get(pk=rcpt.pk)
+        self.assertEqual(rcpt.status, Recipient.STATUSES.OPENED)
+        self.assertEqual(rcpt.status_details, u'open')
+
+    def test_batch_of_events_is_applied_with_constant_number_of_queries(self):
+        msg = self._create_message()
+        rcpts = [self._create_recipient(message=msg, remote_id=u'remote-%s' % i) for i in range(30)]
+        events = [(event_type, {u'_id': u'remote-%s' % i}) for i in range(30) for event_type in [u'send', u'open']]
+        events += [(u'hard_bounce', {u'_id': u'remote-%s' % i}) for i in range(20, 30)]
+        # One query to resolve remote IDs and one update for every (status, event type) pair
+        with self.assertNumQueries(3):
+            message_status_webhook_events(sender=None, events=events)
+        rcpts = Recipient.objects.filter(pk__in=(r.pk for r in rcpts)).order_by_pk()
+        self.assertEqual([r.status_details for r in rcpts], [u'open'] * 20 + [u'hard_bounce'] * 10)
+
 class InboundEmailWebhookEvent(MailTestCaseMixin, TestCase):
     u"""
     Tests ``inbound_email_webhook_event()`` event receiver.
@@ -1,7 +1,9 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
 import random
+import datetime
 
+from django.core.files.base import ContentFile
 from django.db import IntegrityError
 from django.test import TestCase
 
@@ -339,6 +341,82 @@ class MessageModelTest(MailTestCaseMixin, TestCase):
         result = Message.objects.order_by_processed()
         self.assertEqual(list(result), sorted(msgs, key=lambda o: (o.processed, o.pk)))
 
+    def test_save_with_related_method(self):
+        msg = Message(type=Message.TYPES.OUTBOUND)
+        rcpts = [Recipient(mail=u'%s@example.com' % i, type=Recipient.TYPES.TO, status=Recipient.STATUSES.QUEUED) for i in range(3)]
+        attchs = [Attachment(file=ContentFile(u'content'), name=u'%s.txt' % i) for i in range(3)]
+        # One query for each model and a savepoint with its release
+        with self.assertNumQueries(5):
+            msg.save_with_related(rcpts, attchs)
+        msg = Message.objects.get(pk=msg.pk)
+        self.assertEqual([r.mail for r in msg.recipients], [u'0@example.com', u'1@example.com', u'2@example.com'])
+        self.assertEqual([(a.name, a.content) for a in msg.attachments], [(u'0.txt', u'content'), (u'1.txt', u'content'), (u'2.txt', u'content')])
+
+    def test_available_query_method(self):
+        now = utc_now()
+        hour = datetime.timedelta(hours=1)
+        obj1 = self._create_message(processed=None)
+        obj2 = self._create_message(processed=now)
+        obj3 = self._create_message(processed=None, next_attempt=now-hour)
+        obj4 = self._create_message(processed=None, next_attempt=now+hour)
+        obj5 = self._create_message(processed=None, claim_expires=now-hour)
+        obj6 = self._create_message(processed=None, claim_expires=now+hour)
+        result = Message.objects.available()
+        self.assertItemsEqual(result, [obj1, obj3, obj5])
+
+    def test_claim_query_method(self):
+        msgs = [self._create_message(processed=None) for i in range(5)]
+        result = Message.objects.claim(3)
+        self.assertEqual(list(result), msgs[:3])
+        self.assertEqual(len(set(m.claim_token for m in result)), 1)
+        for msg in result:
+            self.assertEqual(msg.attempts, 1)
+            self.assertAlmostEqual(msg.claim_expires, utc_now() + datetime.timedelta(seconds=600),
+                    delta=datetime.timedelta(seconds=10))
+
+    def test_claim_query_method_skips_claimed_messages(self):
+        msgs = [self._create_message(processed=None) for i in range(5)]
+        first = list(Message.objects.claim(3))
+        second = list(Message.objects.claim(3))
+        self.assertEqual(first, msgs[:3])
+        self.assertEqual(second, msgs[3:])
+        self.assertNotEqual(first[0].claim_token, second[0].claim_token)
+        self.assertEqual(list(Message.objects.claim(3)), [])
+
+    def test_claim_query_method_with_lease(self):
+        msg = self._create_message(processed=None)
+        result = Message.objects.claim(1, lease=datetime.timedelta(seconds=-1))
+        self.assertEqual(list(result), [msg])
+        result = Message.objects.claim(1)
+        self.assertEqual(list(result), [msg])
+        self.assertEqual(result[0].attempts, 2)
+
+    def test_release_method(self):
+        msg = self._create_message(processed=None)
+        msg = Message.objects.claim(1).get()
+        msg.release()
+        msg = Message.objects.get(pk=msg.pk)
+        self.assertIsNone(msg.claim_expires)
+        self.assertIsNone(msg.next_attempt)
+        self.assertItemsEqual(Message.objects.available(), [msg])
+
+    def test_release_method_with_failure_postpones_next_attempt(self):
+        msg = self._create_message(processed=None)
+        for attempts, delay in [(1, 60), (2, 120), (3, 240)]:
+            msg = Message.objects.claim(1, lease=datetime.timedelta(seconds=-1)).get()
+            msg.release(failed=True)
+            msg = Message.objects.get(pk=msg.pk)
+            self.assertEqual(msg.attempts, attempts)
+            self.assertAlmostEqual(msg.next_attempt, utc_now() + datetime.timedelta(seconds=delay),
+                    delta=datetime.timedelta(seconds=10))
+            self.assertItemsEqual(Message.objects.available(), [])
+            msg.next_attempt = None
+            msg.save()
+
+    def test_retry_delay_property_is_capped(self):
+        msg = self._create_message(attempts=100)
+        self.assertEqual(msg.retry_delay, datetime.timedelta(days=1))
+
 class RecipientModelTest(MailTestCaseMixin, TestCase):
     u"""
     Tests ``Recipient`` model.
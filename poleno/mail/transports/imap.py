@@ -1,11 +1,15 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+import re
 import email
 import email.message
+import binascii
+import tempfile
+from itertools import takewhile
 from email.utils import parseaddr
 from imaplib import IMAP4, IMAP4_SSL, IMAP4_PORT, IMAP4_SSL_PORT
 
-from django.core.files.base import ContentFile
+from django.core.files.base import File
 from django.conf import settings
 
 from poleno.attachments.models import Attachment
@@ -13,10 +17,15 @@ from poleno.utils.mail import full_decode_header
 from poleno.utils.misc import guess_extension
 
 from .base import BaseTransport
-from ..models import Message, Recipient
+from ..models import Message, Recipient, ImapMailbox
 
 
+class ImapError(Exception):
+    pass
+
 class ImapTransport(BaseTransport):
+    token_re = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+
     def __init__(self, **kwargs):
         super(ImapTransport, self).__init__(**kwargs)
         self.ssl = getattr(settings, u'IMAP_SSL', False)
@@ -25,6 +34,10 @@ class ImapTransport(BaseTransport):
         self.username = getattr(settings, u'IMAP_USERNAME', u'')
         self.password = getattr(settings, u'IMAP_PASSWORD', u'')
         self.transport = IMAP4_SSL if self.ssl else IMAP4
+        self.incremental = getattr(settings, u'IMAP_INCREMENTAL', False)
+        self.batch_size = getattr(settings, u'IMAP_BATCH_SIZE', 20)
+        self.batch_bytes = getattr(settings, u'IMAP_BATCH_BYTES', 5*1024*1024)
+        self.spool_size = getattr(settings, u'IMAP_SPOOL_SIZE', 1024*1024)
         self.connection = None
 
     def connect(self):
@@ -51,7 +64,32 @@ class ImapTransport(BaseTransport):
         except LookupError as e:
             raise email.errors.MessageParseError(e)
 
-    def _decode_message(self, msg):
+    def _attachment_file(self, chunks):
+        # Attachments larger than ``spool_size`` bytes are kept in temporary files on disk until
+        # they are saved, so they do not pile up in memory.
+        spooled = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        size = 0
+        for chunk in chunks:
+            spooled.write(chunk)
+            size += len(chunk)
+        spooled.seek(0)
+        result = File(spooled)
+        result.size = size
+        return result
+
+    def _message_parts(self, msg):
+        u"""
+        Yields ``(content_type, charset, disposition, filename, chunks)`` tuples for all leaf parts
+        of a message parsed in memory. ``chunks`` is a callable returning the decoded content.
+        """
+        for part in msg.walk():
+            if part.is_multipart():
+                continue
+            yield (part.get_content_type(), part.get_content_charset(),
+                    part.get(u'Content-Disposition', u''), part.get_filename(),
+                    lambda part=part: [part.get_payload(decode=True)])
+
+    def _decode_message(self, msg, parts=None):
         assert isinstance(msg, email.message.Message)
 
         headers = {name: self._decode_header(value) for name, value in msg.items()}
@@ -62,24 +100,20 @@ class ImapTransport(BaseTransport):
         text = u''
         html = u''
         attachments = []
-        for part in msg.walk():
-            if part.is_multipart():
-                continue
-            content_type = part.get_content_type()
-            charset = part.get_content_charset()
-            content = part.get_payload(decode=True)
-            disposition = self._decode_header(part.get(u'Content-Disposition', u''))
+        if parts is None:
+            parts = self._message_parts(msg)
+        for content_type, charset, disposition, filename, chunks in parts:
+            disposition = self._decode_header(disposition)
             is_attachment = disposition.startswith(u'attachment')
             if not text and content_type == u'text/plain' and not is_attachment:
-                text = self._decode_content(content, charset)
+                text = self._decode_content(b''.join(chunks()), charset)
             elif not html and content_type == u'text/html' and not is_attachment:
-                html = self._decode_content(content, charset)
+                html = self._decode_content(b''.join(chunks()), charset)
             else:
                 default = u'attachment{}'.format(guess_extension(content_type, u'.bin'))
-                filename = part.get_filename(default)
                 attachments.append(Attachment(
-                        file=ContentFile(content),
-                        name=filename,
+                        file=self._attachment_file(chunks()),
+                        name=filename or default,
                         ))
 
         recipients = []
@@ -107,19 +141,235 @@ class ImapTransport(BaseTransport):
                 html=html,
                 headers=headers,
                 )
-        message.save()
+        message.save_with_related(recipients, attachments)
+
+        return message
 
-        for recipient in recipients:
-            recipient.message = message
-            recipient.save()
+    def _mailbox(self):
+        name = u'{}@{}:{}'.format(self.username, self.host, self.port)
+        mailbox, _ = ImapMailbox.objects.get_or_create(name=name)
+        # Ask for UIDVALIDITY explicitly. The untagged response left behind by ``select()`` may be
+        # consumed already, e.g. by a previous call on the same connection.
+        _, [status] = self.connection.status(u'INBOX', u'(UIDVALIDITY)')
+        match = re.search(r'\bUIDVALIDITY (\d+)', status or u'')
+        if not match:
+            raise ImapError(u'Missing UIDVALIDITY of mailbox: {}'.format(name))
+        uidvalidity = int(match.group(1))
+        if mailbox.uidvalidity != uidvalidity:
+            mailbox.uidvalidity = uidvalidity
+            mailbox.last_uid = 0
+            mailbox.save(update_fields=[u'uidvalidity', u'last_uid'])
+        return mailbox
 
-        for attachment in attachments:
-            attachment.generic_object = message
-            attachment.save()
+    def _parse_response(self, response):
+        u"""
+        Parses ``FETCH`` response data into nested lists of strings. imaplib returns literals as
+        tuples of the preceding line and the literal contents. ``NIL`` is parsed as ``None``.
+        """
+        stack = [[]]
+        for part in response:
+            text, literal = part if isinstance(part, tuple) else (part, None)
+            if literal is not None:
+                text = re.sub(r'\{\d+\}$', u'', text)
+            for match in self.token_re.finditer(text or u''):
+                opening, closing, quoted, atom = match.groups()
+                if opening:
+                    stack.append([])
+                elif closing and len(stack) > 1:
+                    closed = stack.pop()
+                    stack[-1].append(closed)
+                elif quoted is not None:
+                    stack[-1].append(re.sub(r'\\(.)', r'\1', quoted))
+                elif atom:
+                    stack[-1].append(None if atom.upper() == u'NIL' else atom)
+            if literal is not None:
+                stack[-1].append(literal)
+        return stack[0]
 
-        return message
+    def _fetch(self, uids, items):
+        u"""
+        Fetches ``items`` of messages in the UID set ``uids`` with a single ``UID FETCH`` command.
+        Returns a dict mapping message UIDs to dicts of fetched items.
+        """
+        _, response = self.connection.uid(u'FETCH', uids, items)
+        parsed = self._parse_response(response)
+        fetched = {}
+        for data in parsed:
+            if isinstance(data, list):
+                data = dict(zip(data[0::2], data[1::2]))
+                if data.get(u'UID'):
+                    fetched.setdefault(int(data[u'UID']), {}).update(data)
+        return fetched
+
+    def _batches(self, uids):
+        u"""
+        Groups UIDs into batches of at most ``IMAP_BATCH_SIZE`` messages and at most
+        ``IMAP_BATCH_BYTES`` bytes according to message sizes reported by the server. Messages
+        larger than ``IMAP_SPOOL_SIZE`` bytes are yielded in batches of their own and marked to be
+        streamed. Yields ``(batch, streamed)`` tuples.
+        """
+        fetched = self._fetch(u'{}:{}'.format(uids[0], uids[-1]), u'(RFC822.SIZE)')
+        batch = []
+        batch_bytes = 0
+        for uid in uids:
+            size = int(fetched.get(uid, {}).get(u'RFC822.SIZE') or 0)
+            if size > self.spool_size:
+                if batch:
+                    yield batch, False
+                    batch = []
+                    batch_bytes = 0
+                yield [uid], True
+                continue
+            if batch and (len(batch) >= self.batch_size or batch_bytes + size > self.batch_bytes):
+                yield batch, False
+                batch = []
+                batch_bytes = 0
+            batch.append(uid)
+            batch_bytes += size
+        if batch:
+            yield batch, False
+
+    def _decode_chunks(self, chunks, encoding):
+        u"""
+        Decodes content transfer encoding of message part contents downloaded in chunks. Only
+        whole base64 quadruples and whole quoted-printable lines are decoded, the rest is kept for
+        the next chunk.
+        """
+        rest = b''
+        for chunk in chunks:
+            if encoding == u'base64':
+                data = rest + re.sub(br'[^A-Za-z0-9+/=]', b'', chunk)
+                cut = len(data) - len(data) % 4
+                rest = data[cut:]
+                yield binascii.a2b_base64(data[:cut])
+            elif encoding == u'quoted-printable':
+                data = rest + chunk
+                cut = data.rfind(b'\n') + 1
+                rest = data[cut:]
+                yield binascii.a2b_qp(data[:cut])
+            else:
+                yield chunk
+        if rest and encoding == u'quoted-printable':
+            yield binascii.a2b_qp(rest)
+
+    def _fetch_chunks(self, uid, number):
+        u"""
+        Downloads the message part ``number`` in chunks of ``IMAP_SPOOL_SIZE`` bytes using partial
+        ``BODY.PEEK[number]<offset.length>`` fetches.
+        """
+        offset = 0
+        while True:
+            item = u'BODY[{}]<{}>'.format(number, offset)
+            fetched = self._fetch(str(uid), u'(BODY.PEEK[{}]<{}.{}>)'.format(
+                    number, offset, self.spool_size))
+            chunk = fetched.get(uid, {}).get(item) or b''
+            if chunk:
+                yield chunk
+            if len(chunk) < self.spool_size:
+                break
+            offset += len(chunk)
+
+    def _streamed_parts(self, uid, structure, number=u''):
+        u"""
+        Yields the same tuples as ``_message_parts()`` for leaf parts described by the message
+        ``BODYSTRUCTURE``. Part contents are downloaded and decoded in chunks when requested, so
+        they are never held in memory whole. Attached messages are not descended into.
+        """
+        if isinstance(structure[0], list):
+            # Multipart subparts are followed by the subtype and extension data.
+            subparts = takewhile(lambda s: isinstance(s, list), structure)
+            for i, subpart in enumerate(subparts, 1):
+                subnumber = u'{}.{}'.format(number, i) if number else str(i)
+                for part in self._streamed_parts(uid, subpart, subnumber):
+                    yield part
+            return
+
+        def params(values):
+            values = values if isinstance(values, list) else []
+            return {k.lower(): v for k, v in zip(values[0::2], values[1::2]) if k}
+
+        number = number or u'1'
+        content_type = u'{}/{}'.format(structure[0], structure[1]).lower()
+        type_params = params(structure[2])
+        encoding = (structure[5] or u'7bit').lower()
+        if content_type == u'message/rfc822':
+            extension = 11
+        elif content_type.startswith(u'text/'):
+            extension = 9
+        else:
+            extension = 8
+        disposition = structure[extension] if len(structure) > extension else None
+        disposition = disposition if isinstance(disposition, list) and disposition else [u'', None]
+        disposition_params = params(disposition[1] if len(disposition) > 1 else None)
+        filename = disposition_params.get(u'filename') or type_params.get(u'name')
+        yield (content_type, (type_params.get(u'charset') or u'').lower() or None,
+                (disposition[0] or u'').lower(), filename,
+                lambda: self._decode_chunks(self._fetch_chunks(uid, number), encoding))
+
+    def _fetch_streamed(self, uid):
+        u"""
+        Fetches message headers and ``BODYSTRUCTURE`` only. Message parts are downloaded in chunks
+        straight to temporary files while the message is being decoded.
+        """
+        fetched = self._fetch(str(uid), u'(BODY.PEEK[HEADER] BODYSTRUCTURE)').get(uid, {})
+        header = fetched.get(u'BODY[HEADER]')
+        structure = fetched.get(u'BODYSTRUCTURE')
+        if header is None or not structure:
+            return None
+        msg = email.message_from_string(header)
+        return self._decode_message(msg, self._streamed_parts(uid, structure))
+
+    def get_incremental_messages(self):
+        u"""
+        Fetches only messages with UIDs higher than the last UID seen in the mailbox. Message sizes
+        are fetched first and messages are fetched in batches bounded both by their number and by
+        their total size, every batch with a single ``UID FETCH`` command. Messages larger than
+        ``IMAP_SPOOL_SIZE`` are fetched one by one and their parts are downloaded in chunks. The
+        last seen UID is updated together with every received message, so messages that fail to
+        parse are skipped next time instead of being fetched again and again.
+        """
+        mailbox = self._mailbox()
+        _, [found] = self.connection.uid(u'SEARCH', None, u'UID',
+                u'{}:*'.format(mailbox.last_uid + 1))
+        # The range ``n:*`` always contains the highest UID in the mailbox even if it's lower
+        # than ``n``.
+        uids = sorted(uid for uid in (int(u) for u in (found or u'').split())
+                if uid > mailbox.last_uid)
+        if not uids:
+            return
+
+        for batch, streamed in self._batches(uids):
+            if not streamed:
+                fetched = self._fetch(u'{}:{}'.format(batch[0], batch[-1]), u'(RFC822)')
+            for uid in batch:
+                mailbox.last_uid = uid
+                mailbox.save(update_fields=[u'last_uid'])
+                try:
+                    if streamed:
+                        message = self._fetch_streamed(uid)
+                    else:
+                        contents = fetched.pop(uid, {}).get(u'RFC822')
+                        if contents is None:
+                            continue
+                        msg = email.message_from_string(contents)
+                        del contents
+                        message = self._decode_message(msg)
+                except email.errors.MessageParseError:
+                    continue
+                if message is None:
+                    continue
+
+                yield message
+
+                self.connection.uid(u'STORE', str(uid), u'+FLAGS', u'\\Deleted')
+            self.connection.expunge()
 
     def get_messages(self):
+        if self.incremental:
+            for message in self.get_incremental_messages():
+                yield message
+            return
+
         # Based on django_mailbox.transports.imap.ImapTransport
         _, inbox = self.connection.search(None, u'ALL')
         if inbox[0]:
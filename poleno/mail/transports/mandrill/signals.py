@@ -1,8 +1,10 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
 from base64 import b64decode
+from collections import defaultdict
 
 from django.core.files.base import ContentFile
+from django.db.models import Count
 from django.dispatch import Signal, receiver
 
 from poleno.attachments.models import Attachment
@@ -12,27 +14,55 @@ from ...models import Message, Recipient
 
 
 webhook_event = Signal(providing_args=['event_type', 'data'])
+webhook_events = Signal(providing_args=['events'])
 
-@receiver(webhook_event)
-def message_status_webhook_event(sender, event_type, data, **kwargs):
+def _event_status(event_type):
     if event_type == u'deferral':
-        status = Recipient.STATUSES.QUEUED
+        return Recipient.STATUSES.QUEUED
     elif event_type in [u'soft_bounce', u'hard_bounce', u'spam', u'reject']:
-        status = Recipient.STATUSES.REJECTED
+        return Recipient.STATUSES.REJECTED
     elif event_type == u'send':
-        status = Recipient.STATUSES.SENT
+        return Recipient.STATUSES.SENT
     elif event_type in [u'open', u'click']:
-        status = Recipient.STATUSES.OPENED
+        return Recipient.STATUSES.OPENED
     else:
+        return None
+
+@receiver(webhook_events)
+def message_status_webhook_events(sender, events, **kwargs):
+    u"""
+    Updates recipient statuses for a whole batch of ``(event_type, data)`` pairs with a constant
+    number of queries. Only the latest event for every recipient is applied. Events for remote
+    IDs matching no recipient or multiple recipients are ignored.
+    """
+    latest = {}
+    for event_type, data in events:
+        status = _event_status(event_type)
+        remote_id = data.get(u'_id')
+        if status is None or not remote_id:
+            continue
+        ts = data.get(u'ts') or 0
+        if remote_id not in latest or ts >= latest[remote_id][0]:
+            latest[remote_id] = (ts, status, event_type)
+    if not latest:
         return
 
-    try:
-        recipient = Recipient.objects.get(remote_id=data['_id'])
-        recipient.status = status
-        recipient.status_details = event_type
-        recipient.save(update_fields=[u'status', u'status_details'])
-    except (Recipient.DoesNotExist, Recipient.MultipleObjectsReturned):
-        pass
+    counts = (Recipient.objects
+            .filter(remote_id__in=latest.keys())
+            .values(u'remote_id')
+            .annotate(count=Count(u'pk'))
+            )
+    groups = defaultdict(list)
+    for row in counts:
+        if row[u'count'] == 1:
+            _, status, event_type = latest[row[u'remote_id']]
+            groups[status, event_type].append(row[u'remote_id'])
+
+    for (status, event_type), remote_ids in groups.items():
+        (Recipient.objects
+                .filter(remote_id__in=remote_ids)
+                .update(status=status, status_details=event_type)
+                )
 
 @receiver(webhook_event)
 def inbound_email_webhook_event(sender, event_type, data, **kwargs):
@@ -82,12 +112,4 @@ def inbound_email_webhook_event(sender, event_type, data, **kwargs):
                 html=html,
                 headers=headers,
                 )
-        message.save()
-
-        for recipient in recipients:
-            recipient.message = message
-            recipient.save()
-
-        for attachment in attachments:
-            attachment.generic_object = message
-            attachment.save()
+        message.save_with_related(recipients, attachments)
@@ -23,6 +23,46 @@ class MandrillTransport(BaseTransport):
         if self.api_key is None:
             raise ImproperlyConfigured(u'Setting MANDRILL_API_KEY is not set.')
 
+        self.session = None
+
+    def connect(self):
+        # All messages sent within one ``with transport:`` block share pooled connections.
+        self.session = requests.Session()
+
+    def disconnect(self):
+        self.session.close()
+        self.session = None
+
+    def _base64_chunks(self, attachment):
+        # Chunk size must be a multiple of 3, so the encoded chunks may be concatenated.
+        buf = b''
+        for chunk in attachment.chunks():
+            buf += chunk
+            size = len(buf) - len(buf) % 3
+            if size:
+                yield base64.b64encode(buf[:size])
+                buf = buf[size:]
+        if buf:
+            yield base64.b64encode(buf)
+
+    def _request_body(self, data, attachments):
+        u"""
+        Yields JSON encoded request ``data`` with ``attachments`` added as its message attachments.
+        Attachment contents are read and base64 encoded in chunks, so the whole request body is
+        never held in memory.
+        """
+        msg = data[u'message']
+        yield b'{{"key": {}, "message": '.format(json.dumps(data[u'key']))
+        yield json.dumps(msg)[:-1]
+        yield b', "attachments": [' if msg else b'"attachments": ['
+        for i, attachment in enumerate(attachments):
+            yield b'{}{{"type": {}, "name": {}, "content": "'.format(b', ' if i else b'',
+                    json.dumps(attachment.content_type), json.dumps(attachment.name))
+            for chunk in self._base64_chunks(attachment):
+                yield chunk
+            yield b'"}'
+        yield b']}}'
+
     def send_message(self, message):
         assert message.type == message.TYPES.OUTBOUND
         assert message.processed is None
@@ -58,19 +98,13 @@ class MandrillTransport(BaseTransport):
             msg[u'to'].append(rcp)
             recipients[recipient.mail].append(recipient)
 
-        msg[u'attachments'] = []
-        for attachment in message.attachments:
-            attch = {}
-            attch[u'type'] = attachment.content_type
-            attch[u'name'] = attachment.name
-            attch[u'content'] = base64.b64encode(attachment.content)
-            msg[u'attachments'].append(attch)
-
         data = {}
         data[u'key'] = self.api_key
         data[u'message'] = msg
 
-        response = requests.post(self.api_send, data=json.dumps(data))
+        # Attachments are streamed as a chunked request body.
+        body = self._request_body(data, message.attachments)
+        response = (self.session or requests).post(self.api_send, data=body)
 
         if response.status_code != 200:
             raise RuntimeError(squeeze(u"""
@@ -14,7 +14,7 @@ from django.conf import settings
 
 from poleno.utils.views import secure_required
 
-from .signals import webhook_event
+from .signals import webhook_event, webhook_events
 
 
 @require_http_methods([u'HEAD', u'GET', u'POST'])
@@ -62,6 +62,9 @@ def webhook(request):
             data = json.loads(request.POST.get(u'mandrill_events'))
         except (TypeError, ValueError):
             raise SuspiciousOperation(u'Request syntax error')
+        # Receivers of ``webhook_events`` get the whole batch at once, receivers of
+        # ``webhook_event`` get events one by one.
+        webhook_events.send(sender=None, events=[(event['event'], event) for event in data])
         for event in data:
             webhook_event.send(sender=None, event_type=event['event'], data=event)
 
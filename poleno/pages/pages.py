@@ -2,13 +2,17 @@
 # -*- coding: utf-8 -*-
 import os
 import re
+import time
 import shutil
+import threading
 import functools
 import collections
 import codecs
 import logging
 import mimetypes
 
+from django.conf import settings
+from django.core.cache import cache
 from django.core.files.storage import default_storage
 from django.template import Context, Template, Origin
 from django.utils.functional import cached_property
@@ -16,6 +20,7 @@ from django.utils.translation import get_language
 
 from poleno.utils.urls import reverse
 from poleno.utils.translation import translation
+from poleno.utils.misc import random_string
 
 
 path_regex = re.compile(r'^/(?:[a-z0-9]+(?:-[a-z0-9]+)*/)*$')
@@ -114,6 +119,11 @@ class Config(object):
         for key, val in entries.items():
             self.set(key, val)
 
+    def copy(self):
+        res = Config()
+        res._config = self._config.copy()
+        return res
+
 class PageOrigin(Origin):
 
     def __init__(self, source, path):
@@ -131,6 +141,68 @@ def fix_slashes(path):
     return path
 
 
+# Page trees are cached per process. Processes share only the cache version stored in the django
+# cache. Mutable page and file methods change the version, so every process reloads the pages from
+# the disk. Pages changed directly on the disk are reloaded after a timeout.
+CACHE_VERSION_KEY = u'pages.version'
+
+# Processes look for a new cache version at most once per this number of seconds, not for every
+# page instance.
+CACHE_VERSION_CHECK_INTERVAL = 1
+
+def invalidate_cache():
+    u"""
+    Changes the cache version, so every process reloads its cached pages. Called whenever any page
+    or file changes.
+    """
+    global _cache
+    cache.set(CACHE_VERSION_KEY, random_string(16), timeout=None)
+    with _cache_lock:
+        _cache = None
+
+class _PageCache(object):
+    u"""
+    Pages loaded from the disk. ``pages`` maps ``(rootpath, path, keep_last)`` to page states
+    resolved by ``Page.__init__()``. ``subpages`` and ``files`` map page directories to page
+    subpage names and to page file names with flags whether the files are regular, respectively.
+    ``templates`` and ``compiled`` map page directories to page template sources and to compiled
+    templates. Entries are added as the pages are accessed.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.loaded = time.time()
+        self.checked = self.loaded
+        self.pages = {}
+        self.subpages = {}
+        self.files = {}
+        self.templates = {}
+        self.compiled = {}
+
+    def expired(self, version):
+        timeout = getattr(settings, u'PAGES_CACHE_TIMEOUT', 600)
+        return version != self.version or time.time() > self.loaded + timeout
+
+_cache_lock = threading.Lock()
+_cache = None
+
+def _cached_pages():
+    global _cache
+    with _cache_lock:
+        if _cache is not None and time.time() < _cache.checked + CACHE_VERSION_CHECK_INTERVAL:
+            return _cache
+    version = cache.get(CACHE_VERSION_KEY)
+    if version is None:
+        # Keep the version if another process has just set it.
+        cache.add(CACHE_VERSION_KEY, random_string(16), timeout=None)
+        version = cache.get(CACHE_VERSION_KEY)
+    with _cache_lock:
+        if _cache is None or _cache.expired(version):
+            _cache = _PageCache(version)
+        _cache.checked = time.time()
+        return _cache
+
+
 @functools.total_ordering
 class File(object):
     u"""
@@ -148,9 +220,10 @@ class File(object):
 
         filesdir = os.path.join(page._pagedir, u'_files')
         filepath = os.path.join(filesdir, name)
-        if not os.path.exists(filepath):
+        isfile = page._file_names().get(name)
+        if isfile is None:
             raise InvalidFileError(u'Page {} has no file: {}'.format(page.path, name))
-        if not os.path.isfile(filepath):
+        if not isfile:
             raise InvalidFileError(
                     u'Page {} file "{}" is not a regular file'.format(page.path, name))
 
@@ -229,6 +302,7 @@ class File(object):
             os.rmdir(self._filesdir)
         except OSError:
             pass
+        invalidate_cache()
 
     def rename(self, name):
         if not file_regex.match(name):
@@ -239,6 +313,7 @@ class File(object):
             raise FileNameError(u'Target file already exists: {}'.format(name))
 
         os.rename(self._filepath, filepath)
+        invalidate_cache()
         return File(self._page, name)
 
     def save_content(self, content):
@@ -253,6 +328,7 @@ class File(object):
                 os.remove(tmp)
             except OSError:
                 pass
+        invalidate_cache()
 
 @functools.total_ordering
 class Page(object):
@@ -297,7 +373,8 @@ class Page(object):
 
     Note that internal page state is cached and it should be manually refetched if anything changes
     in the page structure. In particular, mutable methods may invalidate any current ``Page``
-    instance.
+    instance. Page states, subpages, files and templates are shared by all instances in the process
+    until the pages are changed with mutable methods; See ``_PageCache``.
     """
 
     ##########
@@ -342,6 +419,65 @@ class Page(object):
 
         return redirect
 
+    def _load(self, path, lang, keep_last):
+        path = _path = fix_slashes(path)
+        if not path_regex.match(path):
+            raise InvalidPageError(u'Invalid path: {}'.format(path))
+
+        rootdir = os.path.realpath(default_storage.path(u'pages/' + lang))
+        if not os.path.lexists(rootdir):
+            os.makedirs(rootdir)
+            os.symlink(u'.', os.path.join(rootdir, u'@'))
+
+        isroot = (path == u'/')
+        if keep_last and not isroot and os.path.islink(rootdir + path.rstrip(u'/')):
+            name = path.rsplit(u'/', 2)[-2]
+            ppath = path[:-len(name)-1]
+            ppath, ppagedir = self._resolve_path(rootdir, ppath)
+            path = ppath + name + u'/'
+            pagedir = os.path.join(ppagedir, name)
+            config = None
+            redirect = self._read_symlink(pagedir)
+        else:
+            path, pagedir = self._resolve_path(rootdir, path)
+            name = path.rsplit(u'/', 2)[-2]
+            ppath = path[:-len(name)-1]
+            isroot = (path == u'/')
+            config = self._read_conf_file(pagedir)
+            redirect = None
+
+        return path, ppath, name, isroot, pagedir, rootdir, config, redirect
+
+    def _list_subpages(self):
+        if not os.path.isdir(self._pagedir) or os.path.islink(self._pagedir):
+            return []
+
+        res = []
+        for file in os.listdir(self._pagedir):
+            path = os.path.join(self._pagedir, file)
+            if os.path.isdir(path) or os.path.islink(path):
+                if slug_regex.match(file):
+                    try:
+                        self.subpage(file)
+                        res.append(file)
+                    except InvalidPageError as e:
+                        logger = logging.getLogger(u'poleno.pages')
+                        logger.error(u'Page /{}{}{}/ is broken: {}'.format(
+                                self._lang, self._path, file, e))
+        return res
+
+    def _file_names(self):
+        key = self._pagedir
+        pages = _cached_pages()
+        if key not in pages.files:
+            res = {}
+            filesdir = os.path.join(self._pagedir, u'_files')
+            if os.path.isdir(filesdir):
+                for file in os.listdir(filesdir):
+                    res[file] = os.path.isfile(os.path.join(filesdir, file))
+            pages.files[key] = res
+        return pages.files[key]
+
     def _fix_redirects(self, pagedir):
         stack = [pagedir]
         while stack:
@@ -373,31 +509,14 @@ class Page(object):
         log a warning if the page is redirected.
         """
         lang = lang or get_language()
-        path = _path = fix_slashes(path)
-        if not path_regex.match(path):
-            raise InvalidPageError(u'Invalid path: {}'.format(path))
-
-        rootdir = os.path.realpath(default_storage.path(u'pages/' + lang))
-        if not os.path.lexists(rootdir):
-            os.makedirs(rootdir)
-            os.symlink(u'.', os.path.join(rootdir, u'@'))
-
-        isroot = (path == u'/')
-        if keep_last and not isroot and os.path.islink(rootdir + path.rstrip(u'/')):
-            name = path.rsplit(u'/', 2)[-2]
-            ppath = path[:-len(name)-1]
-            ppath, ppagedir = self._resolve_path(rootdir, ppath)
-            path = ppath + name + u'/'
-            pagedir = os.path.join(ppagedir, name)
-            config = None
-            redirect = self._read_symlink(pagedir)
-        else:
-            path, pagedir = self._resolve_path(rootdir, path)
-            name = path.rsplit(u'/', 2)[-2]
-            ppath = path[:-len(name)-1]
-            isroot = (path == u'/')
-            config = self._read_conf_file(pagedir)
-            redirect = None
+        key = (default_storage.path(u'pages/' + lang), path, keep_last)
+        pages = _cached_pages()
+        if key not in pages.pages:
+            pages.pages[key] = self._load(path, lang, keep_last)
+        path, ppath, name, isroot, pagedir, rootdir, config, redirect = pages.pages[key]
+        if config is not None:
+            # Configs are mutable; See save_config()
+            config = config.copy()
 
         # Private properties
         self._lang = lang
@@ -457,20 +576,18 @@ class Page(object):
 
     @cached_property
     def subpages(self):
-        if not os.path.isdir(self._pagedir) or os.path.islink(self._pagedir):
-            return []
+        key = self._pagedir
+        pages = _cached_pages()
+        if key not in pages.subpages:
+            pages.subpages[key] = self._list_subpages()
 
         res = []
-        for file in os.listdir(self._pagedir):
-            path = os.path.join(self._pagedir, file)
-            if os.path.isdir(path) or os.path.islink(path):
-                if slug_regex.match(file):
-                    try:
-                        res.append(self.subpage(file))
-                    except InvalidPageError as e:
-                        logger = logging.getLogger(u'poleno.pages')
-                        logger.error(u'Page /{}{}{}/ is broken: {}'.format(
-                                self._lang, self._path, file, e))
+        for file in pages.subpages[key]:
+            try:
+                res.append(self.subpage(file))
+            except InvalidPageError:
+                # The page was changed since the subpages were listed.
+                pass
         res.sort()
         return res
 
@@ -582,11 +699,15 @@ class Page(object):
         if self._redirect is not None:
             return None
 
-        try:
-            with codecs.open(os.path.join(self._pagedir, u'page.html'), u'rb', u'utf-8') as f:
-                return f.read()
-        except IOError:
-            return None
+        key = self._pagedir
+        pages = _cached_pages()
+        if key not in pages.templates:
+            try:
+                with codecs.open(os.path.join(self._pagedir, u'page.html'), u'rb', u'utf-8') as f:
+                    pages.templates[key] = f.read()
+            except IOError:
+                pages.templates[key] = None
+        return pages.templates[key]
 
     ##########
     # Non-mutable public methods
@@ -620,8 +741,13 @@ class Page(object):
 
     def render(self):
         if self.template:
-            origin = PageOrigin(self.template, self._path)
-            return Template(self.template, origin).render(Context({
+            # Compiled templates are shared as they are not changed by rendering.
+            key = self._pagedir
+            pages = _cached_pages()
+            if key not in pages.compiled:
+                origin = PageOrigin(self.template, self._path)
+                pages.compiled[key] = Template(self.template, origin)
+            return pages.compiled[key].render(Context({
                 u'page': self,
                 }))
         else:
@@ -639,6 +765,7 @@ class Page(object):
             shutil.rmtree(self._pagedir)
         else:
             os.remove(self._pagedir)
+        invalidate_cache()
 
     def create_subpage(self, name, template=None, raw_config=None, **entries):
         if self._redirect is not None:
@@ -668,6 +795,7 @@ class Page(object):
             with codecs.open(os.path.join(pagedir, u'page.html'), u'wb', u'utf-8') as f:
                 f.write(template)
 
+        invalidate_cache()
         return Page(path, self._lang)
 
     def move(self, parent, name):
@@ -695,6 +823,7 @@ class Page(object):
                 + u'/@' + path, self._pagedir)
         self._fix_redirects(pagedir)
 
+        invalidate_cache()
         return Page(path, self._lang)
 
     def save_redirect(self, redirect):
@@ -709,6 +838,7 @@ class Page(object):
         os.remove(self._pagedir)
         os.symlink(os.path.relpath(self._rootdir, os.path.dirname(self._pagedir))
                 + u'/@' + target.path, self._pagedir)
+        invalidate_cache()
 
     def save_config(self, raw_config=None, **entries):
         if self._redirect is not None:
@@ -722,6 +852,7 @@ class Page(object):
         else:
             self._config.set_multiple(**entries)
         self._config.write(os.path.join(self._pagedir, u'page.conf'))
+        invalidate_cache()
 
     def save_template(self, template):
         if self._redirect is not None:
@@ -744,6 +875,7 @@ class Page(object):
                     os.remove(tmp)
                 except OSError:
                     pass
+        invalidate_cache()
 
     ##########
     # Attached files
@@ -751,12 +883,8 @@ class Page(object):
 
     @cached_property
     def files(self):
-        filesdir = os.path.join(self._pagedir, u'_files')
-        if not os.path.isdir(filesdir):
-            return []
-
         res = []
-        for file in os.listdir(filesdir):
+        for file in self._file_names():
             if file_regex.match(file):
                 try:
                     res.append(self.file(file))
@@ -786,4 +914,5 @@ class Page(object):
             for chunk in content.chunks():
                 f.write(chunk)
 
+        invalidate_cache()
         return File(self, name)
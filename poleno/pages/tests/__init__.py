@@ -0,0 +1,41 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import os
+import codecs
+from testfixtures import TempDirectory
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.translation import activate, deactivate
+
+from ..pages import invalidate_cache
+
+class PagesTestCaseMixin(TestCase):
+
+    def _pre_setup(self):
+        super(PagesTestCaseMixin, self)._pre_setup()
+        self.tempdir = TempDirectory()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.tempdir.path,
+            CACHES={u'default': {u'BACKEND': u'django.core.cache.backends.locmem.LocMemCache'}},
+            )
+        self.settings_override.enable()
+        activate(u'en')
+        # Pages cached in the process survive previous tests.
+        invalidate_cache()
+
+    def _post_teardown(self):
+        invalidate_cache()
+        deactivate()
+        self.settings_override.disable()
+        self.tempdir.cleanup()
+        super(PagesTestCaseMixin, self)._post_teardown()
+
+
+    def _write_template(self, path, template):
+        u"""
+        Changes the page template directly on the disk, bypassing ``Page.save_template()``.
+        """
+        filename = os.path.join(self.tempdir.path, u'pages', u'en', path.strip(u'/'), u'page.html')
+        with codecs.open(filename, u'wb', u'utf-8') as f:
+            f.write(template)
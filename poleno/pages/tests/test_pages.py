@@ -0,0 +1,101 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import time
+
+import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from .. import pages
+from ..pages import Page, CACHE_VERSION_KEY, CACHE_VERSION_CHECK_INTERVAL
+from . import PagesTestCaseMixin
+
+class PagesCacheTest(PagesTestCaseMixin, TestCase):
+    u"""
+    Tests pages cached per process. Checks that changes made with mutable methods are seen by all
+    other page instances, that changes made by other processes are seen after the version check
+    interval, and that changes made directly on the disk are seen after the cache timeout.
+    """
+
+    def setUp(self):
+        Page(u'/').create_subpage(u'aaa', template=u'First', title=u'First')
+
+    def _later(self, seconds):
+        return mock.patch(u'poleno.pages.pages.time.time', return_value=time.time() + seconds)
+
+
+    def test_pages_are_cached(self):
+        self.assertEqual(Page(u'/aaa/').render(), u'First')
+        self._write_template(u'/aaa/', u'Second')
+        self.assertEqual(Page(u'/aaa/').render(), u'First')
+
+    def test_save_config_is_seen_by_other_instances(self):
+        self.assertEqual(Page(u'/aaa/').title, u'First')
+        Page(u'/aaa/').save_config(title=u'Second')
+        self.assertEqual(Page(u'/aaa/').title, u'Second')
+
+    def test_save_template_is_seen_by_other_instances(self):
+        self.assertEqual(Page(u'/aaa/').render(), u'First')
+        Page(u'/aaa/').save_template(u'Second')
+        self.assertEqual(Page(u'/aaa/').template, u'Second')
+        self.assertEqual(Page(u'/aaa/').render(), u'Second')
+
+    def test_create_and_delete_subpage_are_seen_by_other_instances(self):
+        self.assertEqual([p.name for p in Page(u'/').subpages], [u'aaa'])
+        Page(u'/').create_subpage(u'bbb')
+        self.assertEqual([p.name for p in Page(u'/').subpages], [u'aaa', u'bbb'])
+        Page(u'/aaa/').delete()
+        self.assertEqual([p.name for p in Page(u'/').subpages], [u'bbb'])
+
+    def test_mutable_methods_change_cache_version(self):
+        Page(u'/aaa/')
+        version = cache.get(CACHE_VERSION_KEY)
+        Page(u'/aaa/').save_config(title=u'Second')
+        self.assertIsNotNone(cache.get(CACHE_VERSION_KEY))
+        self.assertNotEqual(cache.get(CACHE_VERSION_KEY), version)
+
+    def test_version_changed_by_other_process_is_seen_after_check_interval(self):
+        self.assertEqual(Page(u'/aaa/').render(), u'First')
+        self._write_template(u'/aaa/', u'Second')
+        cache.set(CACHE_VERSION_KEY, u'other', timeout=None)
+        self.assertEqual(Page(u'/aaa/').render(), u'First')
+        with self._later(CACHE_VERSION_CHECK_INTERVAL + 1):
+            self.assertEqual(Page(u'/aaa/').render(), u'Second')
+
+    def test_unchanged_version_is_checked_after_check_interval(self):
+        self.assertEqual(Page(u'/aaa/').render(), u'First')
+        self._write_template(u'/aaa/', u'Second')
+        with self._later(CACHE_VERSION_CHECK_INTERVAL + 1):
+            self.assertEqual(Page(u'/aaa/').render(), u'First')
+
+    @override_settings(PAGES_CACHE_TIMEOUT=60)
+    def test_changes_on_disk_are_seen_after_timeout(self):
+        self.assertEqual(Page(u'/aaa/').render(), u'First')
+        self._write_template(u'/aaa/', u'Second')
+        with self._later(59):
+            self.assertEqual(Page(u'/aaa/').render(), u'First')
+        with self._later(61):
+            self.assertEqual(Page(u'/aaa/').render(), u'Second')
+
+    def test_missing_version_is_added(self):
+        cache.delete(CACHE_VERSION_KEY)
+        with self._later(CACHE_VERSION_CHECK_INTERVAL + 1):
+            Page(u'/aaa/')
+        self.assertIsNotNone(cache.get(CACHE_VERSION_KEY))
+
+    def test_missing_version_does_not_overwrite_version_set_by_other_process(self):
+        real_get = cache.get
+        def get(key, *args, **kwargs):
+            res = real_get(key, *args, **kwargs)
+            if res is None:
+                # Another process sets the version right after this process found it missing.
+                cache.set(key, u'other', timeout=None)
+            return res
+        cache.delete(CACHE_VERSION_KEY)
+        with self._later(CACHE_VERSION_CHECK_INTERVAL + 1):
+            with mock.patch.object(pages, u'cache', mock.Mock(wraps=cache, get=get)):
+                Page(u'/aaa/')
+        self.assertEqual(cache.get(CACHE_VERSION_KEY), u'other')
+        self.assertEqual(pages._cache.version, u'other')
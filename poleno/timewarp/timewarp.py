@@ -167,9 +167,13 @@ class Timewarp(object):
         if self._lastupdate and self._lastupdate + 1 > time_orig.time():
             return
         self._recursive = True
-        self._warped_from = cache.get(u'timewarp.warped_from')
-        self._warped_to = cache.get(u'timewarp.warped_to')
-        self._speedup = cache.get(u'timewarp.speedup', 1)
+        # Cache backends may call the warped ``time.time()`` while reading, so the attributes must
+        # not be updated before all of them are read.
+        values = cache.get_many([
+                u'timewarp.warped_from', u'timewarp.warped_to', u'timewarp.speedup'])
+        self._warped_from = values.get(u'timewarp.warped_from')
+        self._warped_to = values.get(u'timewarp.warped_to')
+        self._speedup = values.get(u'timewarp.speedup', 1)
         self._recursive = False
         self._lastupdate = time_orig.time()
 
@@ -4,10 +4,14 @@ import os
 import stat
 from threading import local
 
-from django.http import HttpResponseNotModified, FileResponse, JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, FileResponse, JsonResponse
+from django.http import StreamingHttpResponse
 from django.views.static import was_modified_since
 from django.utils.http import http_date, urlquote
 
+from poleno.utils.misc import random_string
+
 # Thread local data
 _local = local()
 
@@ -25,12 +29,141 @@ class RequestProviderMiddleware(object):
         return response
 
 
-def send_file_response(request, path, name, content_type, attachment=True):
-    # Based on: django.views.static.serve
+def _stream_file(path, content_type, statobj):
+    response = FileResponse(open(path, u'rb'), content_type=content_type)
+    response[u'Content-Length'] = statobj.st_size
+    return response
 
-    # FIXME: If running on real Apache server, we should use "X-SENDFILE" header to let Apache
-    # serve the file. It's much faster. Possibly will be fixed in Django 1.8.
-    # See: http://django.readthedocs.org/en/latest/ref/request-response.html#django.http.FileResponse
+def _parse_range_header(header, size):
+    u"""
+    Parses HTTP "Range" header value. Returns a list of satisfiable ``(first, last)`` byte
+    positions, both inclusive. The list is empty if no range is satisfiable. Returns ``None`` if
+    the header is not valid, in which case it must be ignored.
+    """
+    units, sep, ranges_spec = header.partition(u'=')
+    if not sep or units.strip().lower() != u'bytes':
+        return None
+    res = []
+    for spec in ranges_spec.split(u','):
+        first, sep, last = spec.strip().partition(u'-')
+        if not sep:
+            return None
+        try:
+            if not first:
+                length = int(last)
+                if length > 0 and size > 0:
+                    res.append((max(size - length, 0), size - 1))
+            else:
+                first = int(first)
+                last = int(last) if last else size - 1
+                if last < first:
+                    return None
+                if first < size:
+                    res.append((first, min(last, size - 1)))
+        except ValueError:
+            return None
+    return res
+
+def _read_ranges(path, ranges, chunk_size=64*1024):
+    u"""
+    Yields chunks of given file ranges. Each item of ``ranges`` is either a ``(first, last)``
+    tuple or a string to yield between the ranges.
+    """
+    with open(path, u'rb') as f:
+        for item in ranges:
+            if isinstance(item, basestring):
+                yield item
+                continue
+            first, last = item
+            f.seek(first)
+            remaining = last - first + 1
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+def _stream_file_ranges(request, path, content_type, statobj):
+    u"""
+    Streams the file honoring "Range" and "If-Range" request headers. The file is read with seeks
+    and fixed-size chunks, so multi-range responses do not need more memory than simple ones.
+    """
+    size = statobj.st_size
+    header = request.META.get(u'HTTP_RANGE')
+    if_range = request.META.get(u'HTTP_IF_RANGE')
+    ranges = _parse_range_header(header, size) if header else None
+    if ranges is None or (if_range and if_range.strip() != http_date(statobj.st_mtime)):
+        response = _stream_file(path, content_type, statobj)
+
+    elif not ranges:
+        response = HttpResponse(status=416, content_type=content_type)
+        response[u'Content-Range'] = u'bytes */{}'.format(size)
+
+    elif len(ranges) == 1:
+        first, last = ranges[0]
+        response = StreamingHttpResponse(_read_ranges(path, ranges), status=206,
+                content_type=content_type)
+        response[u'Content-Range'] = u'bytes {}-{}/{}'.format(first, last, size)
+        response[u'Content-Length'] = last - first + 1
+
+    else:
+        boundary = random_string(32)
+        parts = []
+        length = 0
+        for first, last in ranges:
+            part_header = (
+                    u'\r\n--{}\r\n'
+                    u'Content-Type: {}\r\n'
+                    u'Content-Range: bytes {}-{}/{}\r\n'
+                    u'\r\n'
+                    ).format(boundary, content_type, first, last, size).encode(u'utf-8')
+            parts.extend([part_header, (first, last)])
+            length += len(part_header) + last - first + 1
+        footer = u'\r\n--{}--\r\n'.format(boundary).encode(u'utf-8')
+        parts.append(footer)
+        length += len(footer)
+        response = StreamingHttpResponse(_read_ranges(path, parts), status=206,
+                content_type=u'multipart/byteranges; boundary={}'.format(boundary))
+        response[u'Content-Length'] = length
+
+    response[u'Accept-Ranges'] = u'bytes'
+    return response
+
+def _xsendfile_file(path, content_type, statobj):
+    # Apache with mod_xsendfile
+    response = HttpResponse(content_type=content_type)
+    response[u'X-Sendfile'] = path
+    return response
+
+def _xaccel_file(path, content_type, statobj):
+    # Nginx. Only files inside ``SENDFILE_ROOT`` may be offloaded. They are mapped to the internal
+    # location ``SENDFILE_URL``. Other files are streamed as usual.
+    root = getattr(settings, u'SENDFILE_ROOT', settings.MEDIA_ROOT)
+    url = getattr(settings, u'SENDFILE_URL', None)
+    relpath = os.path.relpath(os.path.realpath(path), os.path.realpath(root))
+    if url is None or relpath.startswith(os.pardir):
+        return _stream_file(path, content_type, statobj)
+    response = HttpResponse(content_type=content_type)
+    response[u'X-Accel-Redirect'] = urlquote(url.rstrip(u'/') + u'/' + relpath)
+    return response
+
+sendfile_backends = {
+        u'stream': _stream_file,
+        u'xsendfile': _xsendfile_file,
+        u'xaccel': _xaccel_file,
+        }
+
+def send_file_response(request, path, name, content_type, attachment=True, accept_ranges=False):
+    u"""
+    Sends the file as the response. By default the file is streamed by Django. If
+    ``SENDFILE_BACKEND`` setting is ``"xsendfile"`` or ``"xaccel"``, sending the file is offloaded
+    to the front-end server using Apache "X-Sendfile" or Nginx "X-Accel-Redirect" header.
+
+    If ``accept_ranges`` is True, byte range requests are supported when streaming the file. The
+    front-end servers handle range requests of offloaded files themselves.
+    """
+    # Based on: django.views.static.serve
 
     # FIXME: "Content-Disposition" filename is very fragile if contains non-ASCII characters.
     # Current implementation works on Firefox, but probably fails on other browsers. We should test
@@ -41,9 +174,12 @@ def send_file_response(request, path, name, content_type, attachment=True):
     http_header = request.META.get(u'HTTP_IF_MODIFIED_SINCE')
     if not was_modified_since(http_header, statobj.st_mtime, statobj.st_size):
         return HttpResponseNotModified()
-    response = FileResponse(open(path, u'rb'), content_type=content_type)
+    backend = sendfile_backends[getattr(settings, u'SENDFILE_BACKEND', u'stream')]
+    if accept_ranges and backend is _stream_file:
+        response = _stream_file_ranges(request, path, content_type, statobj)
+    else:
+        response = backend(path, content_type, statobj)
     response[u'Last-Modified'] = http_date(statobj.st_mtime)
-    response[u'Content-Length'] = statobj.st_size
     if attachment:
         response[u'Content-Disposition'] = "attachment; filename*=UTF-8''{}".format(urlquote(name))
     return response
@@ -120,7 +120,7 @@ class QuerySet(models.query.QuerySet):
     ``QuerySet`` with common custom methods.
     """
 
-    def bulk_create(self, *args, **kwargs):
+    def bulk_create(self, objs, *args, **kwargs):
         u"""
         Prevents ``bulk_create`` on models that forbid it. Bulk create does not call model
         ``save()`` method nor emit ``pre_save`` and ``post_save`` signals. To prevent using
@@ -132,10 +132,26 @@ class QuerySet(models.query.QuerySet):
                 def save(...):
                      ...
 
+        Models that compute some of their fields in their save method may move the computation to
+        ``prepare_save()`` method instead. Bulk create calls it for every created instance:
+
+            class Book(Model):
+                ...
+                def prepare_save(self, update_fields=None):
+                    ...
+
+                def save(self, *args, **kwargs):
+                    self.prepare_save(kwargs.get(u'update_fields', None))
+                    ...
+
         """
         if getattr(self.model.save, u'prevent_bulk_create', False):
             raise ValueError(u"Can't bulk create {}".format(self.model.__name__))
-        super(QuerySet, self).bulk_create(*args, **kwargs)
+        if hasattr(self.model, u'prepare_save'):
+            objs = list(objs)
+            for obj in objs:
+                obj.prepare_save()
+        super(QuerySet, self).bulk_create(objs, *args, **kwargs)
 
     def get_or_404(self, *args, **kwargs):
         u"""
@@ -160,3 +176,36 @@ class QuerySet(models.query.QuerySet):
         Applies ``func`` on the queryset.
         """
         return func(self)
+
+    def chunked(self, chunk_size=100, pks=None):
+        u"""
+        Iterates over the queryset in chunks of at most ``chunk_size`` objects ordered by their
+        primary keys. Every chunk is fetched by a separate query using keyset pagination on the
+        primary key, so ``prefetch_related`` lookups are applied per chunk and only one chunk of
+        objects with their prefetched relations is kept in memory at a time. Any ordering of the
+        queryset is replaced by ordering by the primary key.
+
+        If ``pks`` are given, only objects with these primary keys are iterated and every chunk
+        query is restricted to the primary keys of the chunk only, instead of the whole list.
+
+        Example:
+            for inforequest in Inforequest.objects.prefetch_related('branch_set').chunked():
+                ...
+        """
+        queryset = self.order_by(u'pk')
+        if pks is not None:
+            pks = sorted(set(pks))
+            for i in range(0, len(pks), chunk_size):
+                for obj in queryset.filter(pk__in=pks[i:i+chunk_size]):
+                    yield obj
+            return
+
+        last = None
+        while True:
+            chunk = queryset if last is None else queryset.filter(pk__gt=last)
+            chunk = list(chunk[:chunk_size])
+            for obj in chunk:
+                yield obj
+            if len(chunk) < chunk_size:
+                return
+            last = chunk[-1].pk
@@ -6,9 +6,10 @@ import json
 from testfixtures import TempDirectory
 
 from django.conf.urls import patterns, url
-from django.http import HttpResponseNotModified, FileResponse
+from django.http import HttpResponse, HttpResponseNotModified, FileResponse
 from django.utils.http import urlquote, urlencode, http_date
 from django.test import TestCase
+from django.test.utils import override_settings
 
 from poleno.utils.http import send_file_response
 from poleno.utils.misc import random_string
@@ -144,3 +145,39 @@ class SendFileResponseTest(TestCase):
         name = random_string(20, chars=u'BａｃòԉíρｓûϻᏧｏｌｒѕìｔãｍｅéӽѵ߀ɭｐèлｕｉｎ.Iüà,ɦëǥｈƅɢïêｇԁSùúâɑｆäｂƃｄｋϳɰյƙｙáFХ-åɋｗ')
         response = self._request_file(path, name)
         self.assertEqual(response[u'Content-Disposition'], u"attachment; filename*=UTF-8''%s" % urlquote(name))
+
+    @override_settings(SENDFILE_BACKEND=u'xsendfile')
+    def test_xsendfile_backend(self):
+        path = self._create_file()
+        response = self._request_file(path, u'thefile.txt')
+        self._check_response(response, HttpResponse, 200)
+        self.assertEqual(response[u'X-Sendfile'], path)
+        self.assertEqual(response[u'Content-Disposition'], u"attachment; filename*=UTF-8''thefile.txt")
+        self.assertIn(u'Last-Modified', response)
+        self.assertEqual(response.content, u'')
+
+    def test_xaccel_backend(self):
+        path = self._create_file(u'dir/my file.tmp')
+        with self.settings(SENDFILE_BACKEND=u'xaccel', SENDFILE_ROOT=self.tempdir.path, SENDFILE_URL=u'/protected/'):
+            response = self._request_file(path)
+        self._check_response(response, HttpResponse, 200)
+        self.assertEqual(response[u'X-Accel-Redirect'], u'/protected/dir/my%20file.tmp')
+        self.assertEqual(response.content, u'')
+
+    def test_xaccel_backend_with_file_outside_root_is_streamed(self):
+        path = self._create_file()
+        with self.settings(SENDFILE_BACKEND=u'xaccel', SENDFILE_ROOT=u'/nonexistent', SENDFILE_URL=u'/protected/'):
+            response = self._request_file(path)
+        self._check_response(response, FileResponse, 200)
+        self.assertNotIn(u'X-Accel-Redirect', response)
+        self._check_content(response, path)
+
+    @override_settings(SENDFILE_BACKEND=u'xsendfile')
+    def test_xsendfile_backend_with_unmodified_file(self):
+        modified_timestamp = 1413500000
+        if_modified_since_timestamp = modified_timestamp + 1000000
+
+        path = self._create_file()
+        os.utime(path, (modified_timestamp, modified_timestamp))
+        response = self._request_file(path, HTTP_IF_MODIFIED_SINCE=http_date(if_modified_since_timestamp))
+        self._check_response(response, HttpResponseNotModified, 304)
@@ -52,6 +52,21 @@ class TestModelsNoBulkModel(models.Model):
     def save(self, *args, **kwargs): # pragma: no cover
         super(TestModelsModel2, self).save(*args, **kwargs)
 
+class TestModelsPreparedModel(models.Model):
+    name = models.CharField(blank=True, max_length=255)
+    upper_name = models.CharField(blank=True, max_length=255)
+    objects = QuerySet.as_manager()
+
+    class Meta:
+        app_label = u'utils'
+
+    def prepare_save(self, update_fields=None):
+        self.upper_name = self.name.upper()
+
+    def save(self, *args, **kwargs): # pragma: no cover
+        self.prepare_save(kwargs.get(u'update_fields', None))
+        super(TestModelsPreparedModel, self).save(*args, **kwargs)
+
 
 class AfterSavedTest(TestCase):
     u"""
@@ -308,6 +323,14 @@ class QuerySetTest(TestCase):
                     ])
         self.assertFalse(obj_set.exists())
 
+    def test_bulk_create_with_prepare_save(self):
+        with created_instances(TestModelsPreparedModel.objects) as obj_set:
+            TestModelsPreparedModel.objects.bulk_create([
+                TestModelsPreparedModel(name=u'aaa'),
+                TestModelsPreparedModel(name=u'bbb'),
+                ])
+        self.assertEqual(sorted(obj_set.values_list(u'upper_name', flat=True)), [u'AAA', u'BBB'])
+
     def test_get_or_404_with_single_result(self):
         res = TestModelsModel.objects.get_or_404(type=TestModelsModel.TYPES.WHITE)
         self.assertEqual(res, self.white)
@@ -324,3 +347,28 @@ class QuerySetTest(TestCase):
         func = lambda q: q.filter(type=TestModelsModel.TYPES.BLACK)
         res = TestModelsModel.objects.apply(func)
         self.assertItemsEqual(res, [self.black1, self.black2])
+
+    def test_chunked(self):
+        with self.assertNumQueries(3):
+            res = list(TestModelsModel.objects.chunked(chunk_size=2))
+        self.assertEqual(res, [self.black1, self.black2, self.white, self.red, self.blue])
+
+    def test_chunked_with_exact_multiple_of_chunk_size(self):
+        with self.assertNumQueries(3):
+            res = list(TestModelsModel.objects.exclude(pk=self.blue.pk).chunked(chunk_size=2))
+        self.assertEqual(res, [self.black1, self.black2, self.white, self.red])
+
+    def test_chunked_ignores_queryset_ordering(self):
+        res = list(TestModelsModel.objects.order_by(u'-name').chunked(chunk_size=2))
+        self.assertEqual(res, [self.black1, self.black2, self.white, self.red, self.blue])
+
+    def test_chunked_with_pks(self):
+        pks = [self.blue.pk, self.black1.pk, self.red.pk, self.blue.pk]
+        with self.assertNumQueries(2):
+            res = list(TestModelsModel.objects.chunked(chunk_size=2, pks=pks))
+        self.assertEqual(res, [self.black1, self.red, self.blue])
+
+    def test_chunked_with_empty_pks(self):
+        with self.assertNumQueries(0):
+            res = list(TestModelsModel.objects.chunked(pks=[]))
+        self.assertEqual(res, [])
@@ -1,12 +1,12 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
 import mock
-from datetime import date
+from datetime import date, timedelta
 
 from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase
 
-from poleno.workdays.workdays import between, HolidaySet, FixedHoliday, EasterHoliday, SPECIFY_HOLIDAY_SET_ERROR
+from poleno.workdays.workdays import between, advance, HolidaySet, FixedHoliday, EasterHoliday, WorkdayCalendar, SPECIFY_HOLIDAY_SET_ERROR
 
 class WorkdaysTest(TestCase):
     u"""
@@ -185,3 +185,56 @@ class WorkdaysTest(TestCase):
         # 2019-04-22 MON: fixed day holiday
         # 2019-04-23 TUE: easter based holiday
         self.assertEqual(between(date(2019, 4, 20), date(2019, 4, 23), holidays), 0) # SAT -- TUE
+
+class WorkdayCalendarTest(TestCase):
+    u"""
+    Tests ``WorkdayCalendar`` class and ``advance()`` function.
+    """
+
+    def _create_holidays(self, **kwargs):
+        return HolidaySet(
+                FixedHoliday(month=10, day=8, first_year=2008),
+                FixedHoliday(month=10, day=10),
+                EasterHoliday(days=2),
+                **kwargs)
+
+    def test_holiday_set_calendar_is_cached(self):
+        holidays = self._create_holidays(calendar_years=(2010, 2020))
+        self.assertIsInstance(holidays.calendar, WorkdayCalendar)
+        self.assertIs(holidays.calendar, holidays.calendar)
+        self.assertEqual(holidays.calendar.first_day, date(2010, 1, 1))
+        self.assertEqual(holidays.calendar.last_day, date(2020, 12, 31))
+
+    def test_between_inside_and_outside_calendar_range(self):
+        holidays = self._create_holidays(calendar_years=(2010, 2020))
+        # 2014-10-08 WED: holiday; 2014-10-10 FRI: holiday
+        self.assertEqual(between(date(2014, 10, 7), date(2014, 10, 14), holidays), 3) # TUE -- TUE
+        self.assertEqual(between(date(2014, 10, 14), date(2014, 10, 7), holidays), -3) # TUE -- TUE
+        # Crossing the range boundary and completely outside the range
+        self.assertEqual(between(date(2020, 10, 7), date(2021, 10, 7), holidays), 259)
+        self.assertEqual(between(date(2006, 10, 7), date(2006, 10, 10), holidays), 1) # SAT -- TUE
+
+    def test_calendar_agrees_with_direct_computation(self):
+        narrow = self._create_holidays(calendar_years=(2013, 2015))
+        wide = self._create_holidays(calendar_years=(2000, 2030))
+        first = date(2012, 10, 1)
+        for a in range(0, 3*365, 17):
+            for b in range(0, 3*365, 23):
+                after = first + timedelta(days=a)
+                before = first + timedelta(days=b)
+                self.assertEqual(between(after, before, narrow), between(after, before, wide))
+            for delta in range(-40, 40, 3):
+                day = first + timedelta(days=a)
+                self.assertEqual(advance(day, delta, narrow), advance(day, delta, wide))
+
+    def test_advance(self):
+        holidays = self._create_holidays()
+        # 2014-10-08 WED: holiday; 2014-10-10 FRI: holiday
+        self.assertEqual(advance(date(2014, 10, 7), 0, holidays), date(2014, 10, 7))
+        self.assertEqual(advance(date(2014, 10, 7), 1, holidays), date(2014, 10, 9)) # TUE -> THU
+        self.assertEqual(advance(date(2014, 10, 7), 2, holidays), date(2014, 10, 13)) # TUE -> MON
+        self.assertEqual(advance(date(2014, 10, 13), -1, holidays), date(2014, 10, 12)) # MON -> SUN
+        self.assertEqual(advance(date(2014, 10, 13), -2, holidays), date(2014, 10, 8)) # MON -> WED
+        for delta in range(-30, 30):
+            day = date(2014, 10, 7)
+            self.assertEqual(between(day, advance(day, delta, holidays), holidays), delta)
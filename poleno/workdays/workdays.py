@@ -1,16 +1,22 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+import array
+import bisect
 import datetime
 from dateutil.easter import easter
 
 from django.core.exceptions import ImproperlyConfigured
 from django.conf import settings
+from django.utils.functional import cached_property
 from django.utils.importlib import import_module
 from poleno.utils.misc import FormatMixin
 
 
 WEEKEND = [5, 6]
 
+# Default range of years covered by the precomputed ``WorkdayCalendar`` of a ``HolidaySet``.
+CALENDAR_YEARS = (2000, 2050)
+
 SPECIFY_HOLIDAY_SET_ERROR = u'Specify holiday_set or set global setting HOLIDAYS_MODULE_PATH.'
 
 def _holidays():
@@ -67,11 +73,13 @@ class EasterHoliday(FormatMixin, Holiday):
         return u'days={}'.format(self.days)
 
 class HolidaySet(FormatMixin, object):
-    def __init__(self, *args):
+    def __init__(self, *args, **kwargs):
         u"""
-        Accepts Holiday objects
+        Accepts Holiday objects. Optional ``calendar_years`` keyword argument specifies the
+        ``(first_year, last_year)`` range covered by the precomputed workday calendar.
         """
         self.holidays = args
+        self.calendar_years = kwargs.pop(u'calendar_years', CALENDAR_YEARS)
 
     def between(self, after, before):
         u"""
@@ -80,32 +88,95 @@ class HolidaySet(FormatMixin, object):
         return set(d for h in self.holidays
                      for d in h.between(after, before))
 
+    @cached_property
+    def calendar(self):
+        u"""
+        Workday calendar index built lazily on the first use and shared by all subsequent calls.
+        """
+        first_year, last_year = self.calendar_years
+        return WorkdayCalendar(self, first_year, last_year)
+
     def __unicode__(self):
         return u', '.join(format(h) for h in self.holidays)
 
-
-def between(after, before, holiday_set=None):
+class WorkdayCalendar(FormatMixin, object):
     u"""
-    Returns number of working days between ``after`` and ``before`` excluding ``after`` and
-    including ``before``. If ``a`` is the day we submitted something and ``b`` is today, then today
-    is the last full day of a ``d`` days long deadline if: ``between(a, b) == d``, and the deadline
-    is missed if: ``between(a, b) > d``.
-
-    The following invariants hold:
-        between(a, a) == 0
-        between(a, b) == -between(b, a)
-        between(a, b) == between(a, x) + between(x, b)
-        between(a, a+1) == 1 iff a+1 is workday; 0 otherwise
+    Precomputed index of workdays from ``first_year`` to ``last_year`` inclusive. For every day in
+    the range the index stores the number of workdays since the first day of the range, so
+    ``between()`` is a difference of two array items and ``advance()`` is a binary search.
+    Queries outside the range fall back to computing the result from the holiday set directly.
     """
-    if after == before:
-        return 0
-    if after > before:
-        return -between(before, after, holiday_set)
 
+    def __init__(self, holiday_set, first_year, last_year):
+        self.holiday_set = holiday_set
+        self.first_day = datetime.date(first_year, 1, 1)
+        self.last_day = datetime.date(last_year, 12, 31)
+        self._first_ordinal = self.first_day.toordinal()
+
+        holidays = holiday_set.between(self.first_day, self.last_day)
+        self._index = array.array('l', [0])
+        count = 0
+        for d in range(1, (self.last_day - self.first_day).days + 1):
+            day = self.first_day + datetime.timedelta(days=d)
+            if day.weekday() not in WEEKEND and day not in holidays:
+                count += 1
+            self._index.append(count)
+
+    def _position(self, day):
+        pos = day.toordinal() - self._first_ordinal
+        if 0 <= pos < len(self._index):
+            return pos
+        return None
+
+    def between(self, after, before):
+        u"""
+        Same as ``workdays.between()`` for the holiday set of the calendar.
+        """
+        after_pos = self._position(after)
+        before_pos = self._position(before)
+        if after_pos is None or before_pos is None:
+            return _between(after, before, self.holiday_set)
+        return self._index[before_pos] - self._index[after_pos]
+
+    def advance(self, day, delta):
+        u"""
+        Same as ``workdays.advance()`` for the holiday set of the calendar.
+        """
+        if delta == 0:
+            return day
+        pos = self._position(day)
+        if pos is None:
+            return _advance(day, delta, self.holiday_set)
+
+        # Forward we look for the first day with ``delta`` more workdays, backward for the last day
+        # with ``-delta`` less workdays. Both exist iff the searched count is within the index.
+        target = self._index[pos] + delta
+        if delta > 0:
+            res = bisect.bisect_left(self._index, target, pos)
+            if res == len(self._index):
+                return _advance(day, delta, self.holiday_set)
+        else:
+            res = bisect.bisect_right(self._index, target, 0, pos) - 1
+            if res < 0:
+                return _advance(day, delta, self.holiday_set)
+        return self.first_day + datetime.timedelta(days=res)
+
+    def __unicode__(self):
+        return u'{} -- {}'.format(self.first_day, self.last_day)
+
+
+def _get_holiday_set(holiday_set):
     if not holiday_set:
         holiday_set = _holidays()
     if not holiday_set:
         raise ImproperlyConfigured(SPECIFY_HOLIDAY_SET_ERROR)
+    return holiday_set
+
+def _between(after, before, holiday_set):
+    if after == before:
+        return 0
+    if after > before:
+        return -_between(before, after, holiday_set)
 
     # Having: after < before
     days = (before - after).days
@@ -116,11 +187,41 @@ def between(after, before, holiday_set=None):
                   if d.weekday() not in WEEKEND])
     return res
 
+def _advance(day, delta, holiday_set):
+    if delta == 0:
+        return day
+
+    res = day + datetime.timedelta(days=delta)
+    working = _between(day, res, holiday_set)
+    return _advance(res, delta - working, holiday_set)
+
+def between(after, before, holiday_set=None):
+    u"""
+    Returns number of working days between ``after`` and ``before`` excluding ``after`` and
+    including ``before``. If ``a`` is the day we submitted something and ``b`` is today, then today
+    is the last full day of a ``d`` days long deadline if: ``between(a, b) == d``, and the deadline
+    is missed if: ``between(a, b) > d``.
+
+    The result is looked up in the precomputed calendar of the holiday set in O(1) time. Only dates
+    outside the calendar range are computed from the holidays directly.
+
+    The following invariants hold:
+        between(a, a) == 0
+        between(a, b) == -between(b, a)
+        between(a, b) == between(a, x) + between(x, b)
+        between(a, a+1) == 1 iff a+1 is workday; 0 otherwise
+    """
+    if after == before:
+        return 0
+    holiday_set = _get_holiday_set(holiday_set)
+    return holiday_set.calendar.between(after, before)
+
 def advance(day, delta, holiday_set=None):
     u"""
-    Advances the given ``date`` by ``delta`` working days. The function time complexity is
-    O(d log d), where d is ``delta``. It may be fixed to be O(d), but I'm too lazy to do it now.
-    The complexity may not be better than Ω(d) because there are Ω(d) holidays.
+    Advances the given ``date`` by ``delta`` working days. Within the precomputed calendar range of
+    the holiday set the result is found by binary search in O(log n) time, where n is the size of
+    the calendar. Outside the range the function falls back to computing it from the holidays
+    directly in O(d log d) time, where d is ``delta``.
 
     The following invariants hold:
         advance(a, 0) == a
@@ -130,12 +231,5 @@ def advance(day, delta, holiday_set=None):
     """
     if delta == 0:
         return day
-
-    if not holiday_set:
-        holiday_set = _holidays()
-    if not holiday_set:
-        raise ImproperlyConfigured(SPECIFY_HOLIDAY_SET_ERROR)
-
-    res = day + datetime.timedelta(days=delta)
-    working = between(day, res, holiday_set)
-    return advance(res, delta - working, holiday_set)
+    holiday_set = _get_holiday_set(holiday_set)
+    return holiday_set.calendar.advance(day, delta)